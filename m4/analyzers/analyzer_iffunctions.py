@@ -5,6 +5,8 @@ Authors
 
 import os
 import logging
+import hashlib
+from collections import OrderedDict
 import h5py
 from astropy.io import fits as pyfits
 import numpy as np
@@ -12,6 +14,7 @@ from m4.ground import read_data
 from m4.ground.read_data import InterferometerConverter
 from m4.utils.influence_functions_maker import IFFunctionsMaker
 from m4.utils.roi import ROI
+from m4.utils.svd_reconstructor import SvdReconstructor
 from m4.utils.image_reducer import TipTiltDetrend
 from m4.configuration import config_folder_names as fold_name
 
@@ -39,6 +42,12 @@ class AnalyzerIFF():
         self._cube = None
         self._rec = None
         self._intMat = None
+        self._rCond = None
+        self._recCache = OrderedDict()
+        self._recCacheSize = 4
+        self._svdCache = OrderedDict()
+        self._svdMask = None
+        self._svdUpdatePixels = 1000
         self._analysisMask = None
         self._cubeMeasure = None
 
@@ -89,6 +98,12 @@ class AnalyzerIFF():
         '''
         return self._cube
 
+    def close(self):
+        '''
+        Close the file of the cube read lazily by loadAnalyzer
+        '''
+        read_data.closeMaskedCube(self._cube)
+
     def getMasterMask(self):
         '''
         Returns
@@ -97,7 +112,7 @@ class AnalyzerIFF():
                             product of the masks of the cube
         '''
         aa = np.sum(self._cube.mask.astype(int), axis=2)
-        master_mask = np.zeros(aa.shape, dtype=np.bool)
+        master_mask = np.zeros(aa.shape, dtype=bool)
         master_mask[np.where(aa > 0)] = True
         return master_mask
 
@@ -180,36 +195,62 @@ class AnalyzerIFF():
         else:
             data_file_path = data_file_path
         list = self._createOrdListFromFilePath(data_file_path)
+        file_list = [list[i] for i in self._frameIndices()]
+        # each chunk holds the template frames of one push pull
+        chunks = read_data.FrameLoader(file_list).chunks(self._template.shape[0])
+        return self._createCubeFromChunks(chunks, tiptilt_detrend)
+
+    def createCubeFromFrames(self, frames, tiptilt_detrend=None):
+        '''
+        Same as createCubeFromImageFolder for frames already in memory
+        (e.g. to analyze the same frames with different templates)
+
+        Parameters
+        ----------
+                frames: masked array [number of images, pixels, pixels]
+                        frames in acquisition order
+
+        Returns
+        -------
+                cube = masked array [pixels, pixels, number of images]
+                        cube from analysis
+        '''
+        ntemplate = self._template.shape[0]
+        idx = np.array(self._frameIndices())
+        chunks = (frames[idx[i:i + ntemplate]]
+                  for i in range(0, idx.size, ntemplate))
+        return self._createCubeFromChunks(chunks, tiptilt_detrend)
+
+    def _frameIndices(self):
+        """ Indices of the frames of each push pull, ordered by actuator """
+        where = self._indexReorganization()
+        ntemplate = self._template.shape[0]
+        indices = []
+        for i in range(self._actsVector.shape[0]):
+            for k in range(self._nPushPull):
+                n = where[self._nPushPull * i + k]
+                mis = k * self._indexingList.shape[1] * ntemplate \
+                        + n * ntemplate
+                indices.extend(range(mis, mis + ntemplate))
+        return indices
 
+    def _createCubeFromChunks(self, chunks, tiptilt_detrend=None):
         where = self._indexReorganization()
         ampl_reorg = self._amplitudeReorganization(self._actsVector,
                                                    self._indexingList,
                                                    self._cmdAmplitude,
                                                    self._nPushPull)
-        cube_all_act = []
+        builder = read_data.CubeBuilder(self._actsVector.shape[0])
         for i in range(self._actsVector.shape[0]):
             print(i)
+            push_pull = read_data.CubeBuilder(self._nPushPull)
             for k in range(self._nPushPull):
                 p = self._nPushPull * i + k
                 n = where[p]
                 mis_amp = k* self._indexingList.shape[1] + n
-                mis = k * self._indexingList.shape[1] * self._template.shape[0] \
-                        + n * self._template.shape[0]
-
-                #name = 'img_%04d' %mis
-                #file_name = os.path.join(data_file_path, name)
-                file_name = list[mis]
-                image0 = self._imageReader(file_name)
-
-#                 image_sum = np.zeros((image_for_dim.shape[0],
-#                                       image_for_dim.shape[1]))
-                image_list = [image0]
-                for l in range(1, self._template.shape[0]):
-                    #name = 'img_%04d' %(mis+l)
-                    #file_name = os.path.join(data_file_path, name)
-                    file_name = list[mis+l]
-                    ima = self._imageReader(file_name)
-                    image_list.append(ima)
+
+                image_list = next(chunks)
+                image0 = image_list[0]
 
                 image = np.zeros((image0.shape[0], image0.shape[1]))
                 for p in range(1, len(image_list)):
@@ -233,21 +274,16 @@ class AnalyzerIFF():
                     tt = TipTiltDetrend()
                     img_if = tt.segment_view_tiptilt_detrend(img_if)
 
-                if_push_pull_kth = img_if
-
-                if k == 0:
-                    all_push_pull_act_jth = if_push_pull_kth
-                else:
-                    all_push_pull_act_jth = np.ma.dstack((all_push_pull_act_jth,
-                                                          if_push_pull_kth))
+                push_pull.setFrame(k, img_if)
 
             if self._nPushPull == 1:
-                if_act_jth = all_push_pull_act_jth
+                if_act_jth = push_pull.cube()[:, :, 0]
             else:
-                if_act_jth = np.ma.mean(all_push_pull_act_jth, axis=2)
+                if_act_jth = np.ma.mean(push_pull.cube(), axis=2)
 
-            cube_all_act.append(if_act_jth)
-        self._cube = np.ma.dstack(cube_all_act)
+            builder.setFrame(i, if_act_jth)
+        self._cube = builder.cube()
+        self.clearReconstructorCache()
         return self._cube
 
     def _imageReader(self, filename):
@@ -294,8 +330,7 @@ class AnalyzerIFF():
         if fits_or_h5 == 0:
             header = pyfits.Header()
             header['NPUSHPUL'] = self._nPushPull
-            pyfits.writeto(file_name, self._cube.data, header)
-            pyfits.append(file_name, self._cube.mask.astype(int))
+            read_data.saveMaskedCube(file_name, self._cube, header)
             pyfits.append(file_name, self._cmdAmplitude)
             pyfits.append(file_name, self._actsVector)
         else:
@@ -310,7 +345,8 @@ class AnalyzerIFF():
 
     @staticmethod
     def loadAnalyzer(file_name, fits_or_h5=0):
-        """ Creates the object using information contained in Cube
+        """ Creates the object using information contained in Cube.
+        The fits cube is read lazily: call close when the analysis is over
 
         Parameters
         ----------
@@ -324,12 +360,11 @@ class AnalyzerIFF():
         """
         theObject = AnalyzerIFF()
         if fits_or_h5 == 0:
-            header = pyfits.getheader(file_name)
-            hduList = pyfits.open(file_name)
-            cube = np.ma.masked_array(hduList[0].data,
-                                      hduList[1].data.astype(bool))
-            acts_vector = hduList[3].data
-            cmd_amplitude = hduList[2].data
+            cube = read_data.readMaskedCube(file_name)
+            with pyfits.open(file_name) as hduList:
+                header = hduList[0].header
+                acts_vector = np.array(hduList[3].data)
+                cmd_amplitude = np.array(hduList[2].data)
             try:
                 n_push_pull = header['NPUSHPUL']
             except KeyError:
@@ -339,6 +374,7 @@ class AnalyzerIFF():
             theObject._cmdAmplitude = cmd_amplitude
             theObject._nPushPull = n_push_pull
             theObject._cube = cube
+            theObject._h5Folder = os.path.dirname(os.path.abspath(file_name))
         else:
             hf = h5py.File(file_name, 'r')
             hf.keys()
@@ -362,11 +398,13 @@ class AnalyzerIFF():
                 analysis_mask: numpy array [pixels, pixels]
         '''
         self._analysisMask = analysis_mask
+        self._intMat = None
+        self._rec = None
 
     def setAnalysisMaskFromMasterMask(self):
         ''' Set the analysis mask using the master mask of analysis cube
         '''
-        self._analysisMask = self.getMasterMask()
+        self.setAnalysisMask(self.getMasterMask())
 
     def setDetectorMask(self, mask_from_ima):
         ''' Set the detector mask chosen
@@ -375,9 +413,9 @@ class AnalyzerIFF():
         ----------
         detector_mask: numpy array [pixels, pixels]
         '''
-        self._analysisMask = None
-        self._rec = None
         self._analysisMask = mask_from_ima
+        self._intMat = None
+        self._rec = None
 
     def getAnalysisMask(self):
         '''
@@ -387,27 +425,122 @@ class AnalyzerIFF():
         '''
         return self._analysisMask
 
-    def _getMaskedInfluenceFunction(self, idx_influence_function):
-        return np.ma.array(self.getCube()[:, :, idx_influence_function],
-                           mask=self.getAnalysisMask())
-
     def _createInteractionMatrix(self):
         if self._analysisMask is None:
             self.setAnalysisMaskFromMasterMask()
-        n_acts_in_cube = self.getCube().shape[2]
-        n_interferometer_pixels_in_mask = \
-                    self._getMaskedInfluenceFunction(0).compressed().shape[0]
-        self._intMat = np.zeros((n_interferometer_pixels_in_mask,
-                                 n_acts_in_cube))
-        for i in range(n_acts_in_cube):
-            self._intMat[:, i] = \
-                            self._getMaskedInfluenceFunction(i).compressed()
+        rows, cols = np.nonzero(np.invert(self.getAnalysisMask()))
+        # one gather [pixels in mask, number of images] in compressed order
+        self._intMat = np.array(self.getCube().data[rows, cols, :],
+                                dtype=float)
+
+    def _maskKey(self):
+        return self._maskKeyOf(self.getAnalysisMask())
+
+    @staticmethod
+    def _maskKeyOf(mask):
+        mask = np.asarray(mask, dtype=bool)
+        return (mask.shape, hashlib.sha1(np.packbits(mask)).hexdigest())
 
     def _createSurfaceReconstructor(self, rCond=1e-15):
-        self._rec = self._createRecWithPseudoInverse(rCond)
+        if self._analysisMask is None:
+            self.setAnalysisMaskFromMasterMask()
+        key = (self._maskKey(), rCond)
+        entry = self._recCache.pop(key, None)
+        if entry is None:
+            entry = (self.getInteractionMatrix(),
+                     self._createRecWithPseudoInverse(rCond))
+            for mat in entry:
+                mat.flags.writeable = False
+            while len(self._recCache) >= self._recCacheSize:
+                self._recCache.popitem(last=False)
+        self._recCache[key] = entry
+        self._intMat, self._rec = entry
+        self._rCond = rCond
 
     def _createRecWithPseudoInverse(self, rCond):
-        return np.linalg.pinv(self.getInteractionMatrix(), rcond=rCond)
+        return self.getSvdReconstructor().reconstructor(rcond=rCond)
+
+    def getSvdReconstructor(self):
+        '''
+        The decomposition is read from the tracking number folder if it
+        has been saved for the analysis mask, obtained with a low rank
+        update if the mask differs from the previous one for a few pixels,
+        computed otherwise
+
+        Returns
+        -------
+                svd: object
+                    SvdReconstructor of the interaction matrix
+        '''
+        if self._analysisMask is None:
+            self.setAnalysisMaskFromMasterMask()
+        key = self._maskKey()
+        svd = self._svdCache.pop(key, None)
+        if svd is None:
+            svd = self._loadSvd(key)
+        if svd is None:
+            svd = self._updateSvd()
+        while len(self._svdCache) >= self._recCacheSize:
+            self._svdCache.popitem(last=False)
+        self._svdCache[key] = svd
+        self._svdMask = np.array(self.getAnalysisMask(), dtype=bool)
+        return svd
+
+    def saveSvdReconstructor(self):
+        '''
+        Save the decomposition for the analysis mask in the tracking
+        number folder
+
+        Returns
+        -------
+                file_name: string
+                    fits file path
+        '''
+        svd = self.getSvdReconstructor()
+        file_name = self._svdFileName(self._maskKey())
+        header = pyfits.Header()
+        header['MASKHASH'] = self._maskKey()[1]
+        svd.save(file_name, header)
+        return file_name
+
+    def _svdFileName(self, key):
+        if self._h5Folder is None:
+            return None
+        return os.path.join(self._h5Folder, 'SVD_%s.fits' % key[1][:16])
+
+    def _loadSvd(self, key):
+        file_name = self._svdFileName(key)
+        if file_name is None or not os.path.isfile(file_name):
+            return None
+        if pyfits.getheader(file_name).get('MASKHASH') != key[1]:
+            return None
+        self._logger.info('Reading SVD from %s', file_name)
+        return SvdReconstructor.load(file_name, self.getInteractionMatrix())
+
+    def _updateSvd(self):
+        mask = np.asarray(self.getAnalysisMask(), dtype=bool)
+        old = self._svdMask
+        if old is not None and old.shape == mask.shape:
+            old_svd = self._svdCache.get(self._maskKeyOf(old))
+            removed = np.invert(old) & mask
+            added = old & np.invert(mask)
+            if old_svd is not None and \
+                    0 < removed.sum() + added.sum() <= self._svdUpdatePixels:
+                # rows in the raster order of the valid pixels
+                return old_svd.update(self.getInteractionMatrix(),
+                                      np.invert(mask[np.invert(old)]),
+                                      old[np.invert(mask)])
+        return SvdReconstructor(self.getInteractionMatrix())
+
+    def clearReconstructorCache(self):
+        ''' Remove the interaction matrices and reconstructors computed
+        for the previous analysis masks
+        '''
+        self._recCache.clear()
+        self._svdCache.clear()
+        self._svdMask = None
+        self._intMat = None
+        self._rec = None
 
     def getInteractionMatrix(self):
         '''
@@ -420,13 +553,21 @@ class AnalyzerIFF():
             self._createInteractionMatrix()
         return self._intMat
 
-    def getReconstructor(self):
+    def getReconstructor(self, rCond=1e-15):
         '''
+        Reconstructors are cached for the last analysis masks used, so
+        that setting again the same mask does not compute them again
+
+        Parameters
+        ----------
+                rCond: float
+                    cutoff for small singular values
+
         Returns
         -------
                 rec = numpy array
                     reconstructor calculated as pseudo inverse of the interaction matrix
         '''
-        if self._rec is None:
-            self._createSurfaceReconstructor()
+        if self._rec is None or self._rCond != rCond:
+            self._createSurfaceReconstructor(rCond)
         return self._rec
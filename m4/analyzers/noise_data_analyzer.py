@@ -5,7 +5,9 @@ Authors
 
 import os
 import logging
+import tempfile
 import glob
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import numpy as np
 from astropy.io import fits as pyfits
 from m4.ground import tracking_number_folder
@@ -73,7 +75,7 @@ class Noise():
         else:
             an._nPushPull = n_push_pull
         if actsVector is None:
-            n_acts = np.int(n_tot / (an._template.size * an._nPushPull))
+            n_acts = int(n_tot / (an._template.size * an._nPushPull))
             an._actsVector = np.arange(n_acts)
             an._modeVector = np.copy(an._actsVector)
         else:
@@ -116,15 +118,15 @@ class Noise():
                 tt: string
                     tracking number of measurements made
         '''
-        an = self._defAnalyzer(data_file_path, tidy_or_shuffle, template, actsVector, n_push_pull)
+        an = self._defAnalyzer(data_file_path, tidy_or_shuffle, template,
+                               n_push_pull, actsVector)
 
         dove, tt = tracking_number_folder.createFolderToStoreMeasurements(self._storageFolder())
 
         self._logger.info('Creating analysis in %s', tt)
         self._cubeFromAnalysis = an.createCubeFromImageFolder(data_file_path)
         fits_file_name = os.path.join(dove, 'Cube.fits')
-        pyfits.writeto(fits_file_name, self._cubeFromAnalysis.data)
-        pyfits.append(fits_file_name, self._cubeFromAnalysis.mask.astype(int))
+        read_data.saveMaskedCube(fits_file_name, self._cubeFromAnalysis)
 
         self._saveInfo(dove, tidy_or_shuffle, an._template, an._actsVector, an._nPushPull)
 
@@ -132,6 +134,72 @@ class Noise():
         self._saveResults(rms_mean, quad_mean, ptv_mean, dove)
         return tt
 
+    def noise_analysis_multi_template(self, data_file_path, tidy_or_shuffle,
+                                      template_list, n_push_pull=None,
+                                      actsVector=None, nthreads=4,
+                                      memmap_folder=None):
+        '''
+        Same results of noise_analysis_from_hdf5_folder for each template
+        followed by different_template_analyzer, reading the frames only
+        once and without saving the cubes
+
+        Parameters
+        ----------
+            data_file_path: string
+                            measurement data folder
+            tidy_or_shuffle: int
+                            0 for tidy, 1 for shuffle
+            template_list: list
+                    list of vectors composed by 1 and -1
+        Other Parameters
+        ----------------
+            actsVector: numpy array, optional
+                        vector of actuators or modes
+            n_push_pull: int
+                        number of push pull
+            nthreads: int
+                        number of templates analyzed at the same time
+            memmap_folder: string
+                        folder where the frames are memory mapped (with
+                        their own dtype). If None a temporary folder in
+                        the noise results folder is used and removed
+
+        Returns
+        -------
+            rms_medio: numpy array
+                     vector of mean rms (one for each template)
+            quad: numpy array
+                     vector of mean tip tilt (one for each template)
+            n_tempo: numpy array
+                    vector of the length of the templates used
+            ptv_medio: numpy array
+                     vector of mean PtV (one for each template)
+        '''
+        if memmap_folder is None:
+            # the whole burst does not fit in memory
+            with tempfile.TemporaryDirectory(dir=Noise._storageFolder()) as folder:
+                return self.noise_analysis_multi_template(
+                    data_file_path, tidy_or_shuffle, template_list,
+                    n_push_pull, actsVector, nthreads, folder)
+        lista = AnalyzerIFF()._createOrdListFromFilePath(data_file_path)
+        builder = read_data.CubeBuilder(len(lista), memmap_folder=memmap_folder)
+        frames = np.moveaxis(builder.map(read_data.read_phasemap, lista,
+                                         nthreads=8), -1, 0)
+
+        def analyze(template):
+            an = self._defAnalyzer(data_file_path, tidy_or_shuffle, template,
+                                   n_push_pull, actsVector)
+            return self._rmsFromCube(an.createCubeFromFrames(frames))
+
+        with ThreadPoolExecutor(nthreads) as pool:
+            results = list(pool.map(analyze, template_list))
+        del frames, builder
+        rms_medio = np.array([r[0] for r in results])
+        quad = np.array([r[1] for r in results])
+        n_temp = np.array([np.size(template) for template in template_list])
+        ptv_medio = np.array([r[3] for r in results])
+        return rms_medio, quad, n_temp, ptv_medio
+
     def _rmsFromCube(self, cube_to_process):
         '''
         Parameters
@@ -256,9 +324,7 @@ class Noise():
         store_in_folder = Noise._storageFolder()
         file_path = os.path.join(store_in_folder, tt)
         fits_file_name = os.path.join(file_path, 'Cube.fits')
-        hduList = pyfits.open(fits_file_name)
-        self._cubeFromAnalysis = np.ma.masked_array(hduList[0].data,
-                                                    hduList[1].data.astype(bool))
+        self._cubeFromAnalysis = read_data.readMaskedCube(fits_file_name)
         return self._cubeFromAnalysis
 
     def _readTempFromInfoFile(self, tt):
@@ -300,7 +366,10 @@ class Noise():
         for tt in tt_list:
             cube = self._readCube(tt)
             n_temp = self._readTempFromInfoFile(tt)
-            rms, quad, tilt, ptv = self._rmsFromCube(cube)
+            try:
+                rms, quad, tilt, ptv = self._rmsFromCube(cube)
+            finally:
+                read_data.closeMaskedCube(cube)
             rms_list.append(rms)
             quad_list.append(quad)
             tilt_list.append(tilt)
@@ -362,7 +431,8 @@ class Noise():
 
 
 
-    def analysis_whit_structure_function(self, data_file_path, tau_vector, h5_or_fits=None, nzern=None):
+    def analysis_whit_structure_function(self, data_file_path, tau_vector,
+                                         nzern=None, nprocs=None):
         '''
         .. 4000 = total number of image in hdf5
 
@@ -375,12 +445,12 @@ class Noise():
 
         Other Parameters
         ----------------
-        h5_or_fits: None
-            if it is none the .h5 or .4D data analysis is performed
-            else the fits analysis is performed
         nzern: int
             if None first three zernike are are subtracted from the differential image
             else the number specified
+        nprocs: int
+            if not None the zernike fits of the differences are computed
+            by a pool of nprocs processes
 
         Returns
         -------
@@ -390,18 +460,6 @@ class Noise():
                      squaring sum of tip and tilt calculated on the difference
                     of the images
         '''
-        #if h5_or_fits is None:
-        #    lista = glob.glob(os.path.join(data_file_path, '*.h5'))
-        #    if len(lista)==0:
-        #        lista = glob.glob(os.path.join(data_file_path,'*.4D'))
-        #    lista.sort()
-        #else:
-        #    listtot = glob.glob(os.path.join(data_file_path, '*.fits'))
-        #    listtot.sort()
-        #    lista = listtot[0:-2]
-        #print(lista)
-
-
         lista = self._createOrdListFromFilePath(data_file_path)
         if nzern is None:
             zv= np.arange(3)+1
@@ -409,54 +467,96 @@ class Noise():
             zv=np.arange(nzern)+1
 
         image_number = len(lista)
-        i_max = np.int((image_number - tau_vector[tau_vector.shape[0]-1]) /
-                       (tau_vector[tau_vector.shape[0]-1] * 2))
+        i_max = int((image_number - tau_vector[tau_vector.shape[0]-1]) /
+                    (tau_vector[tau_vector.shape[0]-1] * 2))
         if i_max <= 10:
             print("Warning low sampling...")
         #    raise OSError('tau = %s too large. i_max = %d' %(tau_vector[tau_vector.shape[0]-1], i_max))
-        rms_medio_list = []
-        quad_med_list = []
-        for j in range(tau_vector.shape[0]):
-            dist = tau_vector[j]
-            print(dist)
-            rms_list = []
-            quad_list = []
-            for i in range(i_max):
-                k = i * dist * 2
-                if h5_or_fits is None:
-                    #k = i * dist * 2
-                    #name = 'img_%04d' %k
-                    #file_name = os.path.join(data_file_path, name)
-                    image_k = image = read_data.read_phasemap(lista[k])
-                    #name = 'img_%04d' %(k+dist)
-                    #file_name = os.path.join(data_file_path, name)
-                    image_dist = image = read_data.read_phasemap(lista[k+dist])
-                else:
-                    image_k = read_data.readFits_maskedImage(lista[k])
-                    image_dist = read_data.readFits_maskedImage(lista[k+dist])
-
-                image_diff = image_k - image_dist
-                zernike_coeff_array, mat = zernike.zernikeFit(image_diff, zv)
-                sur = zernike.zernikeSurface(image_diff, zernike_coeff_array, mat)
-                image_ttr = image_diff - sur
-                quad = np.sqrt(zernike_coeff_array[0]**2 + zernike_coeff_array[1]**2)
-
-                rms = image_ttr.std()
-                rms_list.append(rms)
-                quad_list.append(quad)
-            rms_vector = np.array(rms_list)
-            aa = rms_vector.mean()
-            rms_medio_list.append(aa)
-            quad_med_list.append(np.array(quad_list).mean())
-        rms_medio = np.array(rms_medio_list)
-        quad_med = np.array(quad_med_list)
+        rms_list, quad_list = self._structureFunction(lista, tau_vector, i_max,
+                                                      zv, nprocs)
+        rms_medio = np.array([rms.mean() for rms in rms_list])
+        quad_med = np.array([quad.mean() for quad in quad_list])
 
         # per calcolo statistical amplitude of convention
-        n_meas = rms_vector.shape[0] * 2 * tau_vector.shape[0]
+        n_meas = max(i_max, 0) * 2 * tau_vector.shape[0]
 
         return rms_medio, quad_med, n_meas
     # plot(tau_vector, rms, '-o'); plt.xlabel('tau'); plt.ylabel('rms_medio')
 
+    def _structureFunction(self, lista, tau_vector, i_max, zv, nprocs=None,
+                           batch=20):
+        ''' Rms of the residual and tip tilt of the differences
+        image[k] - image[k + tau] with k = i * tau * 2 for all the tau,
+        reading each frame only once in a single pass over lista.
+        The differences of all the tau are analyzed together in groups of
+        batch, so that only the frames still needed by a pair and batch
+        differences are kept in memory (with nprocs at most 2 * nprocs
+        groups are waiting for the processes)
+        '''
+        # frame k + tau closes the pairs (j, k) of tau_vector[j]
+        pairs = {}
+        starts = {}
+        for j, dist in enumerate(tau_vector):
+            for i in range(i_max):
+                k = int(i * dist * 2)
+                pairs.setdefault(k + int(dist), []).append((j, k))
+                starts[k] = starts.get(k, 0) + 1
+        needed = sorted(set(pairs) | set(starts))
+
+        pool = ProcessPoolExecutor(nprocs) if nprocs is not None else None
+        pending = []
+        results = []
+        resolved = [0]
+
+        def wait(n_waiting):
+            while len(results) - resolved[0] > n_waiting:
+                js, future = results[resolved[0]]
+                results[resolved[0]] = (js, future.result())
+                resolved[0] += 1
+
+        def flush():
+            js = [j for j, diff in pending]
+            cube = np.ma.stack([diff for j, diff in pending])
+            del pending[:]
+            if pool is None:
+                results.append((js, _lagStatistics(cube, zv)))
+            else:
+                results.append((js, pool.submit(_lagStatistics, cube, zv)))
+                wait(2 * nprocs)
+
+        window = {}
+        loader = read_data.FrameLoader([lista[f] for f in needed])
+        frames = iter(needed)
+        try:
+            for cube in loader.chunks(100):
+                for image in cube:
+                    f = next(frames)
+                    for j, k in pairs.get(f, []):
+                        pending.append((j, window[k] - image))
+                        starts[k] -= 1
+                        if starts[k] == 0:
+                            del window[k]
+                        if len(pending) == batch:
+                            flush()
+                    if starts.get(f, 0) > 0:
+                        window[f] = image.copy()
+            if len(pending) > 0:
+                flush()
+            if pool is not None:
+                wait(0)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        # no pair for a tau (i_max <= 0): empty series, whose mean is NaN
+        rms_list = [[] for dist in tau_vector]
+        quad_list = [[] for dist in tau_vector]
+        for js, (rms, quad) in results:
+            for j, r, q in zip(js, rms, quad):
+                rms_list[j].append(r)
+                quad_list[j].append(q)
+        return ([np.array(rms) for rms in rms_list],
+                [np.array(quad) for quad in quad_list])
+
     def piston_noise(self, data_file_path):
         ''' Remove tip and tilt from image and average the results
         .. dovrei vedere una variazione nel tempo
@@ -479,16 +579,10 @@ class Noise():
         time = np.arange(image_number) * (1/Interferometer.BURST_FREQ)
 
         mean_list = []
-        for j in range(image_number):
-            #name = 'img_%04d' %j
-            #file_name = os.path.join(data_file_path, name)
-            image = image = read_data.read_phasemap(lista[j])
-            zernike_coeff_array, mat = zernike.zernikeFit(image,
-                                                              np.array([2, 3]))
-            sur = zernike.zernikeSurface(image, zernike_coeff_array, mat)
-            image_ttr = image - sur
-            mean = image_ttr.mean()
-            mean_list.append(mean)
+        for cube in self._cubeChunks(lista):
+            zernike_coeff_array, cube_ttr = zernike.zernikeFitCube(cube,
+                                                np.array([2, 3]), residual=True)
+            mean_list.extend(cube_ttr.mean(axis=(1, 2)))
 
         spe, freq = self._fft(np.array(mean_list))
         return np.array(mean_list), time, spe, freq
@@ -514,17 +608,18 @@ class Noise():
         time = np.arange(image_number) * (1/Interferometer.BURST_FREQ)
 
         tt_list = []
-        for j in range(image_number):
-            #name = 'img_%04d.h5' %j
-            #file_name = os.path.join(data_file_path, name)
-            image = image = read_data.read_phasemap(lista[j])
-            coeff, mat = zernike.zernikeFit(image,np.array([1,2, 3]))
-
+        for cube in self._cubeChunks(lista):
+            coeff = zernike.zernikeFitCube(cube, np.array([1, 2, 3]))
             tt_list.append(coeff)
 
-        tt = np.array(tt_list)
+        tt = np.concatenate(tt_list)
         return tt
 
+    def _cubeChunks(self, lista, nframes=100):
+        ''' Generator of the cubes [nframes, pixel, pixel] read from lista,
+        the next one being read in background '''
+        return read_data.FrameLoader(lista).chunks(nframes)
+
     def _createOrdListFromFilePath(self, data_file_path ):
 
 #        lista = glob.glob(os.path.join(data_file_path,'*.h5'))
@@ -540,3 +635,12 @@ class Noise():
             if len(lista)==0:
                 lista = th.fileList(None, fold=data_file_path,name ='20*.fits')
         return lista
+
+
+def _lagStatistics(diff_cube, zv):
+    ''' Rms of the residual and tip tilt of a cube of image differences
+    [ndiff, pixel, pixel] after the fit of the zernike in zv '''
+    coeff, residual = zernike.zernikeFitCube(diff_cube, zv, residual=True)
+    rms = np.array([residual[i].std() for i in range(residual.shape[0])])
+    quad = np.sqrt(coeff[:, 0]**2 + coeff[:, 1]**2)
+    return rms, quad
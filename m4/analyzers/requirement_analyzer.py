@@ -12,6 +12,7 @@ from astropy.io import fits as pyfits
 from skimage.draw import disk as draw_circle
 from m4.ground import zernike
 from scipy.ndimage.interpolation import shift
+from scipy import fft as sp_fft
 from m4.ground import read_data
 from m4.configuration import config_folder_names as config
 from matplotlib import pyplot as plt
@@ -53,67 +54,49 @@ def patches_analysis(image, radius_m, pixelscale=None, step=None, n_patches=None
 
     nn = image.compressed().shape[0]
     idx = np.where(image.mask==0)
-    x = idx[0]
-    y = idx[1]
-
     if step is None:
-        n_point = nn
         step = 1
-    else:
-        n_point = np.int(nn/step)+1
+    p = np.arange(0, nn, step)
+    x = idx[0][p]
+    y = idx[1][p]
 
+    stats = PatchStatistics(image)
     result_list = []
     list_ima = []
-    list_big = []
-    for i in range(n_point):
-        p = i + i * (step - 1)
-        #print('%d' %p)
-        #print('%d %d' %(x[p], y[p]))
-        if radius_m == 0.04:
-            thresh = 0.05
-            ima = _circleImage(image, x[p], y[p], raggio_px)
-            if ima is not None:
-                #list_ima.append(ima)
-                alpha, beta = curv_fit_v2(ima, 1/ps)
-                raggi_km = roc(alpha, beta)
-                #raggio = roc(2*radius_m, alpha, beta)
-                #print(raggio)
-                result_list.append(raggi_km)
-        if radius_m == 0.015:
-            thresh = 0.95
-            r1 = 0.1/2
-            r_px1 = r1/ps
-            ima = _circleImage(image, x[p], y[p], r_px1)
-            if ima is not None:
-                new_ima = tiptilt_fit(ima)
-                #list_big.append(new_ima)
-                if n_patches is None:
-                    final_ima = _circleImage(new_ima, x[p], y[p], raggio_px)
-                    if final_ima is not None:
-                        if i == 2:
-                            list_ima.append(final_ima)
-                        final_ima = final_ima - np.mean(final_ima)
-                        result_list.append(np.std(final_ima))
-                else:
-                    list_circleima = _circleImageList(new_ima, x[p], y[p], n_patches, raggio_px)
-                    if list_circleima is not None:
-                        for ima in list_circleima:
-                            list_ima.append(ima)
-                            result_list.append(np.std(ima))
-        if radius_m == 0.25:
-            thresh = 0.95
-            r_px1 = 0.1/2/ps
-            ima = _circleImage(image, x[p], y[p], r_px1)
-            if ima is not None:
+    if radius_m == 0.04:
+        thresh = 0.05
+        alpha, beta, valid = stats.curvature(raggio_px, (x, y), 1/ps)
+        result_list = roc(alpha[valid], beta[valid]).T
+    if radius_m == 0.015:
+        thresh = 0.95
+        r1 = 0.1/2
+        r_px1 = r1/ps
+        if n_patches is None:
+            rms, valid = stats.planeRms(r_px1, (x, y), raggio_px)
+            result_list = rms[valid]
+            if x.size > 2 and valid[2]:
+                new_ima = tiptilt_fit(_circleImage(image, x[2], y[2], r_px1))
+                list_ima.append(_circleImage(new_ima, x[2], y[2], raggio_px))
+        else:
+            for i in np.where(stats.validPatches(r_px1, (x, y)))[0]:
+                ima = _circleImage(image, x[i], y[i], r_px1)
                 new_ima = tiptilt_fit(ima)
-                #list_ima.append(new_ima)
-                result_list.append(np.std(new_ima))
+                list_circleima = _circleImageList(new_ima, x[i], y[i], n_patches, raggio_px)
+                if list_circleima is not None:
+                    for ima in list_circleima:
+                        list_ima.append(ima)
+                        result_list.append(np.std(ima))
+    if radius_m == 0.25:
+        thresh = 0.95
+        r_px1 = 0.1/2/ps
+        rms, valid = stats.planeRms(r_px1, (x, y))
+        result_list = rms[valid]
 
     result_vect = np.array(result_list)
     result_sort = np.copy(result_vect)
     result_sort.sort()
     dim = result_sort.size
-    req = result_sort[np.int(thresh*dim)]
+    req = result_sort[int(thresh*dim)]
     return req, list_ima, result_vect
 
 
@@ -141,7 +124,7 @@ def _circleImageList(new_ima, x, y, n_point, r_px):
         idx = np.where(new_ima.mask==0)
         x = idx[0]
         y = idx[1]
-        step = np.int(nn/(n_point-1))
+        step = int(nn/(n_point-1))
         final_ima_list = []
         for i in range(n_point):
             p = i + i * (step - 2)
@@ -193,6 +176,244 @@ def _circleImage(image, x, y, raggio_px):
             if valid_point >= th_validPoint:
                 return ima
 
+class PatchStatistics():
+    '''
+    Class for the statistics of the circular patches of an image centered
+    on many points at once. The sums over each patch of the valid points,
+    of the image and of their products with the coordinates are obtained
+    for all the centers from the FFT correlation of the moment images with
+    the patch footprint, so that the local fits become small linear
+    systems solved together
+
+    HOW TO USE IT::
+
+        from m4.analyzers.requirement_analyzer import PatchStatistics
+        stats = PatchStatistics(image)
+        rms, valid = stats.planeRms(r_px, (x, y))
+        alpha, beta, valid = stats.curvature(r_px, (x, y), pscale)
+    '''
+
+    def __init__(self, image, workers=-1):
+        """The constructor """
+        mask = np.ma.getmaskarray(image)
+        self._shape = mask.shape
+        self._workers = workers
+        weight = np.invert(mask).astype(float)
+        data = np.where(mask, 0., np.ma.getdata(image))
+        # a global plane does not change the local fits: removing it
+        # keeps the moments small and the differences accurate
+        rows, cols = np.nonzero(weight)
+        mat = np.stack([np.ones(rows.size), cols, rows], axis=1)
+        coef = np.linalg.lstsq(mat, data[rows, cols], rcond=None)[0]
+        data[rows, cols] -= np.dot(mat, coef)
+        self._plane = coef
+        self._images = [weight, data, data**2]
+        self._spectra = {}
+        self._moments = {}
+
+    def validPatches(self, r_px, centers):
+        '''
+        Parameters
+        ----------
+            r_px: float
+                radius of the patch in pixels
+            centers: tuple
+                (rows, columns) arrays of the patch centers
+
+        Returns
+        -------
+            valid: numpy array of bool
+                patches inside the image with at least 30% of valid points
+                (same selection of _circleImage, that discards also the
+                patches touching the first row or column)
+        '''
+        dr, dc = self._footprint(r_px)
+        x, y = centers
+        inside = (x + dr.min() > 0) & (x + dr.max() < self._shape[0]) & \
+            (y + dc.min() > 0) & (y + dc.max() < self._shape[1])
+        count = np.rint(self._moment(r_px, 0, 0, 0)[x, y])
+        return inside & (count >= np.pi * r_px**2 * 30 / 100)
+
+    def planeRms(self, r_fit, centers, r_rms=None):
+        '''
+        Parameters
+        ----------
+            r_fit: float
+                radius in pixels of the patch where tip and tilt are fitted
+            centers: tuple
+                (rows, columns) arrays of the patch centers
+            r_rms: float
+                radius in pixels of the patch where the rms is computed.
+                If None r_fit is used
+
+        Returns
+        -------
+            rms: numpy array
+                rms of each patch after the tip and tilt removal of
+                tiptilt_fit
+            valid: numpy array of bool
+                patches satisfying the selection of _circleImage
+        '''
+        x, y = centers
+        valid = self.validPatches(r_fit, centers)
+        if r_rms is None:
+            r_rms = r_fit
+        else:
+            valid &= self.validPatches(r_rms, centers)
+        xv, yv = x[valid], y[valid]
+        basis = [(1, 0), (0, 1)]
+        tilt = self._tiptilt(r_fit, (xv, yv)) / r_fit * r_rms
+        n = self._moment(r_rms, 0, 0, 0)[xv, yv]
+        sz = self._moment(r_rms, 1, 0, 0)[xv, yv]
+        szz = self._moment(r_rms, 2, 0, 0)[xv, yv]
+        su = np.stack([self._moment(r_rms, 0, a, b)[xv, yv]
+                       for a, b in basis], axis=1)
+        szu = np.stack([self._moment(r_rms, 1, a, b)[xv, yv]
+                        for a, b in basis], axis=1)
+        suu = np.stack([np.stack([self._moment(r_rms, 0, a + c, b + d)[xv, yv]
+                                  for c, d in basis], axis=1)
+                        for a, b in basis], axis=1)
+        mean = (sz - np.sum(tilt * su, axis=1)) / n
+        sq = szz - 2 * np.sum(tilt * szu, axis=1) + \
+            np.einsum('ni,nij,nj->n', tilt, suu, tilt)
+        rms = np.full(x.shape, np.nan)
+        rms[valid] = np.sqrt(np.clip(sq / n - mean**2, 0, None))
+        return rms, valid
+
+    def curvature(self, r_px, centers, pscale=1.):
+        '''
+        Parameters
+        ----------
+            r_px: float
+                radius of the patch in pixels
+            centers: tuple
+                (rows, columns) arrays of the patch centers
+            pscale: float
+                pixel scale [px/m]
+
+        Returns
+        -------
+            alpha: numpy array
+                analytical coefficient of scalloping of each patch
+                (see curv_fit_v2)
+            beta: numpy array
+                analytical coefficient of scalloping of each patch
+            valid: numpy array of bool
+                patches satisfying the selection of _circleImage
+        '''
+        x, y = centers
+        valid = self.validPatches(r_px, centers)
+        basis = [(2, 0), (0, 2), (1, 1), (1, 0), (0, 1), (0, 0)]
+        coeff = self._fit(r_px, basis, (x[valid], y[valid]))
+        coeff = coeff[:, :3] * (pscale / r_px)**2
+        root = np.sqrt((coeff[:, 0] - coeff[:, 1])**2 + coeff[:, 2]**2)
+        alpha = np.full(x.shape, np.nan)
+        beta = np.full(x.shape, np.nan)
+        alpha[valid] = 0.5 * (coeff[:, 0] + coeff[:, 1] + root)
+        beta[valid] = 0.5 * (coeff[:, 0] + coeff[:, 1] - root)
+        return alpha, beta, valid
+
+    def _tiptilt(self, r_px, centers):
+        ''' Tip and tilt of tiptilt_fit for each patch: the zernike fit
+        without piston on the pupil of geo.qpupil, i.e. of (u - u0, v - v0)
+        with u0, v0 the middle of the first and last valid column and row '''
+        x, y = centers
+        v0, u0 = self._pupilCenter(r_px, centers)
+        v0 = v0 / r_px
+        u0 = u0 / r_px
+
+        def mom(zpow, a, b):
+            return self._moment(r_px, zpow, a, b)[x, y]
+
+        s1, su, sv = mom(0, 0, 0), mom(0, 1, 0), mom(0, 0, 1)
+        sz = mom(1, 0, 0)
+        # the fit has no piston: the global plane removed from the data
+        # has to be given back at the pupil center
+        piston = self._plane[0] + self._plane[1] * (y + u0 * r_px) + \
+            self._plane[2] * (x + v0 * r_px)
+        mat = np.empty((x.size, 2, 2))
+        mat[:, 0, 0] = mom(0, 2, 0) - 2 * u0 * su + u0**2 * s1
+        mat[:, 1, 1] = mom(0, 0, 2) - 2 * v0 * sv + v0**2 * s1
+        mat[:, 0, 1] = mom(0, 1, 1) - u0 * sv - v0 * su + u0 * v0 * s1
+        mat[:, 1, 0] = mat[:, 0, 1]
+        vect = np.stack([mom(1, 1, 0) - u0 * sz + piston * (su - u0 * s1),
+                         mom(1, 0, 1) - v0 * sz + piston * (sv - v0 * s1)],
+                        axis=1)
+        try:
+            return np.linalg.solve(mat, vect[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            return np.einsum('nij,nj->ni', np.linalg.pinv(mat), vect)
+
+    def _pupilCenter(self, r_px, centers):
+        ''' Offsets from the patch centers of the middle of the first and
+        last valid row and column of each patch '''
+        dr, dc = self._footprint(r_px)
+        valid = self._images[0] > 0
+        rows = self._validLines(valid, dr, dc, centers)
+        cols = self._validLines(valid.T, dc, dr, centers[::-1])
+        return tuple(0.5 * (off[np.argmax(any_, axis=1)] +
+                            off[off.size - 1 - np.argmax(any_[:, ::-1], axis=1)])
+                     for off, any_ in (rows, cols))
+
+    @staticmethod
+    def _validLines(valid, dr, dc, centers):
+        ''' For each row offset of the footprint, True where the patch has
+        valid points on that row '''
+        x, y = centers
+        csum = np.zeros((valid.shape[0], valid.shape[1] + 1), dtype=int)
+        np.cumsum(valid, axis=1, out=csum[:, 1:])
+        offsets = np.unique(dr)
+        any_ = np.empty((x.size, offsets.size), dtype=bool)
+        for i, off in enumerate(offsets):
+            span = dc[dr == off]
+            rr = np.clip(x + off, 0, valid.shape[0] - 1)
+            lo = np.clip(y + span.min(), 0, valid.shape[1])
+            hi = np.clip(y + span.max() + 1, 0, valid.shape[1])
+            any_[:, i] = csum[rr, hi] > csum[rr, lo]
+        return offsets, any_
+
+    def _fit(self, r_px, basis, centers):
+        ''' Least squares coefficients of the basis (u**a * v**b, with
+        u, v column and row offsets in units of r_px) for each patch '''
+        x, y = centers
+        mat = np.empty((x.size, len(basis), len(basis)))
+        vect = np.empty((x.size, len(basis)))
+        for i, (a, b) in enumerate(basis):
+            vect[:, i] = self._moment(r_px, 1, a, b)[x, y]
+            for j, (c, d) in enumerate(basis):
+                mat[:, i, j] = self._moment(r_px, 0, a + c, b + d)[x, y]
+        try:
+            return np.linalg.solve(mat, vect[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            return np.einsum('nij,nj->ni', np.linalg.pinv(mat), vect)
+
+    def _footprint(self, r_px):
+        c = int(np.ceil(r_px)) + 1
+        rr, cc = draw_circle((c, c), r_px)
+        return rr - c, cc - c
+
+    def _moment(self, r_px, zpow, a, b):
+        ''' Sum over each patch of weight * z**zpow * u**a * v**b '''
+        key = (r_px, zpow, a, b)
+        if key not in self._moments:
+            dr, dc = self._footprint(r_px)
+            c = int(np.ceil(r_px)) + 1
+            kernel = np.zeros((2 * c + 1, 2 * c + 1))
+            # flipped footprint: the convolution becomes a correlation
+            kernel[c - dr, c - dc] = (dc / r_px)**a * (dr / r_px)**b
+            fshape = tuple(sp_fft.next_fast_len(n + 2 * c, real=True)
+                           for n in self._shape)
+            spec_key = (zpow, fshape)
+            if spec_key not in self._spectra:
+                self._spectra[spec_key] = sp_fft.rfft2(
+                    self._images[zpow], fshape, workers=self._workers)
+            full = sp_fft.irfft2(self._spectra[spec_key] *
+                                 sp_fft.rfft2(kernel, fshape, workers=self._workers),
+                                 fshape, workers=self._workers)
+            self._moments[key] = full[c:c + self._shape[0], c:c + self._shape[1]]
+        return self._moments[key]
+
+
 def tiptilt_fit(ima):
     '''
     Parameters
@@ -11,6 +11,7 @@ from astropy.io import fits as pyfits
 from matplotlib import pyplot as plt
 from m4.utils.image_reducer import TipTiltDetrend
 from m4.ground import zernike
+from m4.ground import read_data
 from m4.configuration import config_folder_names as fold_name
 from m4.ground.read_data import InterferometerConverter
 from m4.misc import tip_tilt_interf_fit
@@ -71,15 +72,15 @@ class Caliball():
         bad_mask: numpy array
                     worst mask
         '''
-        cube = self._readCube()
-        #cube_ttr = self._readCube(1)
-        mask_point = np.zeros(cube.shape[2])
-        for i in range(mask_point.shape[0]):
-            mask_point[i] = np.sum(np.invert(cube[:, :, i].mask))
-        mask_ord = np.sort(mask_point)
-        aa = np.where(mask_point == min(mask_point))[0][0]
-        bad_dataset = cube[:, :, aa]
-        bad_mask = cube[:, :, aa].mask
+        with self._readCube() as cube:
+            #cube_ttr = self._readCube(1)
+            mask_point = np.zeros(cube.shape[2])
+            for i in range(mask_point.shape[0]):
+                mask_point[i] = np.sum(np.invert(cube[:, :, i].mask))
+            mask_ord = np.sort(mask_point)
+            aa = np.where(mask_point == min(mask_point))[0][0]
+            bad_dataset = cube[:, :, aa]
+            bad_mask = cube[:, :, aa].mask
 
         plt.plot(np.arange(mask_point.shape[0]), mask_ord, 'o'); plt.xscale('log')
         plt.ylabel('# valid points'); plt.xlabel('# frames')
@@ -96,10 +97,10 @@ class Caliball():
         rs_ttr = rs_img - surf
         r0 = rs_ttr.std()
 
-        cube_ttr = self._readCube(1)
-        rs_vect = np.zeros(cube_ttr.shape[2])
-        for j in range(cube_ttr.shape[2]):
-            rs_vect[j] = cube_ttr[:, :, j].std()
+        with self._readCube(1) as cube_ttr:
+            rs_vect = np.zeros(cube_ttr.shape[2])
+            for j in range(cube_ttr.shape[2]):
+                rs_vect[j] = cube_ttr[:, :, j].std()
 
         plt.figure()
         plt.plot(np.arange(cube_ttr.shape[2]), rs_vect, label='Data'); plt.yscale('log')
@@ -120,7 +121,8 @@ class Caliball():
         mean_image: masked array
                 mean along the sequence
         '''
-        cube_ttr = self._readCube(1)
+        with self._readCube(1) as cube:
+            cube_ttr = cube[:, :, :]
         std_image = cube_ttr.std(axis=2)
         mean_image = cube_ttr.mean(axis=2)
 
@@ -143,25 +145,25 @@ class Caliball():
         mean_image: masked array
                 mean along the sequence
         '''
-        cube_ttr = self._readCube(1)
-        mask_point = np.zeros(cube_ttr.shape[2])
-        for i in range(mask_point.shape[0]):
-            mask_point[i] = np.sum(np.invert(cube_ttr[:, :, i].mask))
-        idx = np.where(mask_point >= (max(mask_point) - self._maskthreshold))
-
-        rs_std = np.zeros(idx[0].shape[0])
-        for i in range(idx[0].shape[0]):
-            rs_std[i] = np.std(cube_ttr[:, :, idx[0][i]])
-
-        rthresh = np.mean(rs_std)+self._rmsthreshold*np.std(rs_std)
-        idr = np.where(rs_std < rthresh)
-
-        idxr = idr
-        for i in range(idr[0].shape[0]):
-            idxr[0][i] = idx[0][idr[0][i]]
-        r_img = np.mean(cube_ttr[:, :, idxr], axis=2)
-        std_img = np.std(cube_ttr[:, :, idxr], axis=2)
-        mask = np.prod(cube_ttr[:, :, idxr].mask, 2)
+        with self._readCube(1) as cube_ttr:
+            mask_point = np.zeros(cube_ttr.shape[2])
+            for i in range(mask_point.shape[0]):
+                mask_point[i] = np.sum(np.invert(cube_ttr[:, :, i].mask))
+            idx = np.where(mask_point >= (max(mask_point) - self._maskthreshold))
+
+            rs_std = np.zeros(idx[0].shape[0])
+            for i in range(idx[0].shape[0]):
+                rs_std[i] = np.std(cube_ttr[:, :, idx[0][i]])
+
+            rthresh = np.mean(rs_std)+self._rmsthreshold*np.std(rs_std)
+            idr = np.where(rs_std < rthresh)
+
+            idxr = idr
+            for i in range(idr[0].shape[0]):
+                idxr[0][i] = idx[0][idr[0][i]]
+            r_img = np.mean(cube_ttr[:, :, idxr], axis=2)
+            std_img = np.std(cube_ttr[:, :, idxr], axis=2)
+            mask = np.prod(cube_ttr[:, :, idxr].mask, 2)
         r_image = np.ma.masked_array(r_img[:, :, 0], mask=mask[:, :, 0])
         std_image = np.ma.masked_array(std_img[:, :, 0], mask=mask[:, :, 0])
 
@@ -176,40 +178,33 @@ class Caliball():
 ###
 
     def _createCubeTTrFromCube(self, fitEx=None):
-        # ci mette un eternit a fare l estenzione dell immagine
         #cube = self._readCube()
-        cube_ttr = None
+        builder = read_data.CubeBuilder(self._cube.shape[2])
         if fitEx is None:
             for i in range(self._cube.shape[2]):
                 image = self._cube[:, :, i]
                 coef, mat = zernike.zernikeFit(image, np.array([2, 3]))
                 surf = zernike.zernikeSurface(image, coef, mat)
-                image_ttr = image - surf
-                if cube_ttr is None:
-                    cube_ttr = image_ttr
-                else:
-                    cube_ttr = np.ma.dstack((cube_ttr, image_ttr))
+                builder.setFrame(i, image - surf)
         else:
             for i in range(self._cube.shape[2]):
                 coef, interf_coef = tip_tilt_interf_fit.fit(self._cube[:, :, i])
                 image_ttr = self._ttd.ttRemoverFromCoeff(coef, self._cube[:, :, i])
-                if cube_ttr is None:
-                    cube_ttr = image_ttr
-                else:
-                    cube_ttr = np.ma.dstack((cube_ttr, image_ttr))
+                builder.setFrame(i, image_ttr)
+        cube_ttr = builder.cube()
 
         self._saveCube(cube_ttr, 'Total_Cube_ttr.fits')
         return cube_ttr
 
     def _createRsImgFile(self):
-        cube = self._readCube()
-        mask_point = np.zeros(cube.shape[2])
-        for i in range(mask_point.shape[0]):
-            mask_point[i] = np.sum(cube[:, :, i].mask)
-        idx = np.where(mask_point <= (min(mask_point) + self._maskthreshold))
-        tot = idx[0].shape[0]
-        image = np.sum(cube[:, :, idx], 3) / tot
-        mask = np.prod(cube[:, :, idx].mask, 3)
+        with self._readCube() as cube:
+            mask_point = np.zeros(cube.shape[2])
+            for i in range(mask_point.shape[0]):
+                mask_point[i] = np.sum(cube[:, :, i].mask)
+            idx = np.where(mask_point <= (min(mask_point) + self._maskthreshold))
+            tot = idx[0].shape[0]
+            image = np.sum(cube[:, :, idx], 3) / tot
+            mask = np.prod(cube[:, :, idx].mask, 3)
         rs_img = np.ma.masked_array(image[:, :, 0], mask=mask)
 
         fits_file_name = os.path.join(Caliball._storageFolder(), self._folderName, 'rs_img.fits')
@@ -218,24 +213,18 @@ class Caliball():
         return rs_img
 
     def _createMeasurementCube(self):
-        cube = None
         fold = os.path.join(Caliball._storageFolder(), self._folderName, 'hdf5')
         list = os.listdir(fold)
-        for i in range(len(list)-1):
-            name = 'img_%04d.h5' %i
-            file_name = os.path.join(fold, name)
-            ima = self._ic.fromPhaseCam4020(file_name)
-            if cube is None:
-                cube = ima
-            else:
-                cube = np.ma.dstack((cube, ima))
+        file_names = [os.path.join(fold, 'img_%04d.h5' % i)
+                      for i in range(len(list)-1)]
+        cube = read_data.CubeBuilder(len(file_names)).map(
+            self._ic.fromPhaseCam4020, file_names, nthreads=8)
         self._saveCube(cube, 'Total_Cube.fits')
         return cube
 
     def _saveCube(self, total_cube, name):
         fits_file_name = os.path.join(Caliball._storageFolder(), self._folderName, name)
-        pyfits.writeto(fits_file_name, total_cube.data)
-        pyfits.append(fits_file_name, total_cube.mask.astype(int))
+        read_data.saveMaskedCube(fits_file_name, total_cube)
 
     def _readCube(self, ttr=None):
         if ttr is None:
@@ -245,10 +234,7 @@ class Caliball():
             #file_name = os.path.join(Caliball._storageFolder(), 'Total_Cube_ttr_runa.fits')
             file_name = os.path.join(Caliball._storageFolder(), self._folderName,
                                      'Total_Cube_ttr.fits')
-        hduList = pyfits.open(file_name)
-        cube = np.ma.masked_array(hduList[0].data,
-                                  hduList[1].data.astype(bool))
-        return cube
+        return read_data.openMaskedCube(file_name)
 
     def _readRsImg(self):
         file_name = os.path.join(Caliball._storageFolder(), self._folderName,
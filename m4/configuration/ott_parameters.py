@@ -125,6 +125,7 @@ class OpcUaParameters():
 
     RM_KIN = 9
     PAR_KIN = 10
+    act_position_tolerance = 0.05 #[mm]
 
     zabbix_variables_name = ['RA', 'CAR', 'ST',
                              'RM1', 'RM2', 'RM3',
@@ -2,14 +2,18 @@
 Authors
   - C. Selmi: written in 2020
 '''
+import os
 import six
+import numpy as np
 from abc import ABCMeta, abstractmethod
+from m4.ground import read_data
 
 @six.add_metaclass(ABCMeta)
 class BaseInterferometer():
     '''
     Abstract class for the interferometer
     '''
+    _frameWriter = None
 
     @abstractmethod
     def acquire_phasemap(self, nframes, show):
@@ -20,3 +24,31 @@ class BaseInterferometer():
     def save_phasemap(self, location, file_name, masked_image):
         ''' Function for saving data '''
         raise Exception('Implement me!')
+
+    def setFrameWriter(self, frame_writer):
+        '''
+        Parameters
+        ----------
+            frame_writer: object
+                FrameWriter used by save_phasemap to write in background,
+                None to write synchronously
+        '''
+        self._frameWriter = frame_writer
+
+    def _writePhasemap(self, location, file_name, masked_image,
+                       mask_dtype=np.uint8):
+        ''' Writes the image with the frame writer, if any
+
+        Returns
+        -------
+            ack: concurrent.futures.Future
+                writing acknowledgment, None if the image was written
+                synchronously
+        '''
+        fits_file_name = os.path.join(location, file_name)
+        if self._frameWriter is None:
+            read_data.saveMaskedImage(fits_file_name, masked_image,
+                                      mask_dtype=mask_dtype)
+            return None
+        return self._frameWriter.write(fits_file_name, masked_image,
+                                       mask_dtype)
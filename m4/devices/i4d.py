@@ -1,27 +1,74 @@
+import io
+import re
 import json
+import time
+import socket
+import logging
+import threading
+import http.client
+import urllib.parse
 import numpy as np
-import urllib
+import pandas as pd
 
 #I4D_IP = '10.1.20.76'
 #I4D_PORT = 8011
 
+_JSON_TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*"|[{}\[\]]')
+_DATA_VALUE = re.compile(rb'\s*:\s*\[')
+
+
 class I4D():
-    """ Interferometer class
-    
+    """ Interferometer class.
+    All the requests use a single keep-alive HTTP connection and the
+    image data in the JSON answers are decoded directly into numpy arrays
+
     HOW TO USE IT::
 
         from m4.devices.i4d import I4D
         i4d = I4D(ip_address, port)
+        width, height, pixel_size, data = i4d.takeSingleMeasurement()
+        i4d.getLatencyStats()
     """
-    def __init__(self, IP, PORT):
+    def __init__(self, IP, PORT, timeout=None):
         """ The constructor """
         self._ip = IP
         self._port = PORT
+        self._timeout = timeout
+        self._logger = logging.getLogger('I4D')
 
         self._dataServiceAddress = 'http://%s:%i/DataService/' % (self._ip, self._port)
         self._systemServiceAddress = 'http://%s:%i/SystemService/' % (self._ip, self._port)
         self._frameBurstServiceAddress = 'http://%s:%i/FrameBurstService/' % (self._ip, self._port)
 
+        self._connection = None
+        self._lock = threading.Lock()
+        self._latency = {}
+
+    def close(self):
+        ''' Close the connection with the interferometer '''
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def getLatencyStats(self):
+        '''
+        Returns
+        -------
+        stats: dict
+            for each service called: number of calls, total, mean, last and
+            max round trip time and total decoding time [s]
+        '''
+        stats = {}
+        for name, (ncalls, total, last, tmax, decode) in self._latency.items():
+            stats[name] = {'ncalls': ncalls, 'total': total,
+                           'mean': total / ncalls, 'last': last,
+                           'max': tmax, 'decode': decode}
+        return stats
+
+    def resetLatencyStats(self):
+        ''' Clear the latency statistics '''
+        self._latency = {}
+
     def _readJsonData(self, url, data=None):
         """
         Parameters
@@ -38,27 +85,59 @@ class I4D():
 
         """
         if data:
-            dumped_data = json.dumps(data)
-            encoded_data = dumped_data.encode('utf-8')
-            content_length = len(encoded_data)
+            encoded_data = json.dumps(data).encode('utf-8')
             request_headers = {'Content-type': 'application/json',
-                            'Accept': 'application/json',
-                            'Content-length': content_length}
-            req = urllib.request.Request(url, data=encoded_data, headers=request_headers)
+                               'Accept': 'application/json',
+                               'Content-length': len(encoded_data)}
         else:
-            req = url
-        try:
-            response = urllib.request.urlopen(req)
+            encoded_data = None
+            request_headers = {}
+        t0 = time.perf_counter()
+        status, response_contents = self._request(url, encoded_data, request_headers)
+        t1 = time.perf_counter()
+        if status >= 400:
+            self._recordLatency(url, t1 - t0, 0.)
+            self._logger.error('Response error %d from %s: %s' % (
+                status, url, response_contents.decode('utf-8', 'replace')))
+            raise Exception('Response error %d from %s' % (status, url))
+        json_data = None
+        if response_contents != b'':
+            json_data = _decodeJson(response_contents)
+        self._recordLatency(url, t1 - t0, time.perf_counter() - t1)
+        return json_data
 
-            response_contents = response.read()
-            if response_contents != b'':
-                json_data = json.loads(response_contents)
-                return json_data
-        except urllib.request.HTTPError as e:
-            error_message = e.read()
-            print(error_message)
-            open('/tmp/out.html','w+').write(error_message.decode('utf-8'))
-            raise Exception('Response error see /tmp/out.html for details')
+    def _request(self, url, body, headers):
+        ''' Send the request on the persistent connection. If the
+        connection was closed by the server while idle it is opened again
+        and the request sent once more '''
+        method = 'POST' if body is not None else 'GET'
+        path = urllib.parse.urlsplit(url).path
+        with self._lock:
+            for attempt in range(2):
+                reused = self._connection is not None
+                if not reused:
+                    self._connection = http.client.HTTPConnection(
+                        self._ip, self._port, timeout=self._timeout)
+                try:
+                    self._connection.request(method, path, body, headers)
+                    response = self._connection.getresponse()
+                    contents = response.read()
+                except (http.client.HTTPException, ConnectionError, socket.timeout):
+                    self.close()
+                    if not reused or attempt == 1:
+                        raise
+                    self._logger.debug('Connection closed by the server, reconnecting')
+                    continue
+                if response.will_close:
+                    self.close()
+                return response.status, contents
+
+    def _recordLatency(self, url, elapsed, decode):
+        name = urllib.parse.urlsplit(url).path.strip('/').split('/')[-1]
+        ncalls, total, last, tmax, tdecode = self._latency.get(name, (0, 0., 0., 0., 0.))
+        self._latency[name] = (ncalls + 1, total + elapsed, elapsed,
+                               max(tmax, elapsed), tdecode + decode)
+        self._logger.debug('%s: %.1f ms + %.1f ms decoding' % (name, elapsed * 1e3, decode * 1e3))
 
     ### DATA PROXY ###
     def getFeatureAnalysisResults(self):
@@ -107,7 +186,7 @@ class I4D():
         width = json_data['Width']
         height = json_data['Height']
         pixel_size_in_microns = json_data['PixelSizeInMicrons']
-        data = np.array(json_data['Data'], dtype=np.float32)
+        data = np.asarray(json_data['Data'], dtype=np.float32)
         return data, height, pixel_size_in_microns, width
 
     def getIntensityData(self):
@@ -127,7 +206,7 @@ class I4D():
         width = json_data['Width']
         height = json_data['Height']
         pixel_size_in_microns = json_data['PixelSizeInMicrons']
-        data = np.array(json_data['Data'], dtype=np.float32)
+        data = np.asarray(json_data['Data'], dtype=np.float32)
         return data, height, pixel_size_in_microns, width
 
     def getInterferogram(self, index):
@@ -198,7 +277,7 @@ class I4D():
         height = json_data['Height']
         pixel_size_in_microns = json_data['PixelSizeInMicrons']
         data_list = json_data["Data"]
-        data_array = np.array(data_list, dtype=np.float32)
+        data_array = np.asarray(data_list, dtype=np.float32)
         return width, height, pixel_size_in_microns, data_array
 
     def getPhaseStepCalculatorResults(self):
@@ -232,7 +311,7 @@ class I4D():
         '''
         url = '%s%s' % (self._dataServiceAddress, 'GetSurfaceData')
         json_data = self._readJsonData(url)
-        data = np.array(json_data['Data'], dtype=np.float32)
+        data = np.asarray(json_data['Data'], dtype=np.float32)
         height = json_data['Height']
         pixel_size_in_microns = json_data['PixelSizeInMicrons']
         width = json_data['Width']
@@ -252,7 +331,7 @@ class I4D():
         '''
         url = '%s%s' % (self._dataServiceAddress, 'GetUnprocessedSurfaceData')
         json_data = self._readJsonData(url)
-        data = np.array(json_data['Data'], dtype=np.float32)
+        data = np.asarray(json_data['Data'], dtype=np.float32)
         height = json_data['Height']
         pixel_size_in_microns = json_data['PixelSizeInMicrons']
         width = json_data['Width']
@@ -289,7 +368,7 @@ class I4D():
         height = json_data['Height']
         pixel_size_in_microns = json_data['PixelSizeInMicrons']
         data_list = json_data['Data']
-        data_array = np.array(data_list, dtype=np.float32)
+        data_array = np.asarray(data_list, dtype=np.float32)
         return width, height, pixel_size_in_microns, data_array
 
     def setDetectorMask(self, mask):
@@ -394,3 +473,53 @@ class I4D():
         url = '%s%s' % (self._frameBurstServiceAddress, 'BurstFramesToDisk')
         data = numberOfFrames
         self._readJsonData(url, data)
+
+
+def _decodeJson(contents):
+    ''' Decode the JSON answer of the interferometer. The image data
+    (list of numbers of the top level "Data" key) are parsed directly into
+    a float32 array, without creating the list of python floats '''
+    start = _topLevelData(contents)
+    if start is not None:
+        stop = contents.find(b']', start)
+        if stop > 0 and contents.find(b'[', start, stop) < 0:
+            try:
+                data = _parseNumbers(contents[start:stop])
+            except ValueError:
+                data = None
+            if data is not None:
+                json_data = json.loads(contents[:start - 1] + b'null' + contents[stop + 1:])
+                json_data['Data'] = data
+                return json_data
+    return json.loads(contents)
+
+
+def _topLevelData(contents):
+    ''' Position after the opening bracket of the list of the "Data" key
+    of the top level object, None if there is not such a list '''
+    depth = 0
+    for token in _JSON_TOKEN.finditer(contents):
+        value = token.group()
+        if value in (b'{', b'['):
+            if depth == 0 and value == b'[':
+                return None
+            depth += 1
+        elif value in (b'}', b']'):
+            depth -= 1
+            if depth == 0:
+                return None
+        elif depth == 1 and value == b'"Data"':
+            match = _DATA_VALUE.match(contents, token.end())
+            if match is not None:
+                return match.end()
+    return None
+
+
+def _parseNumbers(text):
+    ''' Comma separated numbers (NaN included) to float32 array,
+    with the C parser of pandas '''
+    if not text.strip():
+        return None
+    frame = pd.read_csv(io.BytesIO(text), header=None, lineterminator=',',
+                        dtype=np.float32, engine='c', skipinitialspace=True)
+    return frame.values[:, 0]
@@ -7,8 +7,8 @@ import os
 import time
 import shutil
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from matplotlib import pyplot as plt
-from astropy.io import fits as pyfits
 from m4.ground import timestamp
 from m4.configuration import config_folder_names as fold_name
 from m4.configuration.ott_parameters import Interferometer
@@ -78,10 +78,14 @@ class I4d4020(BaseInterferometer):
             measuremnet fits file name
         masked_image: numpy masked array
             data to save
+
+        Returns
+        -------
+        ack: concurrent.futures.Future
+            writing acknowledgment if a frame writer is set, otherwise None
         """
-        fits_file_name = os.path.join(location, file_name)
-        pyfits.writeto(fits_file_name, masked_image.data)
-        pyfits.append(fits_file_name, masked_image.mask.astype(int))
+        return self._writePhasemap(location, file_name, masked_image,
+                                   mask_dtype=int)
 
     def _getMeasurementOnTheFly(self, interf):
         '''
@@ -127,8 +131,9 @@ class I4d6110(BaseInterferometer):
         self._ic = InterferometerConverter()
         self._logger = logging.getLogger('4D')
         self._ts = timestamp.Timestamp()
+        self._lastTiming = None
 
-    def acquire_phasemap(self, nframes=1, delay=0):
+    def acquire_phasemap(self, nframes=1, delay=0, timing=False):
         """
         Parameters
         ----------
@@ -137,30 +142,81 @@ class I4d6110(BaseInterferometer):
             delay: int [s]
                 delay between images
 
+        Other Parameters
+        ----------------
+            timing: boolean
+                True to return also the timing of each frame
+
         Returns
         -------
             masked_ima: numpy masked array
                     interferometer image
+            frame_timing: dict
+                only if timing is True: 'start' of the request from the
+                beginning of the call, 'measure' duration of the request
+                and 'convert' duration of the conversion of each frame [s]
         """
         if nframes == 1:
+            t0 = time.perf_counter()
             width, height, pixel_size_in_microns, data_array = self._i4d.takeSingleMeasurement()
+            t1 = time.perf_counter()
             masked_ima = self._fromDataArrayToMaskedArray(width, height, data_array*632.8e-9)
+            frame_timing = {'start': np.zeros(1), 'measure': np.array([t1 - t0]),
+                            'convert': np.array([time.perf_counter() - t1])}
         else:
-            image_list = []
-            for i in range(nframes):
-                width, height, pixel_size_in_microns, data_array = self._i4d.takeSingleMeasurement()
-                masked_ima = self._fromDataArrayToMaskedArray(width, height, data_array*632.8e-9)
-                image_list.append(masked_ima)
-                time.sleep(delay)
-            images = np.ma.dstack(image_list)
-            masked_ima = np.ma.mean(images, 2)
+            masked_ima, frame_timing = self._acquirePipelined(nframes, delay)
+        self._lastTiming = frame_timing
 
 #         if show != 0:
 #             plt.clf()
 #             plt.imshow(masked_ima, origin='lower')
 #             plt.colorbar()
+        if timing is True:
+            return masked_ima, frame_timing
         return masked_ima
 
+    def _acquirePipelined(self, nframes, delay):
+        ''' Mean of nframes measurements: the request of the next frame is
+        in flight while the previous one is converted and accumulated '''
+        frame_timing = {'start': np.zeros(nframes), 'measure': np.zeros(nframes),
+                        'convert': np.zeros(nframes)}
+        t_call = time.perf_counter()
+
+        def measure(wait):
+            time.sleep(wait)
+            t0 = time.perf_counter()
+            result = self._i4d.takeSingleMeasurement()
+            return t0, time.perf_counter(), result
+
+        total = None
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(measure, 0)
+            for i in range(nframes):
+                t0, t1, (width, height, pixel_size_in_microns, data_array) = future.result()
+                if i < nframes - 1:
+                    future = executor.submit(measure, delay)
+                masked_ima = self._fromDataArrayToMaskedArray(width, height, data_array*632.8e-9)
+                valid = np.invert(masked_ima.mask)
+                if total is None:
+                    total = np.zeros(masked_ima.shape)
+                    count = np.zeros(masked_ima.shape, dtype=int)
+                total += np.where(valid, masked_ima.data, 0)
+                count += valid
+                frame_timing['start'][i] = t0 - t_call
+                frame_timing['measure'][i] = t1 - t0
+                frame_timing['convert'][i] = time.perf_counter() - t1
+        mean = (total / np.maximum(count, 1)).astype(masked_ima.dtype)
+        return np.ma.masked_array(mean, mask=(count == 0)), frame_timing
+
+    def getLastTiming(self):
+        '''
+        Returns
+        -------
+            frame_timing: dict
+                timing of the frames of the last acquire_phasemap
+        '''
+        return self._lastTiming
+
     def _fromDataArrayToMaskedArray(self, width, height, data_array):
        # data = np.reshape(data_array, (width, height))
         data = np.reshape(data_array, (height,width)) #mod20231002, rectangular frames were bad. now fixed
@@ -181,10 +237,13 @@ class I4d6110(BaseInterferometer):
             measuremnet fits file name
         masked_image: numpy masked array
             data to save
+
+        Returns
+        -------
+        ack: concurrent.futures.Future
+            writing acknowledgment if a frame writer is set, otherwise None
         """
-        fits_file_name = os.path.join(location, file_name)
-        pyfits.writeto(fits_file_name, masked_image.data)
-        pyfits.append(fits_file_name, masked_image.mask.astype(np.uint8))  #was int, then uint16
+        return self._writePhasemap(location, file_name, masked_image)  #mask was int, then uint16
 
     # def burstAndConvertFrom4DPCTom4OTTpc(self, n_frames):
     #     '''
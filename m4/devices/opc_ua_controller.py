@@ -4,43 +4,272 @@ Authors
 '''
 
 import logging
+import threading
+import concurrent.futures
 import numpy as np
-import time
 from opcua import Client
 from opcua import ua
+from opcua.common.utils import SocketClosedException
 from m4.configuration.ott_parameters import OpcUaParameters
 
 server = OpcUaParameters.server
 
+# status codes after which the session is opened again
+_SESSION_ERRORS = frozenset(getattr(ua.StatusCodes, name) for name in (
+    'BadSessionIdInvalid', 'BadSessionClosed', 'BadSessionNotActivated',
+    'BadSecureChannelIdInvalid', 'BadSecureChannelClosed',
+    'BadSecureChannelTokenUnknown', 'BadConnectionClosed',
+    'BadCommunicationError', 'BadNotConnected', 'BadServerNotConnected',
+    'BadTimeout', 'BadRequestTimeout'))
+
 
 class OpcUaController():
     """
-    Function for test tower management via OpcUa
+    Function for test tower management via OpcUa.
+    The session with the server is opened at the first request and kept
+    open: if a request fails for a connection problem the session is
+    opened again and the request repeated once
 
     HOW TO USE IT::
 
         from m4.devices.opc_ua_controller import OpcUaController
         opcUa = OpcUaController()
+        positions = opcUa.read_values([opcUa.POSITION_NODE % i for i in (0, 1, 2)])
+        opcUa.move_object(n)
+        future = opcUa.wait_for_stop_async(n)
+        future.result()
+        opcUa.disconnect()
     """
     STOP_NODE = "ns=7;s=MAIN.b_StopCmd"
     TEMPERATURE_NODE = "ns=7;s=MAIN.i_Temperature_Sensor"
+    POSITION_NODE = "ns=7;s=MAIN.Drivers_input.f_PosAct[%d]"
+    TARGET_NODE = "ns=7;s=MAIN.f_TargetPosition_input[%d]"
+    MOVE_NODE = "ns=7;s=MAIN.b_MoveCmd[%d]"
+    SUBSCRIPTION_PERIOD_MS = 50
+    WATCH_POLL_PERIOD = 1
+    STOP_TIMEOUT = 300
+    ACT_TIMEOUT = 10
+    ACT_DWELL_TIME = 0.5
 
     def __init__(self):
         """The constructor """
         self._logger = logging.getLogger('OPCUA:')
         self._client = Client(url=server)
+        self._connected = False
+        self._nodes = {}
+        self._variantTypes = {}
+        self._lock = threading.RLock()
+        self._handler = _DataChangeHandler()
+        self._subscription = None
+        self._monitored = {}
+
+    def connect(self):
+        """
+        Open the session with the server (if not already open)
+        """
+        with self._lock:
+            if not self._connected:
+                self._client.connect()
+                self._connected = True
+                watched = self._handler.watched()
+                if watched:
+                    # a new session has no subscription: the nodes still
+                    # waited for are monitored again and their current
+                    # value is checked
+                    self._logger.debug('Subscribing again %s', watched)
+                    for node_id in watched:
+                        self._subscribe(node_id)
+                    for node_id, value in zip(watched, self._read(watched)):
+                        self._handler.notify(node_id, value)
+
+    def disconnect(self):
+        """
+        Close the session with the server
+        """
+        with self._lock:
+            if self._connected:
+                self._connected = False
+                self._subscription = None
+                self._monitored = {}
+                try:
+                    self._client.disconnect()
+                except Exception as e:
+                    self._logger.debug('Error closing the session: %s', e)
+
+    def read_values(self, node_ids):
+        """
+        Parameters
+        ----------
+            node_ids: list
+                    node id strings to read
+
+        Returns
+        -------
+            values: list
+                    values of the nodes, read in a single request.
+                    A bad status code of any node raises the corresponding
+                    ua.UaStatusCodeError
+        """
+        return self._call(lambda: self._read(node_ids))
+
+    def write_values(self, node_ids, values):
+        """
+        Parameters
+        ----------
+            node_ids: list
+                    node id strings to write
+            values: list
+                    values to assign to the nodes, written in a single request
+        """
+        def write():
+            nodes = [self._node(node_id) for node_id in node_ids]
+            data_values = [ua.DataValue(ua.Variant(value, self._variantType(node_id)))
+                           for node_id, value in zip(node_ids, values)]
+            results = self._client.uaclient.set_attributes(
+                [node.nodeid for node in nodes], data_values, ua.AttributeIds.Value)
+            for result in results:
+                result.check()
+        self._call(write)
+
+    def _read(self, node_ids):
+        nodes = [self._node(node_id) for node_id in node_ids]
+        results = self._client.uaclient.get_attributes(
+            [node.nodeid for node in nodes], ua.AttributeIds.Value)
+        for result in results:
+            result.StatusCode.check()
+        return [result.Value.Value for result in results]
+
+    def _call(self, function):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    self.connect()
+                    return function()
+                except (OSError, concurrent.futures.TimeoutError,
+                        concurrent.futures.CancelledError, ua.UaError) as e:
+                    if not _isConnectionError(e):
+                        raise
+                    self.disconnect()
+                    if attempt == 1:
+                        raise
+                    self._logger.warning('OpcUa request failed (%s): reconnecting', e)
+
+    def _node(self, node_id):
+        node = self._nodes.get(node_id)
+        if node is None:
+            node = self._client.get_node(node_id)
+            self._nodes[node_id] = node
+        return node
+
+    def _variantType(self, node_id):
+        variant_type = self._variantTypes.get(node_id)
+        if variant_type is None:
+            variant_type = self._node(node_id).get_data_type_as_variant_type()
+            self._variantTypes[node_id] = variant_type
+        return variant_type
+
+    def _subscribe(self, node_id):
+        if node_id not in self._monitored:
+            if self._subscription is None:
+                self._subscription = self._client.create_subscription(
+                    self.SUBSCRIPTION_PERIOD_MS, self._handler)
+            node = self._node(node_id)
+            self._handler.register(node.nodeid, node_id)
+            self._monitored[node_id] = self._subscription.subscribe_data_change(node)
+
+    def _watch(self, node_id, condition, timeout=None, dwell=None):
+        ''' Future resolved with the value of the node as soon as its
+        current value or a data change notification satisfies condition.
+        If dwell is not None the value must also stay unchanged for dwell
+        seconds. The node is read also every WATCH_POLL_PERIOD seconds, so
+        that a lost subscription only delays the result '''
+        future = concurrent.futures.Future()
+        lock = threading.Lock()
+        state = {'generation': 0, 'value': None, 'dwell': None, 'poll': None}
+
+        def finish(value=None, exception=None):
+            # called with lock held
+            state['generation'] += 1
+            if future.done():
+                return
+            if exception is None:
+                future.set_result(value)
+            else:
+                future.set_exception(exception)
+
+        def resolve(value=None, exception=None):
+            with lock:
+                finish(value, exception)
+
+        def settled(generation, value):
+            with lock:
+                if generation == state['generation']:
+                    finish(value)
+
+        def callback(value):
+            with lock:
+                if future.done():
+                    return
+                if state['dwell'] is not None and value == state['value']:
+                    return
+                if state['dwell'] is not None:
+                    state['dwell'].cancel()
+                    state['dwell'] = None
+                state['generation'] += 1
+                state['value'] = value
+                if not condition(value):
+                    return
+                if dwell is None:
+                    finish(value)
+                    return
+                state['dwell'] = threading.Timer(
+                    dwell, settled, args=(state['generation'], value))
+                state['dwell'].daemon = True
+                state['dwell'].start()
+
+        def poll():
+            try:
+                callback(self.read_values([node_id])[0])
+            except Exception as e:
+                self._logger.debug('Reading %s failed: %s', node_id, e)
+            schedulePoll()
+
+        def schedulePoll():
+            with lock:
+                if future.done():
+                    return
+                state['poll'] = threading.Timer(self.WATCH_POLL_PERIOD, poll)
+                state['poll'].daemon = True
+                state['poll'].start()
+
+        def cleanup(f):
+            self._handler.remove(node_id, callback)
+            for name in ('dwell', 'poll'):
+                if state[name] is not None:
+                    state[name].cancel()
+
+        self._handler.add(node_id, callback)
+        future.add_done_callback(cleanup)
+        if timeout is not None:
+            timer = threading.Timer(timeout, resolve, kwargs={
+                'exception': concurrent.futures.TimeoutError(
+                    '%s not completed in %s s' % (node_id, timeout))})
+            timer.daemon = True
+            timer.start()
+            future.add_done_callback(lambda f: timer.cancel())
+        try:
+            self._call(lambda: self._subscribe(node_id))
+            callback(self.read_values([node_id])[0])
+        except Exception as e:
+            resolve(exception=e)
+        schedulePoll()
+        return future
 
     def stop(self):
         """
         Stop all commands
         """
-        self._client.connect()
-        stop_node = self._client.get_node(self.STOP_NODE)
-        stop_type = stop_node.get_data_type_as_variant_type()
-#         import pdb
-#         pdb.set_trace()
-        stop_node.set_value(ua.DataValue(ua.Variant(True, stop_type)))
-        self._client.disconnect()
+        self.write_values([self.STOP_NODE], [True])
 
     def get_temperature_vector(self):
         """
@@ -49,10 +278,8 @@ class OpcUaController():
             temperature_vector: numpy array
                                 values obtained from PT
         """
-        self._client.connect()
-        temperature_node = self._client.get_node(self.TEMPERATURE_NODE)
-        temperature_vector = np.array(temperature_node.get_value()) / 100.
-        self._client.disconnect()
+        value = self.read_values([self.TEMPERATURE_NODE])[0]
+        temperature_vector = np.array(value) / 100.
         return temperature_vector
 
     def get_variables_positions(self):
@@ -62,14 +289,9 @@ class OpcUaController():
             variables: numpy array
                     all variables value
         """
-        self._client.connect()
-        var_list = []
-        for i in range(len(OpcUaParameters.zabbix_variables_name)):
-            node = self._client.get_node("ns=7;s=MAIN.Drivers_input.f_PosAct[%d]" % i)
-            var = node.get_value()
-            var_list.append(var)
-        self._client.disconnect()
-        return np.array(var_list)
+        node_ids = [self.POSITION_NODE % i
+                    for i in range(len(OpcUaParameters.zabbix_variables_name))]
+        return np.array(self.read_values(node_ids))
 
 ### Command for object ###
     def get_position(self, int_number):
@@ -84,13 +306,25 @@ class OpcUaController():
             position: float
                     position of the requested object
         """
-        self._client.connect()
-        node = self._client.get_node("ns=7;s=MAIN.Drivers_input.f_PosAct[%d]" % int_number)
-        position = node.get_value()
-        self._client.disconnect()
+        position = self.read_values([self.POSITION_NODE % int_number])[0]
         self._logger.debug('Position = %f', position)
         return position
 
+    def get_positions(self, int_numbers):
+        """
+        Parameters
+        ----------
+            int_numbers: list
+                    numbers of the chosen objects
+
+        Returns
+        -------
+            positions: numpy array
+                    positions of the requested objects, read in a single request
+        """
+        return np.array(self.read_values([self.POSITION_NODE % i
+                                          for i in int_numbers]))
+
     def set_target_position(self, int_number, value):
         """
         Parameters
@@ -106,12 +340,9 @@ class OpcUaController():
                     value assigned to the chosen object
                     (not applied)
         """
-        self._client.connect()
-        node = self._client.get_node("ns=7;s=MAIN.f_TargetPosition_input[%d]" % int_number)
-        type_node = node.get_data_type_as_variant_type()
-        node.set_value(ua.DataValue(ua.Variant(value, type_node)))
-        target_position = node.get_value()
-        self._client.disconnect()
+        node_id = self.TARGET_NODE % int_number
+        self.write_values([node_id], [value])
+        target_position = self.read_values([node_id])[0]
         self._logger.debug('Target position = %f', target_position)
         return target_position
 
@@ -124,11 +355,7 @@ class OpcUaController():
             int_number: int
                     number of the chosen object
         """
-        self._client.connect()
-        node = self._client.get_node("ns=7;s=MAIN.b_MoveCmd[%d]" % int_number)
-        node_type = node.get_data_type_as_variant_type()
-        node.set_value(ua.DataValue(ua.Variant(True, node_type)))
-        self._client.disconnect()
+        self.write_values([self.MOVE_NODE % int_number], [True])
         self._logger.debug('Object moved successfully')
 
     def _get_command_state(self, int_number):
@@ -143,13 +370,32 @@ class OpcUaController():
             value: boolean
                     position of the requested object
         """
-        self._client.connect()
-        node = self._client.get_node("ns=7;s=MAIN.b_MoveCmd[%d]" % int_number)
-        value = node.get_value()
-        self._client.disconnect()
-        return value
+        return self.read_values([self.MOVE_NODE % int_number])[0]
+
+    def wait_for_stop_async(self, int_number, timeout=None):
+        """
+        Parameters
+        ----------
+            int_number: int
+                    number of the chosen object
+
+        Other Parameters
+        ----------------
+            timeout: float
+                    seconds after which the future fails with TimeoutError.
+                    If None there is no time limit
+
+        Returns
+        -------
+            future: concurrent.futures.Future
+                    completed when the move command of the object returns
+                    to False (notified by the server with a data change
+                    subscription)
+        """
+        return self._watch(self.MOVE_NODE % int_number,
+                           lambda value: value == False, timeout)
 
-    def wait_for_stop(self, int_number):
+    def wait_for_stop(self, int_number, timeout=None):
         """
         Function to wait for the movement to be completed
 
@@ -157,11 +403,53 @@ class OpcUaController():
         ----------
             int_number: int
                     number of the chosen object
+
+        Other Parameters
+        ----------------
+            timeout: float
+                    maximum waiting time [s]. If None STOP_TIMEOUT is used.
+                    When it expires concurrent.futures.TimeoutError is raised
+        """
+        if timeout is None:
+            timeout = self.STOP_TIMEOUT
+        self.wait_for_stop_async(int_number, timeout).result()
+
+    def wait_for_position_async(self, int_number, target, tolerance=None, timeout=None,
+                                dwell=None):
+        """
+        Parameters
+        ----------
+            int_number: int
+                    number of the chosen object
+            target: float
+                    position to reach, in the unit of the position node
+                    (mm for the actuators)
+
+        Other Parameters
+        ----------------
+            tolerance: float
+                    maximum distance from target, in the unit of target.
+                    If None OpcUaParameters.act_position_tolerance [mm]
+                    is used
+            timeout: float
+                    seconds after which the future fails with TimeoutError.
+                    If None there is no time limit
+            dwell: float
+                    seconds the position must stay within tolerance without
+                    changing. If None the first position within tolerance
+                    completes the future
+
+        Returns
+        -------
+            future: concurrent.futures.Future
+                    completed with the position of the object when it is
+                    within tolerance from target
         """
-        value = self._get_command_state(int_number)
-        while value == True:
-            time.sleep(0.1)
-            value = self._get_command_state(int_number)
+        if tolerance is None:
+            tolerance = OpcUaParameters.act_position_tolerance
+        return self._watch(self.POSITION_NODE % int_number,
+                           lambda value: abs(value - target) <= tolerance,
+                           timeout, dwell)
 
     def readActsPositions(self, n1, n2, n3):
         '''
@@ -177,10 +465,7 @@ class OpcUaController():
             acts: numpy array
                 vector of actuators position
         '''
-        act1 = self.get_position(n1)
-        act2 = self.get_position(n2)
-        act3 = self.get_position(n3)
-        return np.array([act1, act2, act3])
+        return self.get_positions([n1, n2, n3])
 
     def setActsPositions(self, n1, n2, n3, v1, v2, v3):
         '''
@@ -206,11 +491,69 @@ class OpcUaController():
     def _setAct(self, number, value):
         ''' specific function for actuators because on these
         does not work the wait for stop (not set the transition
-        from true to false by ads)'''
+        from true to false by ads): the end of the movement is the
+        position staying within act_position_tolerance [mm] from the target
+        for ACT_DWELL_TIME, waiting at most ACT_TIMEOUT'''
         self.set_target_position(number, value)
+        future = self.wait_for_position_async(number, value, timeout=self.ACT_TIMEOUT,
+                                              dwell=self.ACT_DWELL_TIME)
         self.move_object(number)
-        time.sleep(10)
-        # self.wait_for_stop(number)
+        try:
+            future.result()
+        except concurrent.futures.TimeoutError:
+            self._logger.warning('Actuator %d not in position after %d s',
+                                 number, self.ACT_TIMEOUT)
         act = self.get_position(number)
         return act
 
+
+def _isConnectionError(error):
+    ''' True for the errors of the connection or of the session, after
+    which the request can be repeated on a new session '''
+    if isinstance(error, ua.UaStatusCodeError):
+        return error.code in _SESSION_ERRORS
+    if isinstance(error, ua.UaError):
+        return isinstance(error, SocketClosedException)
+    return True
+
+
+class _DataChangeHandler():
+    ''' Subscription handler: dispatches the data change notifications
+    to the callbacks registered for the node '''
+
+    def __init__(self):
+        """The constructor """
+        self._lock = threading.Lock()
+        self._names = {}
+        self._callbacks = {}
+
+    def register(self, nodeid, node_id):
+        self._names[nodeid] = node_id
+
+    def watched(self):
+        ''' Node ids with callbacks waiting for a value '''
+        with self._lock:
+            return [node_id for node_id, callbacks in self._callbacks.items()
+                    if callbacks]
+
+    def add(self, node_id, callback):
+        with self._lock:
+            self._callbacks.setdefault(node_id, []).append(callback)
+
+    def remove(self, node_id, callback):
+        with self._lock:
+            if callback in self._callbacks.get(node_id, []):
+                self._callbacks[node_id].remove(callback)
+
+    def notify(self, node_id, value):
+        with self._lock:
+            callbacks = list(self._callbacks.get(node_id, []))
+        for callback in callbacks:
+            callback(value)
+
+    def datachange_notification(self, node, val, data):
+        self.notify(self._names.get(node.nodeid), val)
+
+    def event_notification(self, event):
+        pass
+
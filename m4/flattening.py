@@ -8,6 +8,7 @@ import numpy as np
 from astropy.io import fits as pyfits
 from m4.configuration.ott_parameters import OttParameters, M4Parameters
 from m4.utils.roi import ROI
+from m4.utils.svd_reconstructor import SvdReconstructor
 #from m4.configuration.create_ott import DMirror
 from m4.ground.timestamp import Timestamp
 from m4.configuration import config_folder_names as fold_name
@@ -30,6 +31,8 @@ class Flattenig():
         self._mirror = deformableMirror
         self._command = None
         self._flatteningWf = None
+        self._vMatrix = None
+        self._vSvd = None
 
     @staticmethod
     def _storageFolder():
@@ -39,19 +42,33 @@ class Flattenig():
     def readVMatrix(self):
         """ Function that returns V matrix (892, 811) for the segment
         """
+        if self._vMatrix is not None:
+            return self._vMatrix
         root = M4Parameters.V_MATRIX_FOR_SEGMENT_ROOT_811
         #root = Configuration.V_MATRIX_FOR_SEGMENT_ROOT_892
         hduList = pyfits.open(root)
         v_matrix = hduList[0].data
         v_matrix_cut = v_matrix[:, 0:811]
+        self._vMatrix = v_matrix_cut
         return v_matrix_cut
 
 #comando che permette di ottenere la misura del wf dall'interferometro (wf)
 #ampr = np.random.randn(25)
 #wf = np.dot(self._an._cube, ampr)
-    def flatCommand(self, wf):
+    def flatCommand(self, wf, n_modes=None, rcond=1e-15, tikhonov=0.):
         """ Returns the command to give to the actuators to level
         the wf considered
+
+        Parameters
+        ----------
+            wf: numpy masked array
+                wavefront to flatten
+            n_modes: int
+                number of modes of the reconstructor. If None all are used
+            rcond: float
+                cutoff for small singular values of the interaction matrix
+            tikhonov: float
+                Tikhonov regularization parameter
         """
         tt = Timestamp.now()
         fitsFileName = os.path.join(Flattenig._storageFolder(), tt)
@@ -67,9 +84,9 @@ class Flattenig():
         pyfits.append(os.path.join(fitsFileName, 'imgstart.fits'), wf_masked.mask.astype(int))
 
         self._an.setDetectorMask(wf_masked.mask | self._an.getMasterMask())
-        rec = self._an.getReconstructor()
+        svd = self._an.getSvdReconstructor()
 
-        amp = -np.dot(rec, wf_masked.compressed())
+        amp = -svd.solve(wf_masked.compressed(), n_modes, rcond, tikhonov)
         v_matrix_cut = self.readVMatrix()
         self._command = np.dot(v_matrix_cut, amp)
         pyfits.writeto(os.path.join(fitsFileName, 'flatDeltaCommand.fits'), self._command)
@@ -79,9 +96,9 @@ class Flattenig():
         """ Returns the synthetic wavefront using the input command
         and the same masked wavefront used to determine the command itself.
         """
-        v_matrix_cut = self.readVMatrix()
-        v_pinv = np.linalg.pinv(v_matrix_cut)
-        amp = np.dot(v_pinv, command)
+        if self._vSvd is None:
+            self._vSvd = SvdReconstructor(self.readVMatrix())
+        amp = self._vSvd.solve(command)
         sintetic_wf = np.dot(self._an.getInteractionMatrix(), amp)
 
         circular_mask = self._roi._circularMaskForSegmentCreator()
@@ -0,0 +1,167 @@
+'''
+Pipeline for the measurements made of a movement, an acquisition and the
+saving of the image: the FITS writing of a frame (and its embedding into
+the full frame) is made by the FrameWriter of the interferometer while the
+mechanics move and settle for the next one. The time spent in each stage is recorded.
+
+HOW TO USE IT::
+
+    from m4.ground.acquisition_pipeline import AcquisitionPipeline
+    with AcquisitionPipeline(interf, dove, full_frame=True) as pipe:
+        for i, pos in enumerate(positions):
+            pipe.move(ott.parabola.setPosition, pos)
+            masked_ima = pipe.acquire(n_frames, delay)
+            pipe.save('Frame_%04d.fits' % i, masked_ima)
+    pipe.report()
+'''
+
+import time
+import logging
+import threading
+from m4.ground.frame_writer import FrameWriter
+
+
+class AcquisitionPipeline():
+    '''
+    Class for overlapped move, acquire and save of interferometer images
+
+    HOW TO USE IT::
+
+        from m4.ground.acquisition_pipeline import AcquisitionPipeline
+        pipe = AcquisitionPipeline(interf, dove, dry_run=True)
+        pipe.move(ott.angleRotator.setPosition, 30)
+        pipe.save('Frame_0000.fits', pipe.acquire())
+        pipe.close()
+        pipe.report()
+    '''
+    STAGES = ('move', 'acquire', 'save')
+
+    def __init__(self, interf, folder, full_frame=False, dry_run=False,
+                 max_pending=4):
+        """The constructor """
+        self._interf = interf
+        self._folder = folder
+        self._dryRun = dry_run
+        self._logger = logging.getLogger('AcquisitionPipeline')
+        self._times = {stage: [] for stage in self.STAGES}
+        self._lock = threading.Lock()
+        self._writer = None
+        self._writerStats = None
+        if not dry_run:
+            transform = interf.intoFullFrame if full_frame else None
+            self._writer = FrameWriter(max_queue=max_pending,
+                                       transform=transform)
+            self._interf.setFrameWriter(self._writer)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def move(self, function, *args, **kwargs):
+        '''
+        Parameters
+        ----------
+            function: callable
+                function moving the mechanics (e.g. setPosition), called
+                with the other arguments
+
+        Returns
+        -------
+            result:
+                value returned by the function
+        '''
+        t0 = time.perf_counter()
+        result = function(*args, **kwargs)
+        self._record('move', time.perf_counter() - t0)
+        return result
+
+    def acquire(self, nframes=1, delay=0):
+        '''
+        Parameters
+        ----------
+            nframes: int
+                number of frames to average
+            delay: int [s]
+                delay between frames
+
+        Returns
+        -------
+            masked_ima: numpy masked array
+                interferometer image
+        '''
+        t0 = time.perf_counter()
+        masked_ima = self._interf.acquire_phasemap(nframes, delay)
+        self._record('acquire', time.perf_counter() - t0)
+        return masked_ima
+
+    def save(self, file_name, masked_ima):
+        '''
+        Queue the image for the frame writer of the interferometer. If
+        max_pending images are waiting, this waits for a free place.
+        With full_frame the writer embeds the image into the full frame.
+        The errors of the images already written are raised here
+
+        Parameters
+        ----------
+            file_name: string
+                fits file name in the pipeline folder
+            masked_ima: numpy masked array
+                image to save
+        '''
+        t0 = time.perf_counter()
+        if self._writer is not None:
+            self._writer.checkErrors()
+        if not self._dryRun:
+            self._interf.save_phasemap(self._folder, file_name, masked_ima)
+        self._record('save', time.perf_counter() - t0)
+
+    def flush(self):
+        '''
+        Wait for the writing of all the queued images (errors of the
+        frame writer are raised here)
+        '''
+        if self._writer is not None:
+            self._writer.flush()
+
+    def close(self):
+        '''
+        Flush the queue, stop the frame writer and give back to the
+        interferometer the synchronous saving
+        '''
+        if self._writer is None:
+            return
+        try:
+            self._writer.close()
+        finally:
+            self._interf.setFrameWriter(None)
+            self._writerStats = self._writer.getStats()
+            self._writer = None
+
+    def report(self):
+        '''
+        Returns
+        -------
+            report: dict
+                for each stage: number of calls, total, mean and max time [s]
+                (for save the time of queueing the image). Under 'writer'
+                the statistics of the frame writer (see
+                FrameWriter.getStats), if the images are saved
+        '''
+        report = {}
+        with self._lock:
+            for stage, times in self._times.items():
+                total = sum(times)
+                report[stage] = {'n': len(times), 'total': total,
+                                 'mean': total / len(times) if times else 0.,
+                                 'max': max(times) if times else 0.}
+        if self._writer is not None:
+            report['writer'] = self._writer.getStats()
+        elif self._writerStats is not None:
+            report['writer'] = self._writerStats
+        return report
+
+    def _record(self, stage, elapsed):
+        with self._lock:
+            self._times[stage].append(elapsed)
@@ -0,0 +1,186 @@
+'''
+Background writer of the interferometer frames: the images are put in a
+bounded queue and written by a thread (one open per file, optionally with
+the lossless compressed layout of read_data.saveMaskedImage), so that the
+acquisition is not blocked by slow disks. An optional transform (e.g. the
+embedding into the full frame) is applied by the writer thread too. When the queue is full the
+producer waits, and the time spent waiting is recorded.
+
+HOW TO USE IT::
+
+    from m4.ground.frame_writer import FrameWriter
+    with FrameWriter(max_queue=8, compress=True) as writer:
+        for i in range(n_images):
+            masked_ima = interf.acquire_phasemap(1)
+            ack = writer.write(os.path.join(dove, name), masked_ima)
+    writer.getStats()
+'''
+
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+import numpy as np
+from m4.ground import read_data
+
+
+class FrameWriter():
+    '''
+    Class for writing masked images in background
+
+    HOW TO USE IT::
+
+        from m4.ground.frame_writer import FrameWriter
+        writer = FrameWriter(compress=False, mask_dtype=int,
+                             transform=interf.intoFullFrame)
+        writer.write(fits_file_name, masked_ima)
+        writer.flush()
+        writer.close()
+    '''
+
+    def __init__(self, max_queue=8, compress=False, mask_dtype=np.uint8,
+                 nthreads=1, transform=None):
+        """The constructor """
+        self._compress = compress
+        self._maskDtype = mask_dtype
+        self._transform = transform
+        self._logger = logging.getLogger('FrameWriter')
+        self._queue = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        self._errors = []
+        self._stats = {'queued': 0, 'written': 0, 'failed': 0,
+                       'max_depth': 0, 'blocked': 0, 'blocked_time': 0.,
+                       'max_blocked_time': 0., 'write_time': 0.,
+                       'transform_time': 0.}
+        self._closed = False
+        self._threads = [threading.Thread(target=self._run, daemon=True)
+                         for i in range(nthreads)]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, fits_file_name, masked_image, mask_dtype=None):
+        '''
+        Queue an image for writing: if the queue is full this waits for a
+        free place. The image must not be modified until it is written
+
+        Parameters
+        ----------
+            fits_file_name: string
+                fits file path where to save the image
+            masked_image: numpy masked array
+                image to save
+            mask_dtype: numpy dtype
+                dtype of the mask HDU of the uncompressed layout.
+                If None the mask_dtype of the writer is used
+
+        Returns
+        -------
+            ack: concurrent.futures.Future
+                done with the file name when the image is on disk (or with
+                the exception raised by the writing)
+        '''
+        if self._closed:
+            raise RuntimeError('FrameWriter is closed')
+        ack = Future()
+        t0 = time.perf_counter()
+        if mask_dtype is None:
+            mask_dtype = self._maskDtype
+        self._queue.put((fits_file_name, masked_image, mask_dtype, ack))
+        waited = time.perf_counter() - t0
+        with self._lock:
+            self._stats['queued'] += 1
+            self._stats['max_depth'] = max(self._stats['max_depth'],
+                                           self._queue.qsize())
+            if waited > 1e-3:
+                self._stats['blocked'] += 1
+                self._stats['blocked_time'] += waited
+                self._stats['max_blocked_time'] = max(
+                    self._stats['max_blocked_time'], waited)
+        return ack
+
+    def flush(self):
+        '''
+        Wait for the writing of all the queued images. The first error of
+        the writer since the last flush is raised here
+        '''
+        self._queue.join()
+        self.checkErrors()
+
+    def checkErrors(self):
+        '''
+        Raise the first error of the writer since the last check, without
+        waiting for the queued images (e.g. to stop a long acquisition
+        as soon as the disk is not writable)
+        '''
+        with self._lock:
+            errors, self._errors = self._errors, []
+        if len(errors) > 0:
+            raise errors[0]
+
+    def close(self):
+        '''
+        Flush the queue and stop the writer
+        '''
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.flush()
+        finally:
+            for thread in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+
+    def getStats(self):
+        '''
+        Returns
+        -------
+            stats: dict
+                number of images queued, written and failed, images in the
+                queue now and at most, number of writes that waited for a
+                free place in the queue with the total and max waiting
+                time [s], total writing and transform time [s]
+        '''
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.unfinished_tasks
+        return stats
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            fits_file_name, masked_image, mask_dtype, ack = item
+            t0 = time.perf_counter()
+            try:
+                if self._transform is not None:
+                    masked_image = self._transform(masked_image)
+                    t1 = time.perf_counter()
+                    with self._lock:
+                        self._stats['transform_time'] += t1 - t0
+                    t0 = t1
+                read_data.saveMaskedImage(fits_file_name, masked_image,
+                                          self._compress, mask_dtype)
+            except Exception as e:
+                self._logger.error('Error writing %s: %s', fits_file_name, e)
+                with self._lock:
+                    self._stats['failed'] += 1
+                    self._errors.append(e)
+                ack.set_exception(e)
+            else:
+                with self._lock:
+                    self._stats['written'] += 1
+                    self._stats['write_time'] += time.perf_counter() - t0
+                ack.set_result(fits_file_name)
+            finally:
+                self._queue.task_done()
@@ -251,6 +251,42 @@ def congrid2D(img, newdims, method='linear', centre=False, minusone=False):
     newimg = interp((xg,yg))
     return newimg
 
+def block_stats(img, block):
+    '''
+    Statistics of the valid points in square blocks of an image or of a cube,
+    computed with a reshape of the frames (the pixels beyond the last
+    complete block are discarded)
+
+    Parameters
+    ----------
+        img: masked array [..., H, W]
+            image or cube of images
+        block: int
+            block size in pixels
+
+    Returns
+    -------
+        count: numpy array [..., H/block, W/block]
+            number of valid points in each block
+        mean: masked array [..., H/block, W/block]
+            mean of the valid points, masked for empty blocks
+        std: masked array [..., H/block, W/block]
+            standard deviation of the valid points, masked for empty blocks
+    '''
+    nr = img.shape[-2] // block
+    nc = img.shape[-1] // block
+    shape = img.shape[:-2] + (nr, block, nc, block)
+    data = np.ma.getdata(img)[..., :nr * block, :nc * block].reshape(shape)
+    valid = np.invert(np.ma.getmaskarray(img)[..., :nr * block,
+                                              :nc * block]).reshape(shape)
+    count = valid.sum(axis=(-3, -1))
+    nn = np.maximum(count, 1)
+    mean = np.where(valid, data, 0).sum(axis=(-3, -1)) / nn
+    dev = np.where(valid, data - mean[..., :, None, :, None], 0)
+    std = np.sqrt((dev**2).sum(axis=(-3, -1)) / nn)
+    empty = count == 0
+    return count, np.ma.masked_array(mean, empty), np.ma.masked_array(std, empty)
+
 def spiral_pos(nstep, step):
     p = np.array([0,0])
     pp = []
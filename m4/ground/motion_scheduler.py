@@ -0,0 +1,136 @@
+'''
+Scheduler for the movements of the OTT axes. The axes are separate PLC
+drives: the moves requested together are issued concurrently and the
+call returns when all of them are completed.
+
+HOW TO USE IT::
+
+    from m4.ground.motion_scheduler import MotionScheduler
+    ms = MotionScheduler(ott)
+    ms.moveTo(parabolaSlider=844, referenceMirrorSlider=844, angleRotator=30)
+    futures = ms.submit(parabola=par, referenceMirror=rm)
+    positions = ms.wait(futures)
+    ms.close()
+
+or, to stop the worker threads on exit::
+
+    with MotionScheduler(ott) as ms:
+        ms.moveTo(parabolaSlider=844)
+'''
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MotionScheduler():
+    '''
+    Class for the concurrent movement of the OTT axes
+
+    HOW TO USE IT::
+
+        from m4.ground.motion_scheduler import MotionScheduler
+        ms = MotionScheduler(ott)
+        positions = ms.moveTo({'parabola': par, 'referenceMirror': rm})
+        ms.close()
+    '''
+    AXES = ('parabolaSlider', 'referenceMirrorSlider', 'angleRotator',
+            'parabola', 'referenceMirror', 'm4Exapode')
+
+    def __init__(self, ott):
+        """The constructor """
+        self._ott = ott
+        self._logger = logging.getLogger('MotionScheduler')
+        self._executor = ThreadPoolExecutor(max_workers=len(self.AXES))
+        self._axisLocks = {axis: threading.Lock() for axis in self.AXES}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''
+        Wait for the moves in progress and stop the worker threads.
+        No move can be submitted after close
+        '''
+        self._executor.shutdown(wait=True)
+
+    def submit(self, targets=None, **kwargs):
+        '''
+        Parameters
+        ----------
+            targets: dict
+                target position of each axis to move (keys in AXES)
+
+        Other Parameters
+        ----------------
+            kwargs:
+                target positions given as keywords, e.g. parabola=pos
+
+        Returns
+        -------
+            futures: dict
+                future of each axis, with the position reached as result
+        '''
+        targets = dict(targets or {}, **kwargs)
+        for axis in targets:
+            if axis not in self.AXES:
+                raise ValueError('Unknown OTT axis: %s' % axis)
+        futures = {}
+        for axis, position in targets.items():
+            self._logger.debug('Move %s to %s', axis, position)
+            futures[axis] = self._executor.submit(self._move, axis, position)
+        return futures
+
+    def wait(self, futures):
+        '''
+        Parameters
+        ----------
+            futures: dict
+                futures returned by submit
+
+        Returns
+        -------
+            positions: dict
+                position reached by each axis. If a move failed the error
+                is raised after the completion of all the others
+        '''
+        positions = {}
+        error = None
+        for axis, future in futures.items():
+            try:
+                positions[axis] = future.result()
+            except Exception as e:
+                self._logger.error('Move of %s failed: %s', axis, e)
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+        return positions
+
+    def moveTo(self, targets=None, **kwargs):
+        '''
+        Move the axes to the target configuration, concurrently
+
+        Parameters
+        ----------
+            targets: dict
+                target position of each axis to move (keys in AXES)
+
+        Other Parameters
+        ----------------
+            kwargs:
+                target positions given as keywords, e.g. parabola=pos
+
+        Returns
+        -------
+            positions: dict
+                position reached by each axis
+        '''
+        return self.wait(self.submit(targets, **kwargs))
+
+    def _move(self, axis, position):
+        with self._axisLocks[axis]:
+            return getattr(self._ott, axis).setPosition(position)
@@ -2,6 +2,7 @@
 Authors
   - C. Selmi:  written in 2022
 '''
+from m4.ground.motion_scheduler import MotionScheduler
 
 class OttConfigurations():
     '''
@@ -11,6 +12,8 @@ class OttConfigurations():
         ott, interf = start.create_ott('../M4/Data/SYSCONFData/Config.yaml')
         from m4.ground.ott_configurations import OttConfigurations
         oc = OttConfigurations(ott)
+        oc.move_to_central_view(True)
+        oc.close()
     '''
 
     def __init__(self, ott):
@@ -19,7 +22,13 @@ class OttConfigurations():
         self._angle = None
         self._rslide = None
         self._pslide = None
+        self._scheduler = MotionScheduler(ott)
 
+    def close(self):
+        '''
+        Stop the threads moving the axes
+        '''
+        self._scheduler.close()
 
     def move_to_segment_view(self, number_of_segment, RM_in):
         '''move the ott configuration to a specific section of the DM
@@ -31,13 +40,13 @@ class OttConfigurations():
             RM: boolean
                 Reference mirror in (True) or not (False)
         '''
-        self._ott.parabolaSlider.setPosition(844)
+        targets = {'parabolaSlider': 844,
+                   'angleRotator': 30+60*(number_of_segment-1)}
         if RM_in==True:
-            self._ott.referenceMirrorSlider.setPosition(844)
+            targets['referenceMirrorSlider'] = 844
         if RM_in==False:
-            self._ott.referenceMirrorSlider.setPosition(0)
-
-        self._ott.angleRotator.setPosition(30+60*(number_of_segment-1))
+            targets['referenceMirrorSlider'] = 0
+        self._scheduler.moveTo(targets)
         return
 
     def move_to_central_view(self, RM_in):
@@ -48,13 +57,12 @@ class OttConfigurations():
             RM: boolean
                 Reference mirror in (True) or not (False)
         '''
-        self._ott.parabolaSlider.setPosition(0)
+        targets = {'parabolaSlider': 0, 'angleRotator': 0}
         if RM_in==True:
-            self._ott.referenceMirrorSlider.setPosition(0)
+            targets['referenceMirrorSlider'] = 0
         if RM_in==False:
-            self._ott.referenceMirrorSlider.setPosition(999)
-
-        self._ott.angleRotator.setPosition(0)
+            targets['referenceMirrorSlider'] = 999
+        self._scheduler.moveTo(targets)
         return
 
     def get_configuration(self):
@@ -11,8 +11,30 @@ Function for reading file fits::
     or
     amplitude, mode_vector, cmd_matrix = read_data.readTypeFromFitsName(
                                 'ampName.fits', 'mvec.fits', 'cmdMatrix.fits')
+    or, for a list of interferometer frames
+    cube = read_data.FrameLoader(file_list).cube()
+    or, to pack a list of frames in a single h5 file and read it back
+    file_name = read_data.InterferometerConverter.fromFileListToH5Cube(
+                                file_list, folder, 'frames.h5')
+    with read_data.H5FrameCube(file_name) as fc:
+        image = fc.frame(i)
+        cube = fc[10:20]
+    or, for cubes [pixel, pixel, nimages] read lazily from disk
+    read_data.saveMaskedCube(fits_file_path, cube)
+    with read_data.openMaskedCube(fits_file_path) as cube:
+        image = cube[:, :, i]
+    or, to save a frame opening the file once (optionally compressed)
+    read_data.saveMaskedImage(fits_file_path, masked_image, compress=True)
+    or, for cubes [pixel, pixel, nimages] built frame by frame
+    builder = read_data.CubeBuilder(nframes)
+    builder.append(image)
+    cube = builder.cube()
 """
 import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from astropy.io import fits as pyfits
 import numpy as np
 import h5py
@@ -20,6 +42,10 @@ from m4.type.modalAmplitude import ModalAmplitude
 from m4.type.modalBase import ModalBase
 from m4.type.modesVector import ModesVector
 
+# lossless compression (no quantization) of the saveMaskedImage data
+COMPRESSION_TYPE = 'GZIP_2'
+MASK_BITS_HDU = 'MASKBITS'
+
 
 def read_phasemap(file_path):
     ''' per leggere i tre formati di dati interferometrici
@@ -33,6 +59,243 @@ def read_phasemap(file_path):
         image = InterferometerConverter.fromPhaseCam4020(file_path)
     return image
 
+class FrameLoader():
+    '''
+    Class for reading lists of interferometer frames (fits, 4D or h5) with a
+    pool of threads. The frames are written directly in data and mask arrays
+    [nframes, pixel, pixel] allocated once, and the next chunk of frames can
+    be read in background while the current one is processed.
+
+    HOW TO USE IT::
+
+        from m4.ground.read_data import FrameLoader
+        loader = FrameLoader(file_list, nthreads=8)
+        cube = loader.cube()
+        or
+        for cube in loader.chunks(100):
+            ...
+    '''
+
+    def __init__(self, file_list, nthreads=8):
+        """The constructor """
+        self._fileList = list(file_list)
+        self._nthreads = nthreads
+        self._shape = None
+        self._dtype = None
+
+    def __len__(self):
+        return len(self._fileList)
+
+    def cube(self, start=0, stop=None):
+        '''
+        Parameters
+        ----------
+            start: int
+                index of the first frame to read
+            stop: int
+                index after the last frame to read. If None all the frames
+
+        Returns
+        -------
+            cube: numpy masked array [nframes, pixel, pixel]
+                cube of the frames
+        '''
+        if stop is None:
+            stop = len(self._fileList)
+        with ThreadPoolExecutor(self._nthreads) as pool:
+            cube = self._collect(self._submit(pool, start, stop))
+        return cube
+
+    def chunks(self, chunk_size=100, prefetch=True):
+        '''
+        Parameters
+        ----------
+            chunk_size: int
+                number of frames of each cube
+            prefetch: boolean
+                if True the next chunk is read while the current is used
+
+        Yields
+        ------
+            cube: numpy masked array [chunk_size, pixel, pixel]
+                cube of the frames of the chunk
+        '''
+        nframes = len(self._fileList)
+        starts = list(range(0, nframes, chunk_size))
+        with ThreadPoolExecutor(self._nthreads) as pool:
+            pending = None
+            for j, start in enumerate(starts):
+                if pending is None:
+                    pending = self._submit(pool, start, start + chunk_size)
+                cube = self._collect(pending)
+                pending = None
+                if prefetch and j + 1 < len(starts):
+                    pending = self._submit(pool, starts[j + 1],
+                                           starts[j + 1] + chunk_size)
+                yield cube
+
+    def _submit(self, pool, start, stop):
+        names = self._fileList[start:stop]
+        first = None
+        if self._shape is None:
+            first = read_phasemap(names[0])
+            self._shape = first.shape
+            self._dtype = first.dtype
+        data = np.empty((len(names),) + self._shape, dtype=self._dtype)
+        mask = np.empty((len(names),) + self._shape, dtype=bool)
+        if first is not None:
+            data[0] = first.data
+            mask[0] = np.ma.getmaskarray(first)
+        futures = [pool.submit(self._readInto, name, data, mask, i)
+                   for i, name in enumerate(names) if first is None or i > 0]
+        return data, mask, futures
+
+    @staticmethod
+    def _collect(pending):
+        data, mask, futures = pending
+        for future in futures:
+            future.result()
+        return np.ma.masked_array(data, mask=mask, copy=False)
+
+    @staticmethod
+    def _readInto(file_path, data, mask, i):
+        image = read_phasemap(file_path)
+        if image.shape != data.shape[1:]:
+            raise ValueError('Frame %s has shape %s instead of %s' %
+                             (file_path, image.shape, data.shape[1:]))
+        data[i] = image.data
+        mask[i] = np.ma.getmaskarray(image)
+
+class CubeBuilder():
+    '''
+    Class for filling a masked cube [pixel, pixel, nframes] frame by frame.
+    Data and mask are allocated once at the first frame (in memory or
+    memory mapped in a folder) and each frame is written in place, so
+    frames can also be produced by several threads.
+
+    HOW TO USE IT::
+
+        from m4.ground.read_data import CubeBuilder
+        cb = CubeBuilder(nframes)
+        for ima in images:
+            cb.append(ima)
+        cube = cb.cube()
+        or
+        cube = CubeBuilder(len(file_list)).map(read_phasemap, file_list)
+    '''
+
+    def __init__(self, nframes, dtype=None, memmap_folder=None):
+        """The constructor (if dtype is None the type of the first frame
+        is used) """
+        self._nframes = nframes
+        self._dtype = dtype
+        self._memmapFolder = memmap_folder
+        self._data = None
+        self._mask = None
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._nframes
+
+    def setFrame(self, i, image):
+        '''
+        Parameters
+        ----------
+            i: int
+                index of the frame in the cube
+            image: numpy masked array [pixel, pixel]
+                frame to write
+        '''
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    self._allocate(np.shape(image), np.ma.getdata(image).dtype)
+        if np.shape(image) != self._data.shape[1:]:
+            raise ValueError('Frame %d has shape %s instead of %s' %
+                             (i, np.shape(image), self._data.shape[1:]))
+        self._data[i] = np.ma.getdata(image)
+        self._mask[i] = np.ma.getmaskarray(image)
+
+    def append(self, image):
+        '''
+        Parameters
+        ----------
+            image: numpy masked array [pixel, pixel]
+                frame to write after the last one appended
+        '''
+        with self._lock:
+            i = self._count
+            self._count += 1
+        if i >= self._nframes:
+            raise IndexError('The cube is full (%d frames)' % self._nframes)
+        self.setFrame(i, image)
+
+    def map(self, func, items, nthreads=1):
+        '''
+        Parameters
+        ----------
+            func: function
+                function returning the frame [pixel, pixel] of an item
+            items: list
+                one item for each frame of the cube
+            nthreads: int
+                number of threads calling func
+
+        Returns
+        -------
+            cube: numpy masked array [pixel, pixel, nframes]
+                cube of the frames
+        '''
+        def produce(i, item):
+            self.setFrame(i, func(item))
+        if nthreads > 1:
+            with ThreadPoolExecutor(nthreads) as pool:
+                for future in [pool.submit(produce, i, item)
+                               for i, item in enumerate(items)]:
+                    future.result()
+        else:
+            for i, item in enumerate(items):
+                produce(i, item)
+        return self.cube()
+
+    def cube(self):
+        '''
+        Returns
+        -------
+            cube: numpy masked array [pixel, pixel, nframes]
+                cube of the frames, without copying them
+        '''
+        if self._data is None:
+            raise ValueError('No frame has been written')
+        return np.ma.masked_array(np.moveaxis(self._data, 0, -1),
+                                  mask=np.moveaxis(self._mask, 0, -1),
+                                  copy=False)
+
+    def _allocate(self, frame_shape, frame_dtype):
+        shape = (self._nframes,) + tuple(frame_shape)
+        dtype = frame_dtype if self._dtype is None else self._dtype
+        if self._memmapFolder is None:
+            data = np.empty(shape, dtype=dtype)
+            mask = np.ones(shape, dtype=bool)
+        else:
+            open_memmap = np.lib.format.open_memmap
+            data = open_memmap(self._memmapFile('cube_data_'),
+                               mode='w+', dtype=dtype, shape=shape)
+            mask = open_memmap(self._memmapFile('cube_mask_'),
+                               mode='w+', dtype=bool, shape=shape)
+            mask[:] = True
+        # _data is set last: the other threads check it without the lock
+        self._mask = mask
+        self._data = data
+
+    def _memmapFile(self, prefix):
+        ''' New file in the memmap folder, not shared with other builders '''
+        fd, file_name = tempfile.mkstemp(suffix='.npy', prefix=prefix,
+                                         dir=self._memmapFolder)
+        os.close(fd)
+        return file_name
+
 ### Generiche
 def readFits_data(fits_file_path):
     '''
@@ -61,9 +324,51 @@ def readFits_maskedImage(fits_file_path):
     masked_array: numpy masked array
     '''
     hduList = pyfits.open(fits_file_path)
+    if MASK_BITS_HDU in hduList:
+        mask_hdu = hduList[MASK_BITS_HDU]
+        mask = np.unpackbits(mask_hdu.data, axis=-1,
+                             count=mask_hdu.header['MASKCOLS'])
+        return np.ma.masked_array(hduList[1].data, mask=mask.astype(bool))
     masked_array = np.ma.masked_array(hduList[0].data, mask=hduList[1].data.astype(bool))
     return masked_array
 
+def saveMaskedImage(fits_file_path, masked_image, compress=False,
+                    mask_dtype=np.uint8, overwrite=False):
+    '''
+    Saves a masked image opening the file once. The default layout is the
+    usual one (data in the primary hdu, mask in the second); with compress
+    the data are stored in a lossless tile compressed hdu after an empty
+    primary one and the mask is bit packed (1 bit per pixel). Both are
+    read by readFits_maskedImage
+
+    Parameters
+    ----------
+    fits_file_path: string
+        fits file path where to save the image
+    masked_image: numpy masked array
+        image to save
+    compress: boolean
+        if True the compressed layout is used
+    mask_dtype: numpy dtype
+        type of the mask hdu in the default layout
+    '''
+    data = np.ma.getdata(masked_image)
+    mask = np.ma.getmaskarray(masked_image)
+    if compress:
+        header = pyfits.Header()
+        header['MASKPACK'] = True
+        header['MASKCOLS'] = mask.shape[-1]
+        hduList = pyfits.HDUList([
+            pyfits.PrimaryHDU(),
+            pyfits.CompImageHDU(data, compression_type=COMPRESSION_TYPE,
+                                quantize_level=0.),
+            pyfits.ImageHDU(np.packbits(mask, axis=-1), header,
+                            name=MASK_BITS_HDU)])
+    else:
+        hduList = pyfits.HDUList([pyfits.PrimaryHDU(data),
+                                  pyfits.ImageHDU(mask.astype(mask_dtype))])
+    hduList.writeto(fits_file_path, overwrite=overwrite)
+
 def readFitsSlimImage(fits_file_path):
     '''
     Parameters
@@ -83,6 +388,172 @@ def readFitsSlimImage(fits_file_path):
 ###
 
 
+def saveMaskedCube(fits_file_path, cube, header=None, overwrite=False,
+                   packed=True):
+    '''
+    Saves a masked cube [pixel, pixel, nimages] in a fits file that can be
+    read lazily with readMaskedCube: the images are stored one after the
+    other (data hdu [nimages, pixel, pixel]) and the mask is bit packed
+    (1 bit per pixel). With packed=False the cube is saved as before, with
+    data [pixel, pixel, nimages] and mask in the second hdu, for the
+    readers of the data hdu outside this package
+
+    Parameters
+    ----------
+    fits_file_path: string
+        fits file path where to save the cube
+    cube: numpy masked array [pixel, pixel, nimages]
+        cube to save
+    header: astropy header
+        header of the data hdu
+    packed: boolean
+        if True the lazy layout is used, otherwise the old one
+    '''
+    if header is None:
+        header = pyfits.Header()
+    else:
+        header = header.copy()
+    if not packed:
+        pyfits.writeto(fits_file_path, cube.data, header, overwrite=overwrite)
+        pyfits.append(fits_file_path, np.ma.getmaskarray(cube).astype(int))
+        return
+    header['MASKPACK'] = True
+    data = np.ascontiguousarray(np.moveaxis(cube.data, -1, 0))
+    mask = np.moveaxis(np.ma.getmaskarray(cube), -1, 0)
+    pyfits.writeto(fits_file_path, data, header, overwrite=overwrite)
+    pyfits.append(fits_file_path, np.packbits(mask, axis=-1))
+
+def readMaskedCube(fits_file_path):
+    '''
+    Parameters
+    ----------
+    fits_file_path: string
+        fits file path of the cube to read
+
+    Returns
+    -------
+    cube: LazyMaskedCube or numpy masked array [pixel, pixel, nimages]
+        lazy cube if the file was written by saveMaskedCube, otherwise
+        masked array of the cube saved with mask as second hdu. The lazy
+        cube keeps the file open until its close is called (see
+        openMaskedCube)
+    '''
+    hduList = pyfits.open(fits_file_path, memmap=True)
+    if hduList[0].header.get('MASKPACK', False):
+        return LazyMaskedCube(hduList)
+    with hduList:
+        cube = np.ma.masked_array(np.array(hduList[0].data),
+                                  mask=hduList[1].data.astype(bool))
+    return cube
+
+@contextmanager
+def openMaskedCube(fits_file_path):
+    '''
+    readMaskedCube for a with block, at the end of which the file is closed
+
+    HOW TO USE IT::
+
+        with read_data.openMaskedCube(fits_file_path) as cube:
+            image = cube[:, :, i]
+    '''
+    cube = readMaskedCube(fits_file_path)
+    try:
+        yield cube
+    finally:
+        closeMaskedCube(cube)
+
+def closeMaskedCube(cube):
+    '''
+    Closes the file of a cube returned by readMaskedCube (nothing to do
+    for the cubes in memory)
+    '''
+    if isinstance(cube, LazyMaskedCube):
+        cube.close()
+
+
+class LazyMaskedCube():
+    '''
+    Class for the masked cubes [pixel, pixel, nimages] saved by
+    saveMaskedCube. Data and bit packed mask are memory mapped, so that
+    only the images used by the analysis are read from disk.
+
+    HOW TO USE IT::
+
+        from m4.ground import read_data
+        cube = read_data.readMaskedCube(fits_file_path)
+        image = cube[:, :, i]
+        masked_array_cube = cube.toMaskedArray()
+    '''
+
+    def __init__(self, hduList):
+        """The constructor """
+        self._hduList = hduList
+        self._data = hduList[0].data
+        self._mask = hduList[1].data
+        nimages, npix0, npix1 = self._data.shape
+        self.shape = (npix0, npix1, nimages)
+        self.ndim = 3
+        self.header = hduList[0].header
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 3:
+            return self.toMaskedArray()[key]
+        key = key + (slice(None),) * (3 - len(key))
+        k0, k1, k2 = key
+        basic = (slice, int, np.integer)
+        if isinstance(k2, list):
+            k2 = np.array(k2)
+        if not isinstance(k0, basic) or not isinstance(k1, basic) \
+                or not (isinstance(k2, basic) or
+                        (isinstance(k2, np.ndarray) and k2.ndim == 1)):
+            return self.toMaskedArray()[key]
+        data = self._data[k2, k0, k1]
+        mask = np.unpackbits(self._mask[k2, k0], axis=-1,
+                             count=self.shape[1])[..., k1].astype(bool)
+        if isinstance(k2, np.ndarray) and not isinstance(k0, slice) \
+                and isinstance(k1, slice):
+            # numpy puts first the dimension of non adjacent advanced indices
+            pass
+        elif not isinstance(k2, (int, np.integer)):
+            data = np.moveaxis(data, 0, -1)
+            mask = np.moveaxis(mask, 0, -1)
+        return np.ma.masked_array(data, mask=mask)
+
+    @property
+    def data(self):
+        ''' Memory mapped data [pixel, pixel, nimages] '''
+        return np.moveaxis(self._data, 0, -1)
+
+    @property
+    def mask(self):
+        ''' Mask [pixel, pixel, nimages] '''
+        mask = np.unpackbits(self._mask, axis=-1, count=self.shape[1])
+        return np.moveaxis(mask.astype(bool), 0, -1)
+
+    def toMaskedArray(self):
+        '''
+        Returns
+        -------
+        cube: numpy masked array [pixel, pixel, nimages]
+            the whole cube loaded in memory
+        '''
+        return np.ma.masked_array(np.array(self.data), mask=self.mask)
+
+    def close(self):
+        ''' Close the fits file '''
+        self._hduList.close()
+
 def readTypeFromFitsName(amplitude_fits_file_name,
                          mode_vector_fits_file_name,
                          cmd_matrix_fits_file_name):
@@ -146,7 +617,7 @@ class InterferometerConverter():
         file = h5py.File(h5filename, 'r')
         genraw = file['measurement0']['genraw']['data']
         data = np.array(genraw)
-        mask = np.zeros(data.shape, dtype=np.bool)
+        mask = np.zeros(data.shape, dtype=bool)
         mask[np.where(data == data.max())] = True
         ima = np.ma.masked_array(data * 632.8e-9, mask=mask)
         return ima
@@ -215,3 +686,138 @@ class InterferometerConverter():
         hf = h5py.File(file_name, 'w')
         hf.create_dataset('Data', data=data)
         return file_name
+
+    @staticmethod
+    def fromFileListToH5Cube(file_list, folder, h5name, dtype=np.float32,
+                             compression_opts=4):
+        ''' Function for packing a list of frames (fits, 4D or h5) in a
+        single chunked and compressed h5 file, readable with H5FrameCube
+
+        Parameters
+        ----------
+        file_list: list
+            list of the frame file paths
+        folder: string
+            folder path for new data
+        h5name: string
+            name for h5 data
+        dtype: numpy dtype
+            dtype of the stored frames
+        compression_opts: int
+            gzip compression level
+
+        Returns
+        -------
+        file_name: string
+            finale path name
+        '''
+        file_name = os.path.join(folder, h5name)
+        loader = FrameLoader(file_list)
+        nframes = len(loader)
+        if nframes == 0:
+            raise OSError('No frames to pack in %s' % file_name)
+        with h5py.File(file_name, 'w') as hf:
+            data = None
+            i = 0
+            for cube in loader.chunks(20):
+                if data is None:
+                    shape = cube.shape[1:]
+                    packed = np.packbits(cube.mask[0], axis=-1).shape
+                    data = hf.create_dataset('data', (nframes,) + shape,
+                                             dtype=dtype, chunks=(1,) + shape,
+                                             compression='gzip', shuffle=True,
+                                             compression_opts=compression_opts)
+                    mask = hf.create_dataset('mask', (nframes,) + packed,
+                                             dtype=np.uint8, chunks=(1,) + packed,
+                                             compression='gzip',
+                                             compression_opts=compression_opts)
+                data[i:i + cube.shape[0]] = cube.data
+                mask[i:i + cube.shape[0]] = np.packbits(cube.mask, axis=-1)
+                i += cube.shape[0]
+            hf.create_dataset('timestamps', data=np.array(
+                [os.path.getmtime(name) for name in file_list]))
+            hf.create_dataset('filenames', data=np.array(
+                [os.path.basename(name) for name in file_list], dtype='S'))
+            hf.attrs['FRAMEW'] = shape[-1]
+        return file_name
+
+
+class H5FrameCube():
+    '''
+    Class for reading the frames packed by
+    InterferometerConverter.fromFileListToH5Cube. Only the requested frames
+    are read from disk.
+
+    HOW TO USE IT::
+
+        from m4.ground.read_data import H5FrameCube
+        with H5FrameCube(file_name) as fc:
+            image = fc.frame(0)
+            cube = fc[100:200]
+            times = fc.timestamps()
+    '''
+
+    def __init__(self, file_name):
+        """The constructor """
+        self._file = h5py.File(file_name, 'r')
+        self._data = self._file['data']
+        self._mask = self._file['mask']
+        self._width = self._file.attrs['FRAMEW']
+
+    def __len__(self):
+        return self._data.shape[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        ''' Close the h5 file '''
+        self._file.close()
+
+    @property
+    def shape(self):
+        return self._data.shape
+
+    def frame(self, i):
+        '''
+        Parameters
+        ----------
+        i: int
+            index of the frame
+
+        Returns
+        -------
+        image: numpy masked array
+            frame i
+        '''
+        mask = np.unpackbits(self._mask[i], axis=-1,
+                             count=self._width).astype(bool)
+        return np.ma.masked_array(self._data[i], mask=mask)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            mask = np.unpackbits(self._mask[key], axis=-1,
+                                 count=self._width).astype(bool)
+            return np.ma.masked_array(self._data[key], mask=mask)
+        return self.frame(key)
+
+    def timestamps(self):
+        '''
+        Returns
+        -------
+        timestamps: numpy array
+            modification time of the original frame files
+        '''
+        return self._file['timestamps'][()]
+
+    def fileNames(self):
+        '''
+        Returns
+        -------
+        file_names: list
+            names of the original frame files
+        '''
+        return [name.decode() for name in self._file['filenames'][()]]
@@ -0,0 +1,175 @@
+'''
+Append only store of the time series of a measurement (e.g. zernike
+coefficients and temperatures of the monitoring). Each series is a
+resizable dataset of an HDF5 file written in single writer / multiple
+reader mode: every row is flushed as it is appended, so the file is
+always readable (also during the acquisition or after a crash) and the
+readers can ask only for the rows after the ones they already have.
+
+HOW TO USE IT::
+
+    from m4.ground.time_series_store import TimeSeriesStore, readTimeSeries
+    with TimeSeriesStore(os.path.join(dove, 'timeseries.h5')) as store:
+        for i in range(n_images):
+            store.append(zernike=zer_vect, temperature=temp_vect)
+    zern = readTimeSeries(file_name, 'zernike')
+    new_rows = readTimeSeries(file_name, 'zernike', start=len(zern))
+'''
+
+import os
+import numpy as np
+import h5py
+from astropy.io import fits as pyfits
+
+FILE_NAME = 'timeseries.h5'
+CHUNK_ROWS = 256
+
+
+class TimeSeriesStore():
+    '''
+    Class for appending rows to the time series of an HDF5 file
+
+    HOW TO USE IT::
+
+        from m4.ground.time_series_store import TimeSeriesStore
+        store = TimeSeriesStore(file_name)
+        store.append(zernike=zer_vect, temperature=temp_vect)
+        store.close()
+    '''
+
+    def __init__(self, file_name):
+        """The constructor """
+        self._fileName = file_name
+        self._file = None
+        self._datasets = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        if len(self._datasets) == 0:
+            return 0
+        return min(dset.shape[0] for dset in self._datasets.values())
+
+    def append(self, **rows):
+        '''
+        Add a row to each series. The series are created at the first
+        call, with the length of the given rows, and the following calls
+        must give the same series
+
+        Parameters
+        ----------
+            rows: numpy array [n]
+                row to append, for each series name
+        '''
+        if self._file is None:
+            self._create(rows)
+        elif set(rows) != set(self._datasets):
+            raise KeyError('Series %s instead of %s' %
+                           (sorted(rows), sorted(self._datasets)))
+        for name, row in rows.items():
+            dset = self._datasets[name]
+            n = dset.shape[0]
+            dset.resize(n + 1, axis=0)
+            dset[n] = np.ravel(row)
+        self._file.flush()
+
+    def read(self, name, start=0):
+        '''
+        Parameters
+        ----------
+            name: string
+                series name
+            start: int
+                first row to read
+
+        Returns
+        -------
+            series: numpy array [nrows, n]
+                rows of the series from start
+        '''
+        return self._datasets[name][start:]
+
+    def toFits(self, folder):
+        '''
+        Saves each series in the fits file folder/name.fits, as
+        written by the measurements before this store
+
+        Parameters
+        ----------
+            folder: string
+                folder where to save the fits files
+        '''
+        for name, dset in self._datasets.items():
+            pyfits.writeto(os.path.join(folder, name + '.fits'), dset[()],
+                           overwrite=True)
+
+    def close(self):
+        '''
+        Close the file
+        '''
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _create(self, rows):
+        self._file = h5py.File(self._fileName, 'w', libver='latest')
+        for name, row in rows.items():
+            ncols = np.size(row)
+            self._datasets[name] = self._file.create_dataset(
+                name, shape=(0, ncols), maxshape=(None, ncols), dtype=float,
+                chunks=(CHUNK_ROWS, ncols))
+        self._file.swmr_mode = True
+
+
+def readTimeSeries(file_name, name, start=0):
+    '''
+    Reads a series of a TimeSeriesStore file, also while it is written
+
+    Parameters
+    ----------
+        file_name: string
+            HDF5 file path
+        name: string
+            series name
+        start: int
+            first row to read
+
+    Returns
+    -------
+        series: numpy array [nrows, n]
+            rows of the series from start
+    '''
+    with h5py.File(file_name, 'r', libver='latest', swmr=True) as hf:
+        dset = hf[name]
+        dset.refresh()
+        return dset[start:]
+
+
+def readSeriesOrFits(folder, name, start=0):
+    '''
+    Reads a series from the TimeSeriesStore file of a measurement folder,
+    or from the fits file name.fits of the measurements saved before it
+
+    Parameters
+    ----------
+        folder: string
+            measurement folder
+        name: string
+            series name (e.g. 'zernike' or 'temperature')
+        start: int
+            first row to read
+
+    Returns
+    -------
+        series: numpy array [nrows, n]
+            rows of the series from start
+    '''
+    file_name = os.path.join(folder, FILE_NAME)
+    if os.path.isfile(file_name):
+        return readTimeSeries(file_name, name, start)
+    with pyfits.open(os.path.join(folder, name + '.fits')) as hduList:
+        return np.array(hduList[0].data[start:])
@@ -0,0 +1,333 @@
+'''
+Persistent index of the tracking numbers contained in the data folder.
+It replaces the walk of the whole OPT_DATA_FOLDER tree: each tracking number
+is stored with its data folder, path, number of files and time of the first
+and last file, so that lookups and range queries are O(log n). The file statistics of a
+tracking number are refreshed when it is looked up, if the modification
+time of its folder has changed since it was indexed (e.g. a folder created
+empty by tracking_number_folder and filled by the measurement). In the same
+way a data folder is listed again by scan only if its modification time
+has changed since it was synchronized.
+
+Only the tracking numbers at root/folder/tn are indexed by rebuild and
+sync: the deeper ones are found by tracking_number_folder with a walk of
+the data folder and then added to the catalog.
+
+HOW TO USE IT::
+
+    from m4.ground import tracking_number_catalog as tnc
+    cat = tnc.catalog()
+    path = cat.findPath(tt)
+    tnlist = cat.scan(tt0, tt1)
+
+To rebuild the catalog from a terminal::
+
+    python -m m4.ground.tracking_number_catalog /path/to/OPTData
+'''
+
+import os
+import re
+import sqlite3
+import argparse
+from contextlib import contextmanager
+from m4.configuration import config_folder_names
+
+CATALOG_NAME = '.tncatalog.sqlite'
+_TN_PATTERN = re.compile(r'^\d{8}_\d{6}')
+
+_catalogs = {}
+
+
+def catalog(root=None):
+    '''
+    Parameters
+    ----------
+        root: string
+            data folder to index. If None OPT_DATA_FOLDER is used
+
+    Returns
+    -------
+        cat: object
+            TrackingNumberCatalog of the data folder
+    '''
+    if root is None:
+        root = config_folder_names.OPT_DATA_FOLDER
+    if root is None:
+        raise OSError('No configuration has been loaded!')
+    root = os.path.abspath(root)
+    if root not in _catalogs:
+        _catalogs[root] = TrackingNumberCatalog(root)
+    return _catalogs[root]
+
+
+class TrackingNumberCatalog():
+    '''
+    Class for the SQLite index of the tracking numbers in a data folder
+
+    HOW TO USE IT::
+
+        from m4.ground.tracking_number_catalog import TrackingNumberCatalog
+        cat = TrackingNumberCatalog(root)
+        cat.rebuild()
+        folder = cat.findFolder(tt)
+    '''
+
+    def __init__(self, root, catalog_file_path=None):
+        """The constructor """
+        self._root = os.path.abspath(root)
+        if catalog_file_path is None:
+            catalog_file_path = os.path.join(self._root, CATALOG_NAME)
+        self._catalogFilePath = catalog_file_path
+        with self._connect() as conn:
+            columns = [r[1] for r in conn.execute('PRAGMA table_info(tracknum)')]
+            if len(columns) > 0 and 'mtime' not in columns:
+                # catalog written without the folder times: index again
+                conn.execute('DROP TABLE tracknum')
+            conn.execute('CREATE TABLE IF NOT EXISTS tracknum ('
+                         'tn TEXT NOT NULL, folder TEXT NOT NULL, '
+                         'path TEXT NOT NULL, nfiles INTEGER, '
+                         'first REAL, last REAL, mtime REAL, '
+                         'PRIMARY KEY (tn, folder))')
+            conn.execute('CREATE INDEX IF NOT EXISTS folder_tn '
+                         'ON tracknum (folder, tn)')
+            conn.execute('CREATE TABLE IF NOT EXISTS synced ('
+                         'folder TEXT PRIMARY KEY, mtime REAL)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self._catalogFilePath, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def rebuild(self):
+        '''
+        Index again all the tracking numbers in the data folder
+
+        Returns
+        -------
+            ntn: int
+                number of tracking numbers in the catalog
+        '''
+        rows = []
+        synced = []
+        for folder in self._dataFolders():
+            synced.append((folder, self._folderTime(folder)))
+            for tn in self._listTrackingNumbers(folder):
+                rows.append(self._row(os.path.join(self._root, folder, tn)))
+        with self._connect() as conn:
+            conn.execute('DELETE FROM tracknum')
+            conn.execute('DELETE FROM synced')
+            conn.executemany('INSERT INTO tracknum VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             rows)
+            conn.executemany('INSERT INTO synced VALUES (?, ?)', synced)
+        return len(rows)
+
+    def sync(self, folder):
+        '''
+        Add to the catalog the tracking numbers of a data folder which
+        are not indexed yet (e.g. the ones created by the interferometer)
+
+        Parameters
+        ----------
+            folder: string
+                data folder name (e.g. 'OPDImages')
+        '''
+        mtime = self._folderTime(folder)
+        with self._connect() as conn:
+            known = set(r[0] for r in conn.execute(
+                'SELECT tn FROM tracknum WHERE folder = ?', (folder,)))
+        for tn in self._listTrackingNumbers(folder):
+            if tn not in known:
+                self.add(os.path.join(self._root, folder, tn))
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO synced VALUES (?, ?)',
+                         (folder, mtime))
+
+    def add(self, tn_path):
+        '''
+        Add or update a tracking number folder in the catalog
+
+        Parameters
+        ----------
+            tn_path: string
+                complete path of the tracking number folder
+        '''
+        row = self._row(os.path.abspath(tn_path))
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO tracknum '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?)', row)
+
+    def remove(self, tn, folder=None):
+        '''
+        Remove a tracking number from the catalog
+
+        Parameters
+        ----------
+            tn: string
+                tracking number
+            folder: string
+                data folder name. If None the tracking number is removed
+                from all the folders
+        '''
+        with self._connect() as conn:
+            if folder is None:
+                conn.execute('DELETE FROM tracknum WHERE tn = ?', (tn,))
+            else:
+                conn.execute('DELETE FROM tracknum WHERE tn = ? AND folder = ?',
+                             (tn, folder))
+
+    def lookup(self, tn):
+        '''
+        Parameters
+        ----------
+            tn: string
+                tracking number
+
+        Returns
+        -------
+            rows: list
+                list of (tn, folder, path, nfiles, first, last) of the
+                existing folders containing the tracking number
+        '''
+        with self._connect() as conn:
+            rows = conn.execute('SELECT * FROM tracknum WHERE tn = ? '
+                                'ORDER BY folder', (tn,)).fetchall()
+        valid = []
+        for r in rows:
+            if not os.path.isdir(r[2]):
+                self.remove(r[0], r[1])
+            elif os.stat(r[2]).st_mtime != r[6]:
+                self.add(r[2])
+                valid.append(self._row(r[2]))
+            else:
+                valid.append(r)
+        if len(valid) == 0:
+            valid = self._probe(tn)
+        return [r[:6] for r in valid]
+
+    def findPath(self, tn):
+        '''
+        Parameters
+        ----------
+            tn: string
+                tracking number
+
+        Returns
+        -------
+            path: string
+                complete path of the tracking number folder, None if not found
+        '''
+        rows = self.lookup(tn)
+        if len(rows) == 0:
+            return None
+        return rows[0][2]
+
+    def findFolder(self, tn):
+        '''
+        Parameters
+        ----------
+            tn: string
+                tracking number
+
+        Returns
+        -------
+            folder: string
+                data folder containing the tracking number, None if not found
+        '''
+        rows = self.lookup(tn)
+        if len(rows) == 0:
+            return None
+        return rows[0][1]
+
+    def scan(self, tn0, tn1, folder=None):
+        '''
+        Parameters
+        ----------
+            tn0: string
+                first tracking number
+            tn1: string
+                last tracking number
+            folder: string
+                data folder name. If None the folder of tn0 is used
+
+        Returns
+        -------
+            tnlist: list
+                sorted list of the tracking numbers in the folder
+                between tn0 and tn1
+        '''
+        if folder is None:
+            folder = self.findFolder(tn0)
+            if folder is None:
+                return []
+        with self._connect() as conn:
+            synced = conn.execute('SELECT mtime FROM synced WHERE folder = ?',
+                                  (folder,)).fetchone()
+        if synced is None or synced[0] != self._folderTime(folder):
+            self.sync(folder)
+        query = ('SELECT tn FROM tracknum WHERE folder = ? '
+                 'AND tn BETWEEN ? AND ? ORDER BY tn')
+        with self._connect() as conn:
+            tnlist = [r[0] for r in conn.execute(query, (folder, tn0, tn1))]
+        return tnlist
+
+    def _probe(self, tn):
+        ''' Search the tracking number in the data folders and add it '''
+        rows = []
+        for folder in self._dataFolders():
+            path = os.path.join(self._root, folder, tn)
+            if os.path.isdir(path):
+                self.add(path)
+                rows.append(self._row(path))
+        return rows
+
+    def _dataFolders(self):
+        return sorted(e.name for e in os.scandir(self._root)
+                      if e.is_dir() and not e.name.startswith('.'))
+
+    def _folderTime(self, folder):
+        return os.stat(os.path.join(self._root, folder)).st_mtime
+
+    def _listTrackingNumbers(self, folder):
+        return sorted(e.name for e in os.scandir(os.path.join(self._root, folder))
+                      if e.is_dir() and _TN_PATTERN.match(e.name))
+
+    def _row(self, tn_path):
+        tn = os.path.basename(tn_path)
+        folder = os.path.relpath(os.path.dirname(tn_path), self._root)
+        mtime = os.stat(tn_path).st_mtime
+        nfiles, first, last = _folderStats(tn_path)
+        return (tn, folder, tn_path, nfiles, first, last, mtime)
+
+
+def _folderStats(path):
+    ''' Number of files and modification time of the first and last one '''
+    nfiles = 0
+    times = []
+    for entry in os.scandir(path):
+        if entry.is_dir():
+            sub_nfiles, sub_first, sub_last = _folderStats(entry.path)
+            nfiles += sub_nfiles
+            times.extend(t for t in (sub_first, sub_last) if t is not None)
+        else:
+            nfiles += 1
+            times.append(entry.stat().st_mtime)
+    if len(times) == 0:
+        return nfiles, None, None
+    return nfiles, min(times), max(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Rebuild the tracking numbers catalog of a data folder')
+    parser.add_argument('root', help='data folder to index (e.g. OPTData)')
+    args = parser.parse_args()
+    ntn = TrackingNumberCatalog(args.root).rebuild()
+    print('%d tracking numbers indexed in %s' % (ntn, args.root))
+
+
+if __name__ == '__main__':
+    main()
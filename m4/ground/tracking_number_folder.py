@@ -9,11 +9,16 @@ HOW TO USE IT::
     path, tt = tnf.createFolderToStoreMeasurements(store_in_folder)
     or
     path = tnf.findTrackingNumberPath(tt)
+
+The tracking numbers are looked up in the catalog of
+m4.ground.tracking_number_catalog before walking the data folder.
 '''
 
 import os
 import fnmatch
+import sqlite3
 from m4.ground.timestamp import Timestamp
+from m4.ground import tracking_number_catalog
 from m4.configuration import config_folder_names
 
 def createFolderToStoreMeasurements(store_in_folder):
@@ -38,8 +43,21 @@ def createFolderToStoreMeasurements(store_in_folder):
         _error('Directory %s exists', dove)
     else:
         os.makedirs(dove)
+        _addToCatalog(dove)
     return dove, tt
 
+def _addToCatalog(dove):
+    rootPath = config_folder_names.OPT_DATA_FOLDER
+    if rootPath is None:
+        return
+    rootPath = os.path.abspath(rootPath)
+    if os.path.commonpath([rootPath, os.path.abspath(dove)]) != rootPath:
+        return
+    try:
+        tracking_number_catalog.catalog(rootPath).add(dove)
+    except (OSError, sqlite3.Error):
+        pass
+
 def _error(txt, data):
     raise OSError(txt % data)
 
@@ -59,12 +77,18 @@ def findTrackingNumberPath(tt):
     rootPath = config_folder_names.OPT_DATA_FOLDER
     if rootPath is None:
         raise OSError('No configuration has been loaded!')
+    try:
+        final_path = tracking_number_catalog.catalog(rootPath).findPath(tt)
+    except (OSError, sqlite3.Error):
+        final_path = None
+    if final_path is not None:
+        return final_path
     pattern = tt
 
     for root, dirs, files in os.walk(rootPath):
         for directory in fnmatch.filter(dirs, pattern):
             final_path = os.path.join(root, directory)
-    try:
-        return final_path
-    except:
+    if final_path is None:
         raise OSError('Tracking number %s does not exists' % tt)
+    _addToCatalog(final_path)
+    return final_path
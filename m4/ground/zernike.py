@@ -20,13 +20,27 @@ HOW TO USE IT::
     from m4.ground import zernike
     coeff, mat = zernike.zernikeFit(img, zernike_index_vector)
     surf_image = zernike.zernikeSurface(img, coef, mat)
+
+    or, for many frames sharing the same mask
+    fitter = zernike.ZernikeFitter(maxsize=4)
+    coeff, mat = fitter.fit(img, zernike_index_vector)
+
+    or, for a whole cube of frames [nframes, pixel, pixel]
+    coeff, residual_cube = zernike.zernikeFitCube(cube, zernike_index_vector,
+                                                  residual=True)
+    surf_cube = zernike.zernikeSurfaceCube(cube, coeff, zernike_index_vector)
 """
 
 ### Libraries
 
+import math
+import hashlib
+import threading
+from functools import lru_cache
+from collections import OrderedDict
 import numpy as np
 from m4.ground import geo
-fac = np.math.factorial
+fac = math.factorial
 
 def zernikeFit(img, zernike_index_vector, qpupil=True):
     '''
@@ -43,16 +57,7 @@ def zernikeFit(img, zernike_index_vector, qpupil=True):
         vector of zernike coefficients
     mat: numpy array
     '''
-    img1 = img.data
-    mask = np.invert(img.mask).astype(int)
-    if qpupil==True:
-        x, y, r, xx, yy = geo.qpupil(mask)
-    else:
-        x, y, r, xx, yy = geo.qpupil_circle(img)
-    mm = (mask==1)
-    coeff = _surf_fit(xx[mm], yy[mm], img1[mm], zernike_index_vector)
-    mat = _getZernike(xx[mm], yy[mm], zernike_index_vector)
-    return coeff, mat
+    return _fitter.fit(img, zernike_index_vector, qpupil=qpupil)
 
 def zernikeFitAuxmask(img, auxmask, zernike_index_vector):
     '''
@@ -71,14 +76,128 @@ def zernikeFitAuxmask(img, auxmask, zernike_index_vector):
         vector of zernike coefficients
     mat: numpy array
     '''
-    img1 = img.data
-    mask = np.invert(img.mask).astype(int)
-    x, y, r, xx, yy = geo.qpupil(auxmask)
-    mm = (mask==1)
-    coeff = _surf_fit(xx[mm], yy[mm], img1[mm], zernike_index_vector)
-    mat = _getZernike(xx[mm], yy[mm], zernike_index_vector)
-    return coeff, mat
+    return _fitter.fit(img, zernike_index_vector, auxmask=auxmask)
+
+
+class ZernikeFitter():
+    '''
+    Class for fitting Zernike polynomials on images sharing the same mask.
+    The Zernike matrix and its pseudo inverse are computed once for each
+    (mask, pupil geometry, modes) and kept in a LRU cache, so that the fit
+    of each following frame is a single matrix-vector product.
 
+    HOW TO USE IT::
+
+        from m4.ground.zernike import ZernikeFitter
+        fitter = ZernikeFitter(maxsize=4, dtype=np.float32)
+        for img in cube:
+            coeff, mat = fitter.fit(img, zernike_index_vector)
+    '''
+
+    def __init__(self, maxsize=4, dtype=float):
+        """The constructor """
+        self._maxsize = maxsize
+        self._dtype = dtype
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def fit(self, img, zernike_index_vector, qpupil=True, auxmask=None):
+        '''
+        Parameters
+        ----------
+        img: numpy masked array
+            image for zernike fit
+        zernike_index_vector: numpy array
+            vector containing the index of Zernike modes to be fitted starting from 1
+        qpupil: boolean
+            if True the pupil is computed with geo.qpupil, else with geo.qpupil_circle
+        auxmask: numpy array
+            zero for masked point. If not None it is used to define the pupil
+
+        Returns
+        -------
+        coeff: numpy array [m]
+            vector of zernike coefficients
+        mat: numpy array
+            zernike matrix on the valid points of img (read only)
+        '''
+        mm = np.invert(np.ma.getmaskarray(img))
+        mat, inv = self.basis(img, zernike_index_vector, qpupil, auxmask)
+        coeff = np.dot(inv, img.data[mm])
+        return coeff, mat
+
+    def basis(self, img, zernike_index_vector, qpupil=True, auxmask=None):
+        '''
+        Parameters
+        ----------
+        img: numpy masked array
+            image whose mask defines the valid points
+        zernike_index_vector: numpy array
+            vector containing the index of Zernike modes starting from 1
+        qpupil: boolean
+            if True the pupil is computed with geo.qpupil, else with geo.qpupil_circle
+        auxmask: numpy array
+            zero for masked point. If not None it is used to define the pupil
+
+        Returns
+        -------
+        mat: numpy array [npoints, nmodes]
+            zernike matrix on the valid points of img (read only)
+        inv: numpy array [nmodes, npoints]
+            pseudo inverse of mat (read only)
+        '''
+        mm = np.invert(np.ma.getmaskarray(img))
+        zlist = tuple(int(j) for j in np.atleast_1d(zernike_index_vector))
+        key = self._key(mm, zlist, qpupil, auxmask)
+        with self._lock:
+            entry = self._cache.pop(key, None)
+            if entry is not None:
+                self._cache[key] = entry
+                return entry
+        entry = self._computeBasis(img, mm, zlist, qpupil, auxmask,
+                                   self._dtype)
+        with self._lock:
+            while len(self._cache) >= self._maxsize:
+                self._cache.popitem(last=False)
+            self._cache[key] = entry
+        return entry
+
+    def clear(self):
+        ''' Remove all the cached matrices '''
+        with self._lock:
+            self._cache.clear()
+
+    @staticmethod
+    def _key(mm, zlist, qpupil, auxmask):
+        hh = hashlib.sha1(np.packbits(mm)).hexdigest()
+        if auxmask is not None:
+            aux = np.packbits(np.asarray(auxmask) == 1)
+            geometry = 'auxmask' + hashlib.sha1(aux).hexdigest()
+        elif qpupil == True:
+            geometry = 'qpupil'
+        else:
+            geometry = 'circle'
+        return (mm.shape, hh, geometry, zlist)
+
+    @staticmethod
+    def _computeBasis(img, mm, zlist, qpupil, auxmask, dtype):
+        if auxmask is not None:
+            x, y, r, xx, yy = geo.qpupil(auxmask)
+        elif qpupil == True:
+            x, y, r, xx, yy = geo.qpupil(mm.astype(int))
+        else:
+            x, y, r, xx, yy = geo.qpupil_circle(img)
+        mat = _getZernike(xx[mm], yy[mm], zlist, dtype=dtype)
+        q, r = np.linalg.qr(mat)
+        if np.linalg.matrix_rank(r) < r.shape[1]:
+            inv = np.linalg.pinv(mat)
+        else:
+            inv = np.linalg.solve(r, q.T)
+        mat.flags.writeable = False
+        inv.flags.writeable = False
+        return mat, inv
+
+_fitter = ZernikeFitter()
 
 
 def zernikeSurface(img, coef, mat):
@@ -108,6 +227,85 @@ def zernikeSurface(img, coef, mat):
     surf = np.ma.masked_array(zernike_surface, mask=img.mask)
     return surf
 
+def zernikeFitCube(cube, zernike_index_vector, qpupil=True, residual=False):
+    '''
+    Parameters
+    ----------
+    cube: numpy masked array [nframes, pixel, pixel]
+        cube of images for zernike fit
+    zernike_index_vector: numpy array
+        vector containing the index of Zernike modes to be fitted starting from 1
+    qpupil: boolean
+        if True the pupil is computed with geo.qpupil, else with geo.qpupil_circle
+    residual: boolean
+        if True the cube with the zernike surfaces removed is also returned
+
+    Returns
+    -------
+    coeff: numpy array [nframes, nmodes]
+        zernike coefficients of each frame
+    residual_cube: numpy masked array [nframes, pixel, pixel]
+        cube minus the fitted zernike surfaces (only if residual is True)
+    '''
+    nframes = cube.shape[0]
+    data = cube.data.reshape(nframes, -1)
+    nmodes = np.size(zernike_index_vector)
+    coeff = np.zeros((nframes, nmodes))
+    if residual:
+        surface = np.zeros(cube.shape)
+        flat = surface.reshape(nframes, -1)
+    for idx in _maskGroups(cube):
+        mm = np.invert(np.ma.getmaskarray(cube[idx[0]]))
+        mat, inv = _fitter.basis(cube[idx[0]], zernike_index_vector, qpupil)
+        points = np.ix_(idx, np.flatnonzero(mm))
+        coeff[idx] = np.dot(data[points], inv.T)
+        if residual:
+            # surface from the basis of this mask, without a second lookup
+            flat[points] = np.dot(coeff[idx], mat.T)
+    if not residual:
+        return coeff
+    surf = np.ma.masked_array(surface, mask=np.ma.getmaskarray(cube))
+    residual_cube = cube - surf
+    return coeff, residual_cube
+
+def zernikeSurfaceCube(cube, coeff, zernike_index_vector, qpupil=True):
+    '''
+    Parameters
+    ----------
+    cube: numpy masked array [nframes, pixel, pixel]
+        cube of images used for the zernike fit
+    coeff: numpy array [nframes, nmodes]
+        zernike coefficients of each frame
+    zernike_index_vector: numpy array
+        vector containing the index of Zernike modes used for the fit
+    qpupil: boolean
+        if True the pupil is computed with geo.qpupil, else with geo.qpupil_circle
+
+    Returns
+    -------
+    surf: numpy masked array [nframes, pixel, pixel]
+        zernike surfaces generated by coeff
+    '''
+    nframes = cube.shape[0]
+    surface = np.zeros(cube.shape)
+    flat = surface.reshape(nframes, -1)
+    for idx in _maskGroups(cube):
+        mm = np.invert(np.ma.getmaskarray(cube[idx[0]]))
+        mat, inv = _fitter.basis(cube[idx[0]], zernike_index_vector, qpupil)
+        flat[np.ix_(idx, np.flatnonzero(mm))] = np.dot(coeff[idx], mat.T)
+    surf = np.ma.masked_array(surface, mask=np.ma.getmaskarray(cube))
+    return surf
+
+def _maskGroups(cube):
+    ''' Returns the list of frame indices sharing the same mask '''
+    nframes = cube.shape[0]
+    masks = np.packbits(np.ma.getmaskarray(cube).reshape(nframes, -1), axis=1)
+    groups = OrderedDict()
+    for i in range(nframes):
+        key = hashlib.sha1(masks[i]).hexdigest()
+        groups.setdefault(key, []).append(i)
+    return [np.array(idx) for idx in groups.values()]
+
 def _surf_fit(xx, yy, zz, zlist, ordering='noll'):
     A = _getZernike(xx, yy, zlist, ordering)
     B = np.transpose(zz.copy())
@@ -116,27 +314,73 @@ def _surf_fit(xx, yy, zz, zlist, ordering='noll'):
 
 
 ### Init functions
-def _getZernike(xx,yy,zlist,ordering='noll'):
+def _getZernike(xx, yy, zlist, ordering='noll', dtype=float):
+    '''
+    Parameters
+    ----------
+    xx, yy: numpy array
+        coordinates of the points, normalized to the pupil radius
+    zlist: numpy array
+        vector containing the index of Zernike modes starting from 1
+    ordering: string
+        'noll' or 'ansi'
+    dtype: numpy dtype
+        dtype of the returned matrix (e.g. np.float32)
+
+    Returns
+    -------
+    mat: numpy array [npoints, nmodes]
+        zernike matrix
+    '''
     if min(zlist) ==0:
         #print("Zernike index must be greater or equal to 1")
         raise OSError("Zernike index must be greater or equal to 1")
-    rho = np.sqrt(yy**2 + xx**2)
-    phi = np.arctan2(yy, xx)
-
-    #rho /= scale_factor
-    zkm = []
-    norm = []
-    #for k, j in enumerate([0, 1, 2, 4]):
+    mnlist = []
     for j in zlist:
-
         if ordering=='noll':
             m, n = _l2mn_noll(j)
             cnorm = np.sqrt(n+1) if m == 0 else np.sqrt(2.0*(n+1))
         elif ordering=='ansi': #da rivedere ordine e normalizzazione
             m, n = _l2mn_ansi(j)
             cnorm = 1
-        zkm.append(cnorm*_zernike(m, n, rho, phi))
-    return np.transpose(np.array(zkm))
+        mnlist.append((m, n, cnorm))
+
+    xx = np.asarray(xx, dtype=dtype)
+    yy = np.asarray(yy, dtype=dtype)
+    rho = np.sqrt(yy**2 + xx**2)
+    phi = np.arctan2(yy, xx)
+
+    # powers of rho and azimuthal terms are computed once for all the modes
+    nmax = max(n for m, n, cnorm in mnlist)
+    rho_pow = [np.ones_like(rho)]
+    for p in range(nmax):
+        rho_pow.append(rho_pow[-1] * rho)
+    azimuth = {}
+    zkm = np.empty((len(mnlist),) + rho.shape, dtype=rho.dtype)
+    for i, (m, n, cnorm) in enumerate(mnlist):
+        rad = np.zeros_like(rho)
+        for p, c in _radialCoefficients(abs(m), n):
+            rad += (cnorm * c) * rho_pow[p]
+        if m != 0:
+            if m not in azimuth:
+                azimuth[m] = np.cos(m * phi) if m > 0 else np.sin(-m * phi)
+            rad *= azimuth[m]
+        zkm[i] = rad
+    return np.transpose(zkm)
+
+@lru_cache(maxsize=None)
+def _radialCoefficients(m, n):
+    '''
+    Returns the tuple of (power, coefficient) of the radial polynomial
+    of the Zernike (m, n)
+    '''
+    if (n < 0 or m < 0 or abs(m) > n):
+        raise ValueError
+    if ((n-m) % 2):
+        return ()
+    return tuple((n - 2*k, (-1.0)**k * fac(n-k) /
+                  (fac(k) * fac((n+m)//2 - k) * fac((n-m)//2 - k)))
+                 for k in range((n-m)//2+1))
 
 def _zernike_rad(m, n, rho):
     """
@@ -150,16 +394,10 @@ def _zernike_rad(m, n, rho):
     >>> zernike_rad(3, 5, 0.12345)
     -0.007382104685237683
     """
-
-    if (n < 0 or m < 0 or abs(m) > n):
-        raise ValueError
-
-    if ((n-m) % 2):
-        return rho*0.0
-
-    pre_fac = lambda k: (-1.0)**k * fac(n-k) / ( fac(k) * fac( int((n+m)/2.0 - k) ) * fac( int((n-m)/2.0 - k) ) )
-
-    return sum(pre_fac(k) * rho**(n-2.0*k) for k in range((n-m)//2+1))
+    rad = rho*0.0
+    for p, c in _radialCoefficients(m, n):
+        rad = rad + c * rho**p
+    return rad
 
 def _zernike(m, n, rho, phi):
     """
@@ -106,7 +106,7 @@ class Runner():
             tau_vector = np.arange(1, 60)
             rms, quad, n_meas = n.analysis_whit_structure_function(data_file_path,
                                                            tau_vector,
-                                                           h5_or_fits=None, nzern=None)
+                                                           nzern=None)
 
             rms_nm = rms * 1e9
             x = tau_vector * (1 / Interferometer.BURST_FREQ)
@@ -63,6 +63,7 @@ def showCommandMatrixBeforeCalibration(command_amp_vector):
     mat, cmdList = cal.createCmatAndCmdList(command_amp_vector,
                                             np.append(OttParameters.PARABOLA_DOF,
                                                       OttParameters.RM_DOF))
+    cal.close()
     plt.clf()
     x_old = np.arange(mat.shape[0])
     x = ['par_piston', 'par_tip', 'par_tilt', 'rm_tip', 'rm_tilt']
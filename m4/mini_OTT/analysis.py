@@ -13,6 +13,7 @@ from m4.configuration import config_folder_names as fold_name
 from m4.configuration.ott_parameters import Interferometer
 from m4.ground import read_data
 from m4.ground import zernike
+from m4.ground import time_series_store
 
 class Analysis():
     '''
@@ -203,8 +204,8 @@ class Analysis():
         #'/mnt/m4storage/Data/M4Data/OPTData/OPD_series/'
         path = os.path.join(where, self.tt)
         D = sorted(glob.glob(os.path.join(path, self.tt[0:-6]) + '*'))
-        zern = pyfits.open(os.path.join(path, 'zernike.fits'))[0].data
-        temp = pyfits.open(os.path.join(path, 'temperature.fits'))[0].data
+        zern = time_series_store.readSeriesOrFits(path, 'zernike')
+        temp = time_series_store.readSeriesOrFits(path, 'temperature')
         t0 = str(D[0][1+D[0].rfind('_'):D[0].find('.')])
         hs = float(t0[0: 2])*3600
         ms = float(t0[2: 4])*60
@@ -267,14 +268,11 @@ class Analysis():
         #D = D1[0:-np.int(len(D1)/8)]
         D = D1[0:-2]
 
-        cube = None
+        builder = read_data.CubeBuilder(len(D))
         for name in D:
             print(name)
-            image = read_data.readFits_maskedImage(name)
-            if cube is None:
-                cube = image
-            else:
-                cube = np.ma.dstack((cube, image))
+            builder.append(read_data.readFits_maskedImage(name))
+        cube = builder.cube()
         mean =  np.ma.mean(cube, axis=2)
 
         rms_list = []
@@ -21,8 +21,9 @@ from m4.configuration.ott_parameters import OpcUaParameters, Interferometer, Sou
 from m4.devices.opc_ua_controller import OpcUaController
 from m4.configuration import config_folder_names as fold_name
 from m4.ott_calibrator_and_aligner import OttCalibAndAlign
-from m4.ground import tracking_number_folder, zernike
+from m4.ground import tracking_number_folder, zernike, read_data, time_series_store
 from m4.ground.timestamp import Timestamp
+from m4.ground.frame_writer import FrameWriter
 import playsound
 from m4.configuration import ott_status
 
@@ -59,7 +60,7 @@ class Measurements():
         tna = main.align_PARAndRM(self._ott, self._interf, tnc, zern2corrf, dofidf, n_frames)
 
 
-    def opticalMonitoring(self, n_images, delay, start_delay = 0):
+    def opticalMonitoring(self, n_images, delay, start_delay = 0, compress=False):
         '''
         Acquisition of images for monitoring
 
@@ -71,6 +72,9 @@ class Measurements():
             waiting time (in seconds) between two image acquisitions
         start_delay: int[s]
             waiting time before starting the measure (in seconds) 
+        compress: boolean
+            if True the images are saved with lossless compressed data and
+            bit packed mask (see read_data.saveMaskedImage)
 
         Returns
         ------
@@ -90,30 +94,28 @@ class Measurements():
         print('waiting {:n} s...'.format(start_delay))
         time.sleep(start_delay)
         print('start measuring')
-        zer_list = []
-        temp_list = []
+        store_file_name = os.path.join(dove, time_series_store.FILE_NAME)
         t0 = time.time()
-        for i in range(n_images):
-            ti = time.time()
-            dt = ti - t0
-            masked_ima = self._interf.acquire_phasemap(1)
-            temp_vect = self._ott.temperature.getTemperature()
-            name = Timestamp.now() + '.fits'
-            fits_file_name = os.path.join(dove, name)
-            pyfits.writeto(fits_file_name, masked_ima.data)
-            pyfits.append(fits_file_name, masked_ima.mask.astype(np.uint8))
-
-            coef, mat = zernike.zernikeFit(masked_ima, np.arange(10) + 1)
-            vect = np.append(dt, coef)
-            zer_list.append(vect)
-            temp_list.append(temp_vect)
-
-            fits_file_name = os.path.join(dove, 'zernike.fits')
-            pyfits.writeto(fits_file_name, np.array(zer_list), overwrite=True)
-            fits_file_name = os.path.join(dove, 'temperature.fits')
-            pyfits.writeto(fits_file_name, np.array(temp_list), overwrite=True)
-
-            time.sleep(delay)
+        with FrameWriter(compress=compress) as writer, \
+                time_series_store.TimeSeriesStore(store_file_name) as store:
+            for i in range(n_images):
+                ti = time.time()
+                dt = ti - t0
+                masked_ima = self._interf.acquire_phasemap(1)
+                temp_vect = self._ott.temperature.getTemperature()
+                name = Timestamp.now() + '.fits'
+                fits_file_name = os.path.join(dove, name)
+                # a failed writing (e.g. disk full) stops the monitoring
+                writer.checkErrors()
+                writer.write(fits_file_name, masked_ima)
+
+                coef, mat = zernike.zernikeFit(masked_ima, np.arange(10) + 1)
+                vect = np.append(dt, coef)
+                store.append(zernike=vect, temperature=temp_vect)
+
+                time.sleep(delay)
+            store.toFits(dove)
+        self._logger.info('Frame writer: %s', writer.getStats())
         return tt
 
     def diffOpticalMonitoring(self, n_repetition, delayshort, delaylong):
@@ -138,34 +140,30 @@ class Measurements():
         store_in_folder = fold_name.OPD_SERIES_ROOT_FOLDER
         dove, tt = tracking_number_folder.createFolderToStoreMeasurements(store_in_folder)
 
-        zer_list = []
-        temp_list = []
+        store_file_name = os.path.join(dove, time_series_store.FILE_NAME)
         t0 = time.time()
-        for i in range(n_repetition):
-            for i in range(2):
-                ti = time.time()
-                dt = ti - t0
-                masked_ima = self._interf.acquire_phasemap(1)
-                temp_vect = self._ott.temperature.getTemperature()
-                name = Timestamp.now() + '.fits'
-                fits_file_name = os.path.join(dove, name)
-                pyfits.writeto(fits_file_name, masked_ima.data)
-                pyfits.append(fits_file_name, masked_ima.mask.astype(int))
-
-                coef, mat = zernike.zernikeFit(masked_ima, np.arange(10) + 1)
-                vect = np.append(dt, coef)
-                zer_list.append(vect)
-                temp_list.append(temp_vect)
+        with FrameWriter(mask_dtype=int) as writer, \
+                time_series_store.TimeSeriesStore(store_file_name) as store:
+            for i in range(n_repetition):
+                for i in range(2):
+                    ti = time.time()
+                    dt = ti - t0
+                    masked_ima = self._interf.acquire_phasemap(1)
+                    temp_vect = self._ott.temperature.getTemperature()
+                    name = Timestamp.now() + '.fits'
+                    fits_file_name = os.path.join(dove, name)
+                    writer.checkErrors()
+                    writer.write(fits_file_name, masked_ima)
 
-                fits_file_name = os.path.join(dove, 'zernike.fits')
-                pyfits.writeto(fits_file_name, np.array(zer_list), overwrite=True)
-                fits_file_name = os.path.join(dove, 'temperature.fits')
-                pyfits.writeto(fits_file_name, np.array(temp_list), overwrite=True)
-                print('Waiting for next frame in pair')
-                time.sleep(delayshort)
+                    coef, mat = zernike.zernikeFit(masked_ima, np.arange(10) + 1)
+                    vect = np.append(dt, coef)
+                    store.append(zernike=vect, temperature=temp_vect)
+                    print('Waiting for next frame in pair')
+                    time.sleep(delayshort)
 
-            print('Waiting for next iterations')
-            time.sleep(delaylong)
+                print('Waiting for next iterations')
+                time.sleep(delaylong)
+            store.toFits(dove)
 
         return tt
 
@@ -305,8 +303,8 @@ class Measurements():
                     masked_ima = self._interf.acquire_phasemap(nframes)
                     name = Timestamp.now() + '.fits'
                     fits_file_name = os.path.join(dove, name)
-                    pyfits.writeto(fits_file_name, masked_ima.data)
-                    pyfits.append(fits_file_name, masked_ima.mask.astype(int))
+                    read_data.saveMaskedImage(fits_file_name, masked_ima,
+                                              mask_dtype=int)
 
                     coef, mat = zernike.zernikeFit(masked_ima, np.arange(10) + 1)
                     zern_vect.append(coef)
@@ -1,5 +1,7 @@
 import os
 import glob
+import sqlite3
+from functools import lru_cache
 import numpy as np
 import jdcal
 from astropy.io import fits as pyfits
@@ -9,10 +11,14 @@ start_onlydata.create_conf_paths(os.environ['PYOTTCONF'])
 from m4.configuration import config_folder_names as foldname
 from m4.ground import zernike
 from m4.ground import geo
+from m4.ground import tracking_number_catalog as tnc
+from m4.ground import time_series_store
 from m4.ground.read_data import InterferometerConverter
 from matplotlib.pyplot import *
 import psutil
 import scipy.fft
+import scipy.ndimage
+import scipy.signal
 import scipy.stats as stats
 ic = InterferometerConverter()
 #a= foldname.BASE_PATH+'M4Data/OPTData/'  #'/mnt/data/M4/Data/M4Data/OPTData/'
@@ -81,9 +87,16 @@ def findTracknum(tn):
     '''
 
     #a= '/mnt/data/M4/Data/M4Data/OPTData/'
+    try:
+        return tnc.catalog(a).findFolder(tn)
+    except (OSError, sqlite3.Error):
+        # e.g. read only data folder: no catalog
+        pass
     lsdir = os.listdir(a)
     for i in lsdir:
         b = a+i
+        if not os.path.isdir(b):
+            continue
         z = os.listdir(b)
         check = False
         for j in z:
@@ -122,10 +135,10 @@ def fileList(tn, fold=None, name=None):
         fold = findTracknum(tn)
         addfold = '/'
         dirs = os.listdir(a+'/'+ fold+'/'+tn)
-        if dirs[0] == 'hdf5': 
+        if 'hdf5' in dirs:
             addfold = '/hdf5/'
             name = 'img*.h5'
-        elif dirs[0][-3:] == '.4D':
+        elif any(d[-3:] == '.4D' for d in dirs):
             name = '*.4D'
         else:
             name = '20*.fits'
@@ -172,21 +185,8 @@ def read_phasemap(filename, thefold = None):
 
     thetype = filename.split('.')[1]
     if thetype == 'fits':
-        hduList = pyfits.open(filename)
-        img = hduList[0].data
-        mask = hduList[1].data.astype(bool)
-
-        '''
-        with pyfits.open(filename) as hduList:
-        
-            img = hduList[0].data
-            mask = hduList[1].data
-        '''
-        #mask = np.zeros(img.shape, dtype=np.bool)
-        #mask[np.where(img == img.max())] = True
-        
-        img = np.ma.masked_array(img, mask)
-        #hduList.close()
+        # both the usual and the compressed layout of saveMaskedImage
+        img = read_data.readFits_maskedImage(filename)
 
     if thetype == '4D':
         img = ic.fromPhaseCam6110(filename)
@@ -196,43 +196,144 @@ def read_phasemap(filename, thefold = None):
 
     return img
 
-def averageFrames(first, last, fileList, thresh=None, fsel=None):
+def averageFrames(first, last, fileList, thresh=None, fsel=None, std=False):
     '''
     Parameters
     ----------
-    first: first item 
-        tracking number where to search for the images file list
+    first: int
+        index of the first frame to average
+    last: int
+        index of the last frame to average
+    fileList: list
+        list of the image files
+    thresh: int
+        if not None, frames with less than thresh valid pixels are rejected
+    fsel: numpy array
+        indices of the frames to average. If not None first and last are ignored
+    std: boolean
+        if True the per pixel standard deviation is also returned
 
     Returns
     -------
-    lsdir: the list of image files
-    fold1: the path where the file is found
+    aveimg: numpy masked array
+        average of the frames
+    stdimg: numpy masked array
+        per pixel standard deviation of the frames (only if std is True)
+
+    Raises
+    ------
+    ValueError
+        if no frame is accepted (e.g. all have less than thresh valid pixels)
     '''
     if fsel is None:
         fsel = np.arange(first, last+1)
-    
+
     #imcube = cubeFromList(fileList[x for x in flist])
-    imcube = cubeFromList([fileList[x] for x in fsel])
-    if thresh is None:
-        aveimg = np.ma.mean(imcube, axis=0)
-        
-    else:
-        img = imcube[0].data*0
-        mmask = imcube[0].mask
-        mysize = imcube[0].compressed()
-        nn = 0
-        for i in imcube:
-            if i.data.compressed.size > 1:
-                nn +=1
-                img += i.data
-                mmask = np.ma.mask_or(i.mask, mmask)
-            
-        img = img/nn
-        image = np.ma.masked_array(img, mask=mmask)
-        
+    loader = read_data.FrameLoader([fileList[x] for x in fsel])
+    ave = RunningAverage()
+    for imcube in loader.chunks(20):
+        if thresh is not None:
+            nvalid = np.sum(np.invert(imcube.mask), axis=(1, 2))
+            imcube = imcube[nvalid >= thresh]
+        ave.addCube(imcube)
+    aveimg = ave.mean()
+    if std:
+        return aveimg, ave.std()
     return aveimg
 
-def saveAverage(tn, id0=0, id1=None):
+class RunningAverage():
+    '''
+    Class for the per pixel average and standard deviation of a sequence of
+    masked frames, without keeping the frames in memory.
+    Each pixel is averaged on the frames where it is valid.
+
+    HOW TO USE IT::
+
+        from m4.mini_OTT.timehistory import RunningAverage
+        ave = RunningAverage()
+        for img in frames:
+            ave.add(img)
+        aveimg = ave.mean()
+        stdimg = ave.std()
+    '''
+
+    def __init__(self):
+        """The constructor """
+        self.nframes = 0
+        self._count = None
+        self._mean = None
+        self._m2 = None
+
+    def add(self, image):
+        '''
+        Parameters
+        ----------
+        image: numpy masked array
+            frame to add
+        '''
+        self.addCube(np.ma.masked_array([image]))
+
+    def addCube(self, cube):
+        '''
+        Parameters
+        ----------
+        cube: numpy masked array [nframes, pixel, pixel]
+            frames to add
+        '''
+        if cube.shape[0] == 0:
+            return
+        valid = np.invert(np.ma.getmaskarray(cube))
+        data = np.where(valid, cube.data, 0.)
+        count = valid.sum(axis=0)
+        mean = data.sum(axis=0) / np.maximum(count, 1)
+        m2 = np.sum(np.where(valid, (data - mean)**2, 0.), axis=0)
+        if self._count is None:
+            self._count, self._mean, self._m2 = count, mean, m2
+        else:
+            # Chan et al. update of mean and sum of squared differences
+            tot = self._count + count
+            delta = mean - self._mean
+            weight = count / np.maximum(tot, 1)
+            self._mean += delta * weight
+            self._m2 += m2 + delta**2 * self._count * weight
+            self._count = tot
+        self.nframes += cube.shape[0]
+
+    def count(self):
+        '''
+        Returns
+        -------
+        count: numpy array
+            number of valid frames for each pixel
+        '''
+        return self._count
+
+    def mean(self):
+        '''
+        Returns
+        -------
+        aveimg: numpy masked array
+            per pixel average, masked where no frame is valid
+        '''
+        self._checkFrames()
+        return np.ma.masked_array(self._mean.copy(), mask=self._count == 0)
+
+    def std(self):
+        '''
+        Returns
+        -------
+        stdimg: numpy masked array
+            per pixel standard deviation, masked where no frame is valid
+        '''
+        self._checkFrames()
+        var = self._m2 / np.maximum(self._count, 1)
+        return np.ma.masked_array(np.sqrt(var), mask=self._count == 0)
+
+    def _checkFrames(self):
+        if self._count is None:
+            raise ValueError('no frame accepted')
+
+def saveAverage(tn, id0=0, id1=None, thresh=None):
     fold = findTracknum(tn)
     fname = foldname.OPT_DATA_FOLDER + '/'+fold+'/'+tn+ '/average.fits'
     print(fname)
@@ -246,12 +347,18 @@ def saveAverage(tn, id0=0, id1=None):
         if id1==None: 
             id1=np.size(fl)-1
             #print(id0,id1)
-        aveimg = averageFrames(id0, id1, fl)
-        fold = findTracknum(tn)
-        fname = foldname.OPT_DATA_FOLDER + '/'+fold+'/'+tn+ '/average.fits'
+        aveimg, stdimg = averageFrames(id0, id1, fl, thresh=thresh, std=True)
         print(fname)
         pyfits.writeto(fname, aveimg.data)
         pyfits.append(fname, aveimg.mask.astype(np.uint8))
+        pyfits.append(fname, stdimg.data)
+
+def openAverageStd(tn):
+    fold = findTracknum(tn)
+    fname = foldname.OPT_DATA_FOLDER + '/'+fold+'/'+tn+ '/average.fits'
+    hduList = pyfits.open(fname)
+    stdimg = np.ma.masked_array(hduList[2].data, mask=hduList[1].data.astype(bool))
+    return stdimg
 
 def openAverage(tn):
     fold = findTracknum(tn)
@@ -290,13 +397,7 @@ def zernikePlot(mylist, modes=np.array(range(1,11))):
     if mytype is np.ma.core.MaskedArray:
         imgcube = mylist
         
-    zlist = []
-    for i in range(len(imgcube)):
-        print(i)
-        coeff, mat = zernike.zernikeFit(imgcube[i], modes)
-        zlist.append(coeff)
-        
-    zcoeff = np.array(zlist)
+    zcoeff = zernike.zernikeFitCube(imgcube, modes)
     zcoeff = zcoeff.T
     return zcoeff
     
@@ -324,8 +425,48 @@ def frame(id, mylist):
         
     if mytype is np.ma.core.MaskedArray:
         img = mylist[id]
+
+    if mytype is read_data.H5FrameCube:
+        img = mylist.frame(id)
     
     return img
+
+def packFrames(tn, h5name='frames.h5'):
+    '''
+    Packs the frames of a tracking number in a single compressed h5 file,
+    saved in the tracking number folder
+
+    Parameters
+    ----------
+    tn: string
+        tracking number of the frames
+
+    Returns
+    -------
+    file_name: string
+        path of the h5 file
+    '''
+    fold = findTracknum(tn)
+    fl = fileList(tn)
+    path = a+'/'+fold+'/'+tn
+    file_name = read_data.InterferometerConverter.fromFileListToH5Cube(fl, path, h5name)
+    return file_name
+
+def frameCube(tn, h5name='frames.h5'):
+    '''
+    Parameters
+    ----------
+    tn: string
+        tracking number of the frames packed with packFrames
+
+    Returns
+    -------
+    fc: H5FrameCube
+        object reading single frames (fc.frame(i)) or slices (fc[i:j])
+    '''
+    fold = findTracknum(tn)
+    fc = read_data.H5FrameCube(a+'/'+fold+'/'+tn+'/'+h5name)
+    return fc
     
 def spectrum(signal, dt=1, show=None):
     # see: https://numpy.org/doc/stable/reference/generated/numpy.angle.html?highlight=numpy%20angle#numpy.angle  for the phase spectrum
@@ -356,13 +497,8 @@ def spectrum(signal, dt=1, show=None):
             plot(freq, spe[i,:])
     return spe, freq
         
-def cubeFromList(fileList):
-    image_list = []
-    for i in fileList:
-        ima = read_phasemap(i)
-        image_list.append(ima)
-
-    image_list = np.ma.masked_array(image_list)
+def cubeFromList(fileList, nthreads=8):
+    image_list = read_data.FrameLoader(fileList, nthreads).cube()
     #print(psutil.Process().open_files())
     return image_list
 
@@ -428,17 +564,25 @@ def track2date(tni):
 def runningMean(vec, npoints):
     
     return np.convolve(vec, np.ones(npoints), 'valid') / npoints       
-def readTemperatures(tn):
+def readTemperatures(tn, start=0):
+    '''
+    temperatures of the monitoring from the row start (the new rows can
+    be read while the acquisition is running)
+    '''
     fold=findTracknum(tn)
-    fname = foldname.OPT_DATA_FOLDER + '/'+fold+'/'+tn+ '/temperature.fits'
-    temperatures = (pyfits.open(fname))[0].data
+    path = foldname.OPT_DATA_FOLDER + '/'+fold+'/'+tn
+    temperatures = time_series_store.readSeriesOrFits(path, 'temperature', start)
     return temperatures
 
-def readZernike(tn):
+def readZernike(tn, start=0):
+    '''
+    zernike coefficients of the monitoring (time in the first column) from
+    the row start (the new rows can be read while the acquisition is running)
+    '''
     fold=findTracknum(tn)
-    fname = foldname.OPT_DATA_FOLDER + '/'+fold+'/'+tn+ '/zernike.fits'
-    temperatures = (pyfits.open(fname))[0].data
-    return temperatures
+    path = foldname.OPT_DATA_FOLDER + '/'+fold+'/'+tn
+    zern = time_series_store.readSeriesOrFits(path, 'zernike', start)
+    return zern
 
 
 
@@ -518,72 +662,130 @@ def readFrameRate(tn):
     return fr
 
 
-def comp_filtered_image(imgin,verbose=False, disp=False, d=1, crop=True, freq2filter=None):
+class BandPassFilter():
+    '''
+    Spatial frequency filter of images and cubes [nframes, pixel, pixel].
+    The frequencies to keep are computed once for the image shape,
+    sampling and band; the frames are filtered with real FFTs on several
+    threads.
 
-#    if crop:
-#        cir = geo.qpupil(-1*imgin.mask+1)
-#        cir = np.array(cir[0:3]).astype(int)
-#        img = imgin.data[cir[0]-cir[2]:cir[0]+cir[2],cir[1]-cir[2]:cir[1]+cir[2]]
-#        m = imgin.mask[cir[0]-cir[2]:cir[0]+cir[2],cir[1]-cir[2]:cir[1]+cir[2]]
-#        img = np.ma.masked_array(img, m)
-#    else:
-    img = imgin.copy()
+    HOW TO USE IT::
 
+        from m4.mini_OTT.timehistory import BandPassFilter
+        bp = BandPassFilter(img.shape, d=pixel_scale, freq2filter=(f0, f1))
+        imgout = bp.filter(img)
+        cubeout = bp.filterCube(cube)
+    '''
 
-    sx = (np.shape(img))[0]
+    def __init__(self, shape, d=1, freq2filter=None, dtype=np.float32,
+                 workers=-1):
+        """The constructor """
+        self._shape = tuple(shape)
+        self._dtype = dtype
+        self._workers = workers
+        kfreq = np.fft.fftfreq(self._shape[0], d=d)
+        kx = np.fft.rfftfreq(self._shape[1], d=d)
+        self._knrm = np.sqrt(kx[np.newaxis, :]**2 + kfreq[:, np.newaxis]**2)
+        if freq2filter is None:
+            fmin = -1
+            fmax = np.max(kfreq)
+        else:
+            fmin, fmax = freq2filter
+        self._keep = (self._knrm <= np.max(kfreq)) & (self._knrm <= fmax) & \
+            (self._knrm >= fmin)
 
-    #img = img-np.mean(img)
-    mask = np.invert(img.mask)
+    @property
+    def shape(self):
+        ''' Shape of the images to filter '''
+        return self._shape
 
-    img[mask ==0]=0
-    norm='ortho'
-    tf2d = scipy.fft.fft2(img.data,norm=norm)
-    #tf2d[0,0]=0
+    def filter(self, img):
+        '''
+        Parameters
+        ----------
+            img: numpy masked array [pixel, pixel]
+                image to filter (masked points are set to zero)
+
+        Returns
+        -------
+            imgout: numpy masked array [pixel, pixel]
+                filtered image, with the mask of img
+        '''
+        return self.filterCube(np.ma.masked_array(
+            np.ma.getdata(img)[np.newaxis],
+            mask=np.ma.getmaskarray(img)[np.newaxis]))[0]
 
-    kfreq = np.fft.fftfreq(sx, d=d)                #frequenza in cicli  
-    kfreq2D = np.meshgrid(kfreq, kfreq)            #griglia di frequenze xx e yy
-    knrm = np.sqrt(kfreq2D[0]**2 + kfreq2D[1]**2)  #griglia di frequenze distanza
+    def filterCube(self, cube, chunk_size=64, overwrite=False):
+        '''
+        Parameters
+        ----------
+            cube: numpy masked array [nframes, pixel, pixel]
+                frames to filter (masked points are set to zero)
+            chunk_size: int
+                number of frames transformed together
+            overwrite: boolean
+                if True the filtered frames are written in the data of cube
+
+        Returns
+        -------
+            cubeout: numpy masked array [nframes, pixel, pixel]
+                filtered frames, with the mask of cube
+        '''
+        data = np.ma.getdata(cube)
+        mask = np.ma.getmaskarray(cube)
+        if data.shape[1:] != self._shape:
+            raise ValueError('Frames shape %s instead of %s' %
+                             (data.shape[1:], self._shape))
+        if overwrite:
+            out = data
+        else:
+            out = np.empty(data.shape, dtype=self._dtype)
+        for start in range(0, data.shape[0], chunk_size):
+            sl = slice(start, start + chunk_size)
+            block = np.where(mask[sl], 0, data[sl]).astype(self._dtype,
+                                                            copy=False)
+            spectrum = scipy.fft.rfft2(block, workers=self._workers,
+                                       overwrite_x=True)
+            spectrum *= self._keep
+            out[sl] = scipy.fft.irfft2(spectrum, s=self._shape,
+                                       workers=self._workers,
+                                       overwrite_x=True)
+        return np.ma.masked_array(out, mask=mask)
 
 
-    #maschera (da mettere opzionale) per limitarsi al cerchio e non prendere il quadrato
-    fmask1 = 1.0 * (knrm > np.max(kfreq))
+@lru_cache(maxsize=8)
+def _bandPassFilter(shape, d, freq2filter, dtype):
+    return BandPassFilter(shape, d, freq2filter, dtype)
 
-    if freq2filter is None:
-        fmin = -1
-        fmax = np.max(kfreq)
-    else:
-        fmin, fmax = freq2filter
 
-    fmask2 = 1.0*(knrm > fmax)
-    fmask3 = 1.0*(knrm < fmin)
+def comp_filtered_image(imgin,verbose=False, disp=False, d=1, crop=True, freq2filter=None):
 
-    fmask = (fmask1+fmask2+fmask3) > 0
+#    if crop:
+#        cir = geo.qpupil(-1*imgin.mask+1)
+#        cir = np.array(cir[0:3]).astype(int)
+#        img = imgin.data[cir[0]-cir[2]:cir[0]+cir[2],cir[1]-cir[2]:cir[1]+cir[2]]
+#        m = imgin.mask[cir[0]-cir[2]:cir[0]+cir[2],cir[1]-cir[2]:cir[1]+cir[2]]
+#        img = np.ma.masked_array(img, m)
+#    else:
+    if freq2filter is not None:
+        freq2filter = tuple(freq2filter)
+    bp = _bandPassFilter(np.shape(imgin), d, freq2filter, float)
 
-    tf2d_filtered= tf2d.copy()
-    tf2d_filtered[fmask]=0
-    imgf = scipy.fft.ifft2(tf2d_filtered,norm=norm)
-    imgout= np.ma.masked_array(np.real(imgf), mask=imgin.mask)
+    mask = np.invert(np.ma.getmaskarray(imgin))
+    img = np.where(mask, imgin.data, 0)
+    imgout = bp.filter(imgin)
     if disp:
         figure()
-        imshow(knrm)
+        imshow(np.fft.fftshift(bp._knrm, axes=0))
         title('freq')
         figure()
-        imshow(fmask1)
-        title('fmask1')
-        figure()
-        imshow(fmask2)
-        title('fmask2')
-        figure()
-        imshow(fmask3)
-        title('fmask3')
-        figure()
-        imshow(fmask)
+        imshow(np.fft.fftshift(np.invert(bp._keep), axes=0))
         title('fmask')
         figure()
-        imshow(np.abs(tf2d))
+        imshow(np.fft.fftshift(np.abs(scipy.fft.rfft2(img, norm='ortho')), axes=0))
         title("Initial spectrum")
         figure()
-        imshow(np.abs(tf2d_filtered))
+        imshow(np.fft.fftshift(np.abs(scipy.fft.rfft2(imgout.data, norm='ortho')), axes=0))
         title("Filtered spectrum")
         figure()
         imshow(imgin)
@@ -592,11 +794,11 @@ def comp_filtered_image(imgin,verbose=False, disp=False, d=1, crop=True, freq2fi
         imshow(imgout)
         title("Filtered image")
 
-
+    # the spectrum rms are the same of the images (Parseval, norm='ortho')
     e1 =np.sqrt(np.sum(img[mask]**2)/np.sum(mask))*1e9
     e2 =np.sqrt(np.sum(imgout[mask]**2)/np.sum(mask))*1e9
-    e3 =np.sqrt(np.sum(np.abs(tf2d)**2)/np.sum(mask))*1e9
-    e4 =np.sqrt(np.sum(np.abs(tf2d_filtered)**2)/np.sum(mask))*1e9
+    e3 =np.sqrt(np.sum(img**2)/np.sum(mask))*1e9
+    e4 =np.sqrt(np.sum(imgout.data**2)/np.sum(mask))*1e9
 
     if verbose:
         print("RMS image [nm]            %5.2f" % e1)
@@ -607,14 +809,189 @@ def comp_filtered_image(imgin,verbose=False, disp=False, d=1, crop=True, freq2fi
 
     return imgout
 
+class PsdEngine():
+    '''
+    Radially binned power spectral density of images and cubes.
+    The frequency grid and the bin of each frequency are computed once for
+    each (shape, sampling, nbins), the spectra are obtained with rfft2 on
+    several threads and binned with np.bincount.
+
+    HOW TO USE IT::
+
+        from m4.mini_OTT.timehistory import PsdEngine
+        pe = PsdEngine(d=pixel_scale, window='hann')
+        fout, Aout = pe.psd(img)
+        fout, Aout = pe.cubePsd(cube)   # average of the frames PSD
+    '''
+
+    def __init__(self, nbins=None, d=1, norm='backward', crop=True,
+                 window=None, workers=-1):
+        """The constructor """
+        self._nbins = nbins
+        self._d = d
+        self._norm = norm
+        self._crop = crop
+        self._window = window
+        self._workers = workers
+
+    def psd(self, img, sigma=None):
+        '''
+        Parameters
+        ----------
+            img: numpy masked array [pixel, pixel]
+                image to analyze
+            sigma: float
+                if not None sigma of scipy.ndimage.fourier_gaussian
+
+        Returns
+        -------
+            fout: numpy array
+                spatial frequencies
+            Aout: numpy array
+                power spectrum in each frequency bin
+        '''
+        if self._crop:
+            img = _cropToPupil(img, _pupilBox(img))
+        data, nvalid = self._prepare(img, sigma)
+        fout, abins = self._spectra(data[np.newaxis])
+        return fout, abins[0] / nvalid
+
+    def cubePsd(self, cube, sigma=None, chunk_size=64):
+        '''
+        Parameters
+        ----------
+            cube: numpy masked array [nframes, pixel, pixel]
+                frames to analyze (also a list of frames or an H5FrameCube).
+                If crop is True all the frames are cropped on the pupil
+                of the first one
+            sigma: float
+                if not None sigma of scipy.ndimage.fourier_gaussian
+            chunk_size: int
+                number of frames transformed together
+
+        Returns
+        -------
+            fout: numpy array
+                spatial frequencies
+            Aout: numpy array
+                power spectrum averaged on the frames
+        '''
+        nframes = len(cube)
+        box = _pupilBox(cube[0]) if self._crop else None
+        total = None
+        for start in range(0, nframes, chunk_size):
+            data = []
+            nvalid = []
+            for i in range(start, min(start + chunk_size, nframes)):
+                img = cube[i]
+                if box is not None:
+                    img = _cropToPupil(img, box)
+                dd, nn = self._prepare(img, sigma)
+                data.append(dd)
+                nvalid.append(nn)
+            fout, abins = self._spectra(np.array(data))
+            aout = np.sum(abins / np.array(nvalid)[:, np.newaxis], axis=0)
+            total = aout if total is None else total + aout
+        return fout, total / nframes
+
+    def binnedSpectrum(self, img, sigma=None):
+        '''
+        Parameters
+        ----------
+            img: numpy masked array [pixel, pixel]
+                image to analyze, already cropped
+            sigma: float
+                if not None sigma of scipy.ndimage.fourier_gaussian
+
+        Returns
+        -------
+            fout: numpy array
+                spatial frequencies
+            abins: numpy array
+                power in each frequency bin, not normalized on the
+                number of valid pixels
+            data: numpy array [pixel, pixel]
+                transformed image: mean removed, masked pixels to zero,
+                filtered and windowed
+        '''
+        data, nvalid = self._prepare(img, sigma)
+        fout, abins = self._spectra(data[np.newaxis])
+        return fout, abins[0], data
+
+    def _prepare(self, img, sigma=None):
+        img = img - np.mean(img)
+        mask = np.invert(np.ma.getmaskarray(img))
+        data = np.where(mask, np.ma.getdata(img), 0.)
+        if sigma is not None:
+            data = scipy.ndimage.fourier_gaussian(data, sigma=sigma)
+        if self._window is not None:
+            data = data * _psdWindow(data.shape, self._window)
+        return data, np.sum(mask)
+
+    def _spectra(self, data):
+        nbins = self._nbins
+        if nbins is None:
+            nbins = data.shape[1] // 2
+        idx, weights, fout = _psdGrid(data.shape[1:], self._d, nbins)
+        tf2d = scipy.fft.rfft2(data, norm=self._norm, workers=self._workers)
+        tf2d[:, 0, 0] = 0
+        power = (tf2d.real**2 + tf2d.imag**2).reshape(data.shape[0], -1)
+        valid = idx >= 0
+        nframes = data.shape[0]
+        bins = (idx[valid] + nbins * np.arange(nframes)[:, np.newaxis]).ravel()
+        abins = np.bincount(bins, (power[:, valid] * weights[valid]).ravel(),
+                            minlength=nframes * nbins)
+        return fout, abins.reshape(nframes, nbins)
+
+
+@lru_cache(maxsize=16)
+def _psdGrid(shape, d, nbins):
+    ''' Bin of each frequency of rfft2 (-1 outside the circle), weight of
+    the frequency in the full plane and output frequencies '''
+    kfreq = np.fft.fftfreq(shape[0], d=d)
+    kx = np.fft.rfftfreq(shape[1], d=d)
+    knrm = np.sqrt(kx[np.newaxis, :]**2 + kfreq[:, np.newaxis]**2)
+    # columns with kx > 0 stand also for their conjugate -kx
+    weights = np.full(knrm.shape, 2.)
+    weights[:, 0] = 1
+    if shape[1] % 2 == 0:
+        weights[:, -1] = 1
+    fmask = knrm < np.max(kfreq)
+    # same bins of scipy.stats.binned_statistic on the valid frequencies
+    edges = np.linspace(knrm[fmask].min(), knrm[fmask].max(), nbins + 1)
+    idx = np.searchsorted(edges, knrm, side='right') - 1
+    idx[knrm == edges[-1]] = nbins - 1
+    idx[np.invert(fmask)] = -1
+    fout = kfreq[0:shape[0] // 2]
+    for arr in (idx, weights, fout):
+        arr.flags.writeable = False
+    return idx.ravel(), weights.ravel(), fout
+
+
+@lru_cache(maxsize=4)
+def _psdWindow(shape, window):
+    win = np.outer(scipy.signal.get_window(window, shape[0]),
+                   scipy.signal.get_window(window, shape[1]))
+    win.flags.writeable = False
+    return win
+
+
+def _pupilBox(imgin):
+    cir = geo.qpupil(-1*np.ma.getmaskarray(imgin)+1)
+    return tuple(np.array(cir[0:3]).astype(int))
+
+
+def _cropToPupil(imgin, box):
+    x, y, r = box
+    img = np.ma.getdata(imgin)[x-r:x+r, y-r:y+r]
+    m = np.ma.getmaskarray(imgin)[x-r:x+r, y-r:y+r]
+    return np.ma.masked_array(img, m)
+
+
 def comp_psd(imgin,  nbins=None, norm='backward',verbose=False, disp=False, d=1, sigma=None, crop=True):
 
     if crop:
-        cir = geo.qpupil(-1*imgin.mask+1)
-        cir = np.array(cir[0:3]).astype(int)
-        img = imgin.data[cir[0]-cir[2]:cir[0]+cir[2],cir[1]-cir[2]:cir[1]+cir[2]]
-        m = imgin.mask[cir[0]-cir[2]:cir[0]+cir[2],cir[1]-cir[2]:cir[1]+cir[2]]
-        img = np.ma.masked_array(img, m)
+        img = _cropToPupil(imgin, _pupilBox(imgin))
     else:
         img = imgin.copy()
 
@@ -622,52 +999,28 @@ def comp_psd(imgin,  nbins=None, norm='backward',verbose=False, disp=False, d=1,
 
     if nbins is None:
         nbins = sx//2
-    img = img-np.mean(img)
+    engine = PsdEngine(nbins, d, norm, crop=False)
+    fout, Abins, data = engine.binnedSpectrum(img, sigma)
     mask = np.invert(img.mask)
-
-    #DA IMPLEMENTARE: finestre contro effetti di bordo
-#        maskf = scipy.ndimage.fourier_gaussian(np.array(mask, dtype=float), sigma=sigma)
-
-#    img=maskf*img#0
-    img[mask ==0]=0
-    if sigma is not None:
-        img = scipy.ndimage.fourier_gaussian(img, sigma=sigma)
-    tf2d = scipy.fft.fft2(img,norm=norm)
-    tf2d[0,0]=0
-    tf2d_power_spectrum = np.abs(tf2d)**2
-
-    #kfreq = np.fft.fftfreq(sx) * sx                #freq spaziale in pixel
-    kfreq = np.fft.fftfreq(sx, d=d)                #frequenza in cicli  
-    kfreq2D = np.meshgrid(kfreq, kfreq)            #griglia di frequenze xx e yy
-    knrm = np.sqrt(kfreq2D[0]**2 + kfreq2D[1]**2)  #griglia di frequenze distanza
-
-    #maschera (da mettere opzionale) per limitarsi al cerchio e non prendere il quadrato
-    fmask = knrm < np.max(kfreq)
-    #fmask = mask.copy()
-    knrm = knrm[fmask].flatten()
-    fourier_amplitudes = tf2d_power_spectrum[fmask].flatten()
-    Abins, x_edges, y_edges = stats.binned_statistic(knrm, fourier_amplitudes,
-                                         statistic = "sum",
-                                         bins = nbins)
+    kfreq = np.fft.fftfreq(sx, d=d)
 
     #assert(Abins[0] == 0)
     #ediff = (np.sum(img[mask]i**2) - np.sum(Abins))/np.sum(img[mask]**2)
-    e1 =np.sum(img[mask]**2/np.sum(mask))
+    e1 =np.sum(data[mask]**2/np.sum(mask))
     e2 =np.sum(Abins)/np.sum(mask)
     ediff = np.abs(e2-e1)/e1
 
-    fout=kfreq[0:sx//2]
     Aout=Abins/np.sum(mask)
     if verbose:
         print("RMS from spectrum %e" % np.sqrt(e2))
-        print("RMS [nm]          %5.2f" % (np.std(img[mask])*1e9))
+        print("RMS [nm]          %5.2f" % (np.std(data[mask])*1e9))
     else:
         print("Sampling          %e" % d)
         print("Energy signal     %e" % e1)
         print("Energy spectrum    %e" % e2)
         print("Energy difference %e" % ediff)
         print("RMS from spectrum %e" % np.sqrt(e2))
-        print("RMS [nm]          %5.2f" % (np.std(img[mask])*1e9))
+        print("RMS [nm]          %5.2f" % (np.std(data[mask])*1e9))
         print(kfreq[0:4])
         print(kfreq[-4:])
     if disp == True:
@@ -683,7 +1036,6 @@ def comp_psd(imgin,  nbins=None, norm='backward',verbose=False, disp=False, d=1,
 
 
 
-
 def comp_psd_old(img,  nbins=None, verbose=None):
     sx = (np.shape(img))[0]
 
@@ -731,8 +1083,10 @@ def tnscan(tn0, tn1):
     syntax: tnlist = tnscan(tn0, tn1)
     '''
     datafold = findTracknum(tn0)
+    try:
+        return tnc.catalog(a).scan(tn0, tn1, datafold)
+    except (OSError, sqlite3.Error):
+        pass
     ll = sorted(os.listdir(foldname.OPT_DATA_FOLDER+'/'+datafold))
-    id0 = ll.index(tn0)
-    id1 = ll.index(tn1)
-    tnlist = ll[id0:id1+1]
+    tnlist = [tn for tn in ll if tn0 <= tn <= tn1]
     return tnlist
@@ -61,20 +61,21 @@ def _createTemplateList(numbers_array):
         if i % 2 == 0:
             # pari
             k = i - 2
-            temp = np.tile(vec, np.int(i / 2))
+            temp = np.tile(vec, int(i / 2))
         elif i % 2 == 1:
             # dispari
             k = i - 2
             if k == 1:
                 temp_pari = vec
             else:
-                temp_pari = np.tile(vec, np.int((i - 1) / 2))
+                temp_pari = np.tile(vec, int((i - 1) / 2))
             temp = np.append(temp_pari, 1)
         template_list.append(temp)
     return template_list
 
 
-def noise_vibrations(data_file_path, numbers_array, tidy_or_shuffle):
+def noise_vibrations(data_file_path, numbers_array, tidy_or_shuffle,
+                     save_cubes=False):
     '''
     Parameters
     ----------
@@ -86,6 +87,13 @@ def noise_vibrations(data_file_path, numbers_array, tidy_or_shuffle):
         tidy_or_shuffle: int
                         0 for tidy, 1 for shuffle
 
+    Other Parameters
+    ----------------
+        save_cubes: boolean
+            if True the cube of each template is saved in a new tracking
+            number, else the frames are read once and all the templates
+            are analyzed together
+
     Returns
     ------
     The output of this function is the plot of results and save this results
@@ -95,21 +103,26 @@ def noise_vibrations(data_file_path, numbers_array, tidy_or_shuffle):
     dove = _path_noise_results(data_file_path)
     template_list = _createTemplateList(numbers_array)
 
-    tt_list = []
-    for temp in template_list:
-        tt = n.noise_analysis_from_hdf5_folder(data_file_path, tidy_or_shuffle,
-                                               temp)
-        time.sleep(1)
-        tt_list.append(tt)
-
-    fits_file_name = os.path.join(dove, 'trackingnumbers_%d.txt' % tidy_or_shuffle)
-    file = open(fits_file_name, 'w+')
-    file.write('Tidy or shuffle = %d \n' % tidy_or_shuffle)
-    for tt in tt_list:
-        file.write('%s \n' % tt)
-    file.close()
-
-    rms_medio, quad_medio, n_temp, ptv_medio = n.different_template_analyzer(tt_list)
+    if save_cubes:
+        tt_list = []
+        for temp in template_list:
+            tt = n.noise_analysis_from_hdf5_folder(data_file_path, tidy_or_shuffle,
+                                                   temp)
+            time.sleep(1)
+            tt_list.append(tt)
+
+        fits_file_name = os.path.join(dove, 'trackingnumbers_%d.txt' % tidy_or_shuffle)
+        file = open(fits_file_name, 'w+')
+        file.write('Tidy or shuffle = %d \n' % tidy_or_shuffle)
+        for tt in tt_list:
+            file.write('%s \n' % tt)
+        file.close()
+
+        rms_medio, quad_medio, n_temp, ptv_medio = n.different_template_analyzer(tt_list)
+    else:
+        rms_medio, quad_medio, n_temp, ptv_medio = \
+            n.noise_analysis_multi_template(data_file_path, tidy_or_shuffle,
+                                            template_list)
     pyfits.writeto(os.path.join(dove, 'rms_vector_%d.fits' % tidy_or_shuffle), rms_medio, overwrite=True)
     pyfits.writeto(os.path.join(dove, 'tiptilt_vector_%d.fits' % tidy_or_shuffle), quad_medio, overwrite=True)
     pyfits.writeto(os.path.join(dove, 'n_temp_vector_%d.fits' % tidy_or_shuffle), n_temp, overwrite=True)
@@ -184,7 +197,8 @@ def spectrumFromData(data_file_path):
     plt.savefig(name)
 
 
-def convection_noise(data_file_path, tau_vector, fits_analysis=False, nzern=None):
+def convection_noise(data_file_path, tau_vector, fits_analysis=False, nzern=None,
+                     nprocs=None):
     '''
     Parameters
     ----------
@@ -197,6 +211,8 @@ def convection_noise(data_file_path, tau_vector, fits_analysis=False, nzern=None
     ----------------
         fits_analysis: Boolean
             if False the h5 or 4D data analysis is performed
+        nprocs: int
+            number of processes for the zernike fits. If None no pool is used
     '''
     #last_name = data_file_path.split('/')[-1]
     if fits_analysis is False:
@@ -210,7 +226,8 @@ def convection_noise(data_file_path, tau_vector, fits_analysis=False, nzern=None
 
     rms, quad, n_meas = n.analysis_whit_structure_function(data_file_path,
                                                            tau_vector,
-                                                           h5_or_fits, nzern=nzern)
+                                                           nzern=nzern,
+                                                           nprocs=nprocs)
     pyfits.writeto(os.path.join(dove, 'rms_vector_conv.fits'), rms,
                    overwrite=True)
     pyfits.writeto(os.path.join(dove, 'tiptilt_vector_conv.fits'), quad,
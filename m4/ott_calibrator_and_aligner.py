@@ -36,6 +36,12 @@ class OttCalibAndAlign():
         self._tt = None
         self._roi = ROI()
 
+    def close(self):
+        '''
+        Stop the threads moving the OTT axes
+        '''
+        self._cal.close()
+
     def par_and_rm_calibrator(self, command_amp_vector, n_push_pull, n_frames, delay):
         '''Calibration of the optical tower
 
@@ -6,7 +6,6 @@ import logging
 import os
 import time
 import numpy as np
-from astropy.io import fits as pyfits
 from m4.ott_sim.ott_images import OttImages
 from m4.devices.base_interferometer import BaseInterferometer
 
@@ -130,7 +129,10 @@ class FakeInterferometer(BaseInterferometer):
             measuremnet fits file name
         image: numpy masked array
             data to save
+
+        Returns
+        -------
+        ack: concurrent.futures.Future
+            writing acknowledgment if a frame writer is set, otherwise None
         """
-        fits_file_name = os.path.join(dove, name)
-        pyfits.writeto(fits_file_name, image.data)
-        pyfits.append(fits_file_name, image.mask.astype(int))
+        return self._writePhasemap(dove, name, image, mask_dtype=int)
@@ -79,11 +79,8 @@ class PistMeas():
                 zernike coefficient to be removed
         '''
     
-        cube=np.zeros(np.shape(imgcube))
-        coeff=np.zeros([len(cube),len(modes)])
-        
-        for j in range(len(imgcube)):
-            cube[j,:,:], coeff[j,:]=self.removeZernike(imgcube[j,:,:],modes)
+        coeff, res = zernike.zernikeFitCube(imgcube, modes, residual=True)
+        cube = res.data
         
         plt.figure()
         for j in range(len(modes)):    
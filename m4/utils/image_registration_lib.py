@@ -18,10 +18,13 @@ import os
 import shutil
 
 def crop_frame(imgin):
-    cir = geo.qpupil(-1*imgin.mask+1)
+    mask = np.ma.getmaskarray(imgin)
+    if mask.ndim > 2:
+        mask = np.all(mask.reshape((-1,) + mask.shape[-2:]), axis=0)
+    cir = geo.qpupil(-1*mask+1)
     cir = np.array(cir[0:3]).astype(int)
-    img = imgin.data[cir[0]-cir[2]:cir[0]+cir[2]+1,cir[1]-cir[2]:cir[1]+cir[2]+1]
-    m = imgin.mask[cir[0]-cir[2]:cir[0]+cir[2]+1,cir[1]-cir[2]:cir[1]+cir[2]+1]
+    img = imgin.data[..., cir[0]-cir[2]:cir[0]+cir[2]+1,cir[1]-cir[2]:cir[1]+cir[2]+1]
+    m = np.ma.getmaskarray(imgin)[..., cir[0]-cir[2]:cir[0]+cir[2]+1,cir[1]-cir[2]:cir[1]+cir[2]+1]
     img = np.ma.masked_array(img, m)
     return img
 
@@ -388,37 +391,33 @@ def thresh_image(img1,threshold,zlist=[1,2,3,4],inrad=0, out=0,crop=False):
 
 
 def quick243(img, pixs):  #pixs = [pix/m]
-    img1 = crop_frame(img)
-    dd = 0.03
-    pp =int(pixs * dd)#.astype(int)
-    ss = (np.array(img1.shape)/pp).astype(int)
-#    ss = np.array((img1.shape[0]/pp)).astype(int)
-    ww = np.zeros(ss)
-    for ii in np.arange (0,ss[0]):
-        for jj in np.arange(0,ss[1]):
-            kk = img1[ii*pp:ii*pp+pp,jj*pp:jj*pp+pp]
-            st = kk.std()
-            if st != np.nan:
-                ww[ii,jj] = st
-    mask = (ww == 0)
-    ww = np.ma.masked_array(ww.data,mask)
-    return ww
+    return blockStd(img, pixs, 0.03)
 
 def quick283(img, pixs):  #pixs = [pix/m]
+    return blockStd(img, pixs, 0.08)
+
+def blockStd(img, pixs, dd):
+    '''
+    Parameters
+    ----------
+        img: masked array [..., H, W]
+            image or cube of images
+        pixs: float
+            pixel scale [pix/m]
+        dd: float
+            block size [m]
+
+    Returns
+    -------
+        ww: masked array [..., H/pp, W/pp]
+            std of each block of the cropped pupil, masked where it is zero
+    '''
     img1 = crop_frame(img)
-    dd = 0.08
     pp =int(pixs * dd)#.astype(int)
-    ss = (np.array(img1.shape)/pp).astype(int)
-#    ss = np.array((img1.shape[0]/pp)).astype(int)
-    ww = np.zeros(ss)
-    for ii in np.arange (0,ss[0]):
-        for jj in np.arange(0,ss[1]):
-            kk = img1[ii*pp:ii*pp+pp,jj*pp:jj*pp+pp]
-            st = kk.std()
-            if st != np.nan:
-                ww[ii,jj] = st
+    count, mean, ww = geo.block_stats(img1, pp)
+    ww = ww.filled(0)
     mask = (ww == 0)
-    ww = np.ma.masked_array(ww.data,mask)
+    ww = np.ma.masked_array(ww,mask)
     return ww
 
 
@@ -450,24 +449,40 @@ def adjust_marker(cghf,ottf, mid,ran):
     return tmp
 
 def compSlope(img,px, rfact):
-    ss=np.array(np.shape(img))
-    sli = img-np.roll(img,(1,1),axis=(0,1))
-    slid = geo.congrid2D(sli,(ss/rfact).astype(int))/(px*rfact)
-    slim = geo.congrid2D(-1*sli.mask+1,(ss/rfact).astype(int))
-    sli = np.ma.masked_array(slid,(-1*slim+1))
+    sli = img-np.roll(img,(1,1),axis=(-2,-1))
+    sli = _blockMean(sli, rfact)/(px*rfact)
     return sli.std()
 
 def compSlopXY(img,px, rfact):
-    ss=np.array(np.shape(img))
-    slm  = -1*img.mask+1
-    slm = slm+np.roll(slm,(1,1),axis=(0,1))
-    slix = np.ma.masked_array((img-np.roll(img,(1,0),axis=(0,1)))/px,slm < 2)
-    sliy = np.ma.masked_array((img-np.roll(img,(0,1),axis=(0,1)))/px,slm < 2)
+    return slopeMap(img, px, rfact).std()
+
+def slopeMap(img, px, rfact):
+    '''
+    Parameters
+    ----------
+        img: masked array [..., H, W]
+            image or cube of images
+        px: float
+            pixel size [m]
+        rfact: int
+            reduction factor of the map
+
+    Returns
+    -------
+        sli: masked array [..., H/rfact, W/rfact]
+            slope modulus averaged on blocks of rfact pixels, masked
+            where the block is not completely valid
+    '''
+    slm  = -1*np.ma.getmaskarray(img)+1
+    slm = slm+np.roll(slm,(1,1),axis=(-2,-1))
+    slix = np.ma.masked_array((img-np.roll(img,1,axis=-2))/px,slm < 2)
+    sliy = np.ma.masked_array((img-np.roll(img,1,axis=-1))/px,slm < 2)
     sli  = np.ma.sqrt(slix**2+sliy**2)
-    slid = geo.congrid2D(sli,(ss/rfact).astype(int))
-    slim = geo.congrid2D(-1*sli.mask+1,(ss/rfact).astype(int))
-    sli = np.ma.masked_array(slid,(-1*slim+1))
-    return sli.std()
+    return _blockMean(sli, rfact)
+
+def _blockMean(img, rfact):
+    count, mean, std = geo.block_stats(img, rfact)
+    return np.ma.masked_array(mean.data, count < rfact**2)
 
 
 def compSlopXY2(img,px, rfact, thr=None):
@@ -11,6 +11,9 @@ from m4.configuration import config_folder_names as fold_name
 from m4.configuration.ott_parameters import OttParameters
 from m4.ground import tracking_number_folder
 from m4.ground import zernike
+from m4.ground import read_data
+from m4.ground.motion_scheduler import MotionScheduler
+from m4.ground.acquisition_pipeline import AcquisitionPipeline
 from m4.configuration.ott_parameters import OtherParameters
 
 WHO_PAR_AND_RM = 'PAR + RM'
@@ -28,6 +31,7 @@ class OpticalCalibration():
         cal = OpticalCalibration(ott, interf)
         cal.measureAndAnalysisCalibrationMatrix(who, command_amp_vector,
                                             n_push_pull, n_frames, delay)
+        cal.close()
 
     """
 
@@ -36,6 +40,7 @@ class OpticalCalibration():
         self._logger = logging.getLogger('OPT_CALIB:')
         self._interf = interf
         self._ott = ott
+        self._scheduler = MotionScheduler(ott)
         #start
         self._nPushPull = None
         self._commandAmpVector = None
@@ -52,6 +57,13 @@ class OpticalCalibration():
 
         self._fullCommandMatrix=None
         self._fullCube=None
+        self._timingReport = None
+
+    def close(self):
+        '''
+        Stop the threads moving the OTT axes
+        '''
+        self._scheduler.close()
 
     @staticmethod
     def _storageFolder():
@@ -171,7 +183,58 @@ class OpticalCalibration():
     def getWho(self):
         return self._who
 
-    def _measureAndStore(self, command_list, dove, n_frames, delay):
+    def dryRunCalibration(self, who, command_amp_vector, n_push_pull, n_frames, delay):
+        '''
+        Execute the movements and the acquisitions of a calibration
+        without saving the images, to measure the time spent in each stage
+
+        Parameters
+        ----------
+        who: string
+            string indicating the optical element (see
+            measureAndAnalysisCalibrationMatrix)
+        command_amp_vector: numpy array [mm]
+                            vector containing the amplitude of the
+                            commands to give degrees of freedom to
+                            calibrate
+        n_push_pull: int
+                    number of push pull
+        n_frames: int
+                number of frame for 4D measurement
+
+        Returns
+        -------
+        report: dict
+            for each stage (move, acquire, save): number of calls,
+            total, mean and max time [s]
+        '''
+        self._nPushPull = n_push_pull
+        dofIndex_vector = self._logAndDefineDovIndexForCommandMatrixCreation(who)
+        cmat, command_list = self.createCmatAndCmdList(command_amp_vector,
+                                                       dofIndex_vector)
+        return self._measureAndStore(command_list, None, n_frames, delay, dry_run=True)
+
+    def _measureAndStore(self, command_list, dove, n_frames, delay, dry_run=False):
+        ''' Push pull measurements: the images are saved by the background
+        writer of the pipeline while the mechanics move for the next one.
+        Returns the timing report of the pipeline '''
+        with AcquisitionPipeline(self._interf, dove, full_frame=True,
+                                 dry_run=dry_run) as pipe:
+            self._measureWithPipeline(pipe, command_list, n_frames, delay)
+        self._timingReport = pipe.report()
+        self._logger.info('Timing report: %s', self._timingReport)
+        return self._timingReport
+
+    def getTimingReport(self):
+        '''
+        Returns
+        -------
+        report: dict
+            time spent in each stage of the last measurement
+        '''
+        return self._timingReport
+
+    def _measureWithPipeline(self, pipe, command_list, n_frames, delay):
         if self._who == 'PAR + RM':
             vec_push_pull = np.array((1, -1))
             # mis = (len(command_list)-2) * n_push_pull * vec_push_pull.size
@@ -186,14 +249,13 @@ class OpticalCalibration():
                         for v in range(vec_push_pull.size):
                             par1 = pcmd * vec_push_pull[v]
                             print(par1)
-                            self._ott.parabola.setPosition(par0 + par1)
-                            masked_ima = self._interf.acquire_phasemap(n_frames, delay)
-                            masked_ima = self._interf.intoFullFrame(masked_ima)
+                            pipe.move(self._ott.parabola.setPosition, par0 + par1)
+                            masked_ima = pipe.acquire(n_frames, delay)
 
                             name = 'Frame_%04d.fits' % (2 * i + mis[v])
                             print(name)
-                            self._interf.save_phasemap(dove, name, masked_ima)
-                            self._ott.parabola.setPosition(par0)
+                            pipe.save(name, masked_ima)
+                            pipe.move(self._ott.parabola.setPosition, par0)
                     elif i == 1 or i == 2:
                         if i == 1:
                             l = i
@@ -204,30 +266,28 @@ class OpticalCalibration():
                         for v in range(vec_push_pull.size):
                             par1 = pcmd * vec_push_pull[v]
                             rm1 = rcmd * vec_push_pull[v]
-                            self._ott.parabola.setPosition(par0 + par1)
+                            targets = {'parabola': par0 + par1}
                             if np.count_nonzero(rm1) != 0:
-                                self._ott.referenceMirror.setPosition(rm0 + rm1)
+                                targets['referenceMirror'] = rm0 + rm1
+                            pipe.move(self._scheduler.moveTo, targets)
                             print(par1, rm1)
-                            masked_ima = self._interf.acquire_phasemap(n_frames, delay)
-                            masked_ima= self._interf.intoFullFrame(masked_ima)
+                            masked_ima = pipe.acquire(n_frames, delay)
 
                             name = 'Frame_%04d.fits' % (2 * i + mis[v])
                             print(name)
-                            self._interf.save_phasemap(dove, name, masked_ima)
-                            self._ott.parabola.setPosition(par0)
-                            self._ott.referenceMirror.setPosition(rm0)
+                            pipe.save(name, masked_ima)
+                            pipe.move(self._scheduler.moveTo, parabola=par0, referenceMirror=rm0)
                     else:
                         rcmd = np.array(command_list[i + 2])
                         for v in range(vec_push_pull.size):
                             rm1 = rcmd * vec_push_pull[v]
-                            self._ott.referenceMirror.setPosition(rm0 + rm1)
+                            pipe.move(self._ott.referenceMirror.setPosition, rm0 + rm1)
                             print(rm1)
-                            masked_ima = self._interf.acquire_phasemap(n_frames, delay)
-                            masked_ima = self._interf.intoFullFrame(masked_ima)
+                            masked_ima = pipe.acquire(n_frames, delay)
                             name = 'Frame_%04d.fits' % (2 * i + mis[v])
                             print(name)
-                            self._interf.save_phasemap(dove, name, masked_ima)
-                            self._ott.referenceMirror.setPosition(rm0)
+                            pipe.save(name, masked_ima)
+                            pipe.move(self._ott.referenceMirror.setPosition, rm0)
         elif self._who == 'PAR':
             pass
         elif self._who == 'RM':
@@ -241,12 +301,11 @@ class OpticalCalibration():
                     mis = np.array([j, j + 1])
                     for v in range(vec_push_pull.size):
                         m4_cmd = command_list[i] * vec_push_pull[v]
-                        self._ott.me.setPosition(m0 + m4_cmd)
-                        masked_ima = self._interf.acquire_phasemap(n_frames, delay)
-                        masked_ima = self._interf.intoFullFrame(masked_ima)
+                        pipe.move(self._ott.m4Exapode.setPosition, m0 + m4_cmd)
+                        masked_ima = pipe.acquire(n_frames, delay)
                         name = 'Frame_%04d.fits' %( 2*i + mis[v])
-                        self._interf.save_phasemap(dove, name, masked_ima)
-            self._ott.m4Exapode.setPosition(m0)
+                        pipe.save(name, masked_ima)
+            pipe.move(self._ott.m4Exapode.setPosition, m0)
 
     def _logAndDefineDovIndexForCommandMatrixCreation(self, who):
         '''
@@ -342,7 +401,7 @@ class OpticalCalibration():
         header['WHO'] = self._who
         pyfits.writeto(fits_file_name, self._commandAmpVector, header)
         pyfits.append(fits_file_name, self._commandMatrix.T, header)
-        pyfits.append(fits_file_name, self._mask.astype(int), header)
+        pyfits.append(fits_file_name, self._mask.astype(np.uint8), header)
         pyfits.append(fits_file_name, self._intMat, header)
 
         #file separti per Runa
@@ -351,7 +410,7 @@ class OpticalCalibration():
         fits_file_name = os.path.join(dove, 'CMat.fits')
         pyfits.writeto(fits_file_name, self._commandMatrix.T)
         fits_file_name = os.path.join(dove, 'Mask.fits')
-        pyfits.writeto(fits_file_name, self._mask.astype(int))
+        pyfits.writeto(fits_file_name, self._mask.astype(np.uint8))
         fits_file_name = os.path.join(dove, 'InteractionMatrix.fits')
         pyfits.writeto(fits_file_name, self._intMat)
 
@@ -391,22 +450,15 @@ class OpticalCalibration():
         if norm != True:
             self._commandAmpVector = np.ones(self._commandAmpVector.size)
         self._logger.info('Creation of the cube relative to %s', self.tt)
-        self._fullCube = None
         self._fold = os.path.join(OpticalCalibration._storageFolder(), self.tt)
         
         if self._fullCommandMatrix is None:
             dummy=self.getFullCommnadMatrix()
-        for i in range(self._fullCommandMatrix.shape[1]):
-            name_pos = 'Frame_%04d.fits' % i
-            print("Reding "+name_pos)
-            file = os.path.join(self._fold, name_pos)
-            hduList = pyfits.open(file)
-            final_ima = np.ma.masked_array(hduList[0].data, mask=hduList[1].data.astype(bool))
-
-            if self._fullCube is None:
-                self._fullCube = final_ima
-            else:
-                self._fullCube = np.ma.dstack((self._fullCube, final_ima))
+        nframes = self._fullCommandMatrix.shape[1]
+        file_names = [os.path.join(self._fold, 'Frame_%04d.fits' % i)
+                      for i in range(nframes)]
+        self._fullCube = read_data.CubeBuilder(nframes).map(
+            read_data.readFits_maskedImage, file_names, nthreads=8)
         return
 
 
@@ -416,9 +468,10 @@ class OpticalCalibration():
         if norm != True:
             self._commandAmpVector = np.ones(self._commandAmpVector.size)
         self._logger.info('Creation of the cube relative to %s', self.tt)
-        self._cube = None
         self._fold = os.path.join(OpticalCalibration._storageFolder(), self.tt)
+        builder = read_data.CubeBuilder(self._commandAmpVector.shape[0])
         for i in range(self._commandAmpVector.shape[0]):
+            push_pull = read_data.CubeBuilder(self._nPushPull)
             for j in range(self._nPushPull):
                 k = 2 * i + 2 * self._commandAmpVector.shape[0] * j
                 name_pos = 'Frame_%04d.fits' % k
@@ -435,19 +488,13 @@ class OpticalCalibration():
                 elif self._who == 'M4':
                     image = (image_pos + image_neg) / (2 * self._commandAmpVector[i])
 
-                if j == 0:
-                    all_push_pull_act = image
-                else:
-                    all_push_pull_act = np.ma.dstack((all_push_pull_act, image))
+                push_pull.setFrame(j, image)
             if self._nPushPull == 1:
-                final_ima = all_push_pull_act
-            else:
-                final_ima = np.ma.mean(all_push_pull_act, axis=2)
-
-            if self._cube is None:
-                self._cube = final_ima
+                final_ima = push_pull.cube()[:, :, 0]
             else:
-                self._cube = np.ma.dstack((self._cube, final_ima))
+                final_ima = np.ma.mean(push_pull.cube(), axis=2)
+            builder.setFrame(i, final_ima)
+        self._cube = builder.cube()
         return
 
     def getCube(self):
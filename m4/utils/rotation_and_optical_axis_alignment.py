@@ -12,6 +12,7 @@ from matplotlib import pyplot as plt
 from m4.configuration import config_folder_names as fold_name
 from m4.ground import tracking_number_folder
 from m4.ground import zernike
+from m4.ground.acquisition_pipeline import AcquisitionPipeline
 from m4.utils.parabola_identification import ParabolIdent
 
 class RotOptAlign():
@@ -35,6 +36,7 @@ class RotOptAlign():
         self._cube = None
         self._angles = None
         self.tt = None
+        self._timingReport = None
 
     @staticmethod
     def _storageFolder():
@@ -63,9 +65,9 @@ class RotOptAlign():
         total_angle = np.abs(end_point - start_point)/1.
         self._ott.angleRotator.setPosition(start_point)
         rot_angle = total_angle/n_points
-        number_of_image = np.int(total_angle/rot_angle)
+        number_of_image = int(total_angle/rot_angle)
         angle_list = []
-        self._cube = None
+        image_list = []
 
         start_angle = self._ott.angleRotator.getPosition()
         if end_point < start_point:
@@ -73,23 +75,36 @@ class RotOptAlign():
         elif end_point > start_point:
             direction = 1
 
-        for k in range(number_of_image+1):
-            #start_angle = self.ott.angle()
-            self._ott.angleRotator.setPosition(start_angle + k*rot_angle*direction)
-            angle_list.append(start_angle + k*rot_angle*direction)
-            time.sleep(5)
-            masked_ima = self._interf.acquire_phasemap(1)
-            name = 'Frame_%04d.fits' %k
-            self._interf.save_phasemap(dove, name, masked_ima)
-            if self._cube is None:
-                self._cube = masked_ima
-            else:
-                self._cube = np.ma.dstack((self._cube, masked_ima))
+        with AcquisitionPipeline(self._interf, dove) as pipe:
+            for k in range(number_of_image+1):
+                #start_angle = self.ott.angle()
+                pipe.move(self._rotateAndSettle, start_angle + k*rot_angle*direction)
+                angle_list.append(start_angle + k*rot_angle*direction)
+                masked_ima = pipe.acquire(1)
+                name = 'Frame_%04d.fits' %k
+                pipe.save(name, masked_ima)
+                image_list.append(masked_ima)
+        self._timingReport = pipe.report()
+        self._logger.info('Timing report: %s', self._timingReport)
+        self._cube = np.ma.dstack(image_list)
         self._saveCube(dove)
         self._angles = angle_list
         self._saveAngles(self._angles, self.tt)
         return self.tt
 
+    def _rotateAndSettle(self, angle):
+        self._ott.angleRotator.setPosition(angle)
+        time.sleep(5)
+
+    def getTimingReport(self):
+        '''
+        Returns
+        -------
+        report: dict
+            time spent in each stage of the last image acquisition
+        '''
+        return self._timingReport
+
     def data_analyzer(self):
         """
         Returns
@@ -0,0 +1,227 @@
+'''
+Reconstructor engine based on the singular value decomposition of an
+interaction matrix. The decomposition is computed once and the
+reconstructor (or directly the command for a measure) is obtained for
+any number of modes, rcond or Tikhonov regularization without computing
+it again. When a few rows of the interaction matrix are added or removed
+(i.e. pixels entering or leaving the analysis mask) the decomposition is
+updated from a small [nacts + nadded, nacts] problem.
+
+HOW TO USE IT::
+
+    from m4.utils.svd_reconstructor import SvdReconstructor
+    svd = SvdReconstructor(int_mat)
+    amp = svd.solve(wf.compressed(), n_modes=500)
+    rec = svd.reconstructor(rcond=1e-3, tikhonov=0.01)
+    svd.save(file_name)
+    svd = SvdReconstructor.load(file_name, int_mat)
+'''
+
+import numpy as np
+from astropy.io import fits as pyfits
+
+
+class SvdReconstructor():
+    '''
+    Class for the truncated and regularized pseudo inverse of an
+    interaction matrix [npixels, nacts]
+
+    HOW TO USE IT::
+
+        from m4.utils.svd_reconstructor import SvdReconstructor
+        svd = SvdReconstructor(int_mat)
+        amp = svd.solve(wf.compressed(), rcond=1e-15)
+    '''
+
+    def __init__(self, int_mat, s=None, vt=None, u=None):
+        """The constructor """
+        self._intMat = int_mat
+        if s is None:
+            self._u, self._s, self._vt = np.linalg.svd(int_mat,
+                                                       full_matrices=False)
+        else:
+            self._u = u
+            self._s = s
+            self._vt = vt
+
+    @property
+    def singularValues(self):
+        ''' Singular values of the interaction matrix '''
+        return self._s
+
+    @property
+    def nModes(self):
+        ''' Number of modes of the decomposition '''
+        return self._s.size
+
+    def getInteractionMatrix(self):
+        '''
+        Returns
+        -------
+            int_mat: numpy array [npixels, nacts]
+                interaction matrix
+        '''
+        return self._intMat
+
+    def filterFactors(self, n_modes=None, rcond=1e-15, tikhonov=0.):
+        '''
+        Parameters
+        ----------
+            n_modes: int
+                number of modes to use. If None all the modes are used
+            rcond: float
+                cutoff for small singular values, relative to the largest one
+            tikhonov: float
+                Tikhonov regularization parameter
+
+        Returns
+        -------
+            h: numpy array [nmodes]
+                inverse gain of each mode: s / (s**2 + tikhonov**2) for
+                the modes used, zero for the others
+        '''
+        s = self._s
+        use = s > rcond * s[0]
+        if n_modes is not None:
+            use[n_modes:] = False
+        h = np.zeros(s.size)
+        h[use] = s[use] / (s[use]**2 + tikhonov**2)
+        return h
+
+    def reconstructor(self, n_modes=None, rcond=1e-15, tikhonov=0.):
+        '''
+        Parameters
+        ----------
+            n_modes: int
+                number of modes to use. If None all the modes are used
+            rcond: float
+                cutoff for small singular values, relative to the largest one
+            tikhonov: float
+                Tikhonov regularization parameter
+
+        Returns
+        -------
+            rec: numpy array [nacts, npixels]
+                reconstructor
+        '''
+        h = self.filterFactors(n_modes, rcond, tikhonov)
+        return np.dot(self._vt.T * h, self._getU().T)
+
+    def solve(self, wf, n_modes=None, rcond=1e-15, tikhonov=0.):
+        '''
+        Same as np.dot(reconstructor(...), wf) without creating the
+        reconstructor
+
+        Parameters
+        ----------
+            wf: numpy array [npixels] or [npixels, nmeas]
+                measurements on the valid points of the mask
+            n_modes: int
+                number of modes to use. If None all the modes are used
+            rcond: float
+                cutoff for small singular values, relative to the largest one
+            tikhonov: float
+                Tikhonov regularization parameter
+
+        Returns
+        -------
+            amp: numpy array [nacts] or [nacts, nmeas]
+                least square solution
+        '''
+        h = self.filterFactors(n_modes, rcond, tikhonov)
+        if self._u is None:
+            # U.T wf = S^-1 V.T A.T wf, without computing U
+            h = h * self._inverseSingularValues()
+            proj = np.dot(self._vt, np.dot(self._intMat.T, wf))
+        else:
+            proj = np.dot(self._u.T, wf)
+        h = h.reshape((-1,) + (1,) * (np.ndim(wf) - 1))
+        return np.dot(self._vt.T, h * proj)
+
+    def update(self, int_mat, kept=None, added=None):
+        '''
+        Decomposition of an interaction matrix differing from this one
+        for a few rows, updating the thin decomposition (U, s, Vt) without
+        forming the Gram matrix: the kept rows of U are orthonormalized
+        with a QR, the added rows are projected on V and the singular
+        values are obtained from a small [nacts + nadded, nacts] problem
+
+        Parameters
+        ----------
+            int_mat: numpy array [npixels, nacts]
+                new interaction matrix
+            kept: boolean numpy array [old npixels]
+                rows of the old interaction matrix in the new one (in the
+                same order). If None all the rows are kept
+            added: boolean numpy array [npixels]
+                rows of the new interaction matrix not in the old one. If
+                None no row is added
+
+        Returns
+        -------
+            svd: object
+                SvdReconstructor of int_mat
+        '''
+        if self._u is None or self._vt.shape[0] != self._vt.shape[1]:
+            # U obtained from A V / s would lose the accuracy of the
+            # small singular values: start again from the full problem
+            return SvdReconstructor(int_mat)
+        u = self._u
+        if kept is None:
+            kept = np.ones(u.shape[0], dtype=bool)
+        if added is None:
+            added = np.zeros(int_mat.shape[0], dtype=bool)
+        nacts = self._s.size
+        q, r = np.linalg.qr(u[kept])
+        small = np.vstack((r * self._s,
+                           np.dot(int_mat[added], self._vt.T)))
+        us, s, wt = np.linalg.svd(small, full_matrices=False)
+        new_u = np.empty((int_mat.shape[0], nacts))
+        new_u[~added] = np.dot(q, us[:nacts])
+        new_u[added] = us[nacts:]
+        return SvdReconstructor(int_mat, s, np.dot(wt, self._vt), new_u)
+
+    def save(self, file_name, header=None):
+        '''
+        Parameters
+        ----------
+            file_name: string
+                fits file path where to save singular values and
+                right singular vectors
+            header: fits header
+                additional information to save (e.g. the mask hash)
+        '''
+        pyfits.writeto(file_name, self._s, header, overwrite=True)
+        pyfits.append(file_name, self._vt)
+
+    @staticmethod
+    def load(file_name, int_mat):
+        '''
+        Parameters
+        ----------
+            file_name: string
+                fits file path written by save
+            int_mat: numpy array [npixels, nacts]
+                interaction matrix of the saved decomposition
+
+        Returns
+        -------
+            svd: object
+                SvdReconstructor
+        '''
+        with pyfits.open(file_name) as hduList:
+            s = np.array(hduList[0].data)
+            vt = np.array(hduList[1].data)
+        return SvdReconstructor(int_mat, s, vt)
+
+    def _inverseSingularValues(self):
+        g = np.zeros(self._s.size)
+        nonzero = self._s > 0
+        g[nonzero] = 1. / self._s[nonzero]
+        return g
+
+    def _getU(self):
+        if self._u is None:
+            self._u = np.dot(self._intMat, self._vt.T) * \
+                self._inverseSingularValues()
+        return self._u
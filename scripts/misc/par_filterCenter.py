@@ -2,6 +2,8 @@ import numpy as np
 from matplotlib.pyplot import *
 from m4.mini_OTT import timehistory as th
 from m4.ground import geo
+from m4.ground import zernike
+from m4.ground import read_data
 
 #filterFrames(tn,0.1,0.03,1.2)
 
@@ -31,11 +33,10 @@ def filterFrames(tn,rad1=0.1,rad2=0.02,thr=None):
 #    img1 = np.ma.masked_array(img1.data, mmask)
 #    imshow(img1)
     st=[]
-    for i in range(len(fl)):
-        img=th.frame(i,fl)
-        img = np.ma.masked_array(img, mmask)
-        img=th.removeZernike(img, [1,2,3])
-        st.append(img.std())    
+    for cube in read_data.FrameLoader(fl).chunks(100):
+        cube = np.ma.masked_array(cube, cube.mask | (mmask == 1))
+        coeff, res = zernike.zernikeFitCube(cube, np.array([1,2,3]), residual=True)
+        st.extend(res[i].std() for i in range(res.shape[0]))
     st = np.array(st)
     print('min value = %.3e m, RMS = %.3e m' %(np.min(st),st.std()))
     figure()
@@ -4,7 +4,7 @@ import os
 from astropy.io import fits as pyfits
 from m4.ground import zernike as zern
 from m4.mini_OTT import timehistory as th
-from m4.ground import geo, rebinner
+from m4.ground import geo, rebinner, read_data
 
 
 
@@ -101,10 +101,10 @@ def gimmethelist(tn, fold):
 def getcube(flist, rebfactor):
     nf = len(flist)
     imgcube = []
-    for i in flist:
-        img = th.read_phasemap(i)
-        img = rebin(img,rebfactor)
-        imgcube.append(img)
+    for cube in read_data.FrameLoader(flist).chunks(100):
+        for img in cube:
+            img = rebin(img,rebfactor)
+            imgcube.append(img)
     return imgcube
     
 def std_check(thecube, thr, removeZern=0):
@@ -108,6 +108,9 @@ setup(name=NAME,
           'gui_scripts': [
               'ott_geometry=m4.ground.GUI:main',
           ],
+          'console_scripts': [
+              'm4_tncatalog=m4.ground.tracking_number_catalog:main',
+          ],
       },
       test_suite='test',
       cmdclass={'upload': UploadCommand, },
@@ -0,0 +1,58 @@
+'''
+Authors
+  - C. Selmi:  written in 2023
+'''
+import unittest
+import numpy as np
+from m4.analyzers.analyzer_iffunctions import AnalyzerIFF
+
+
+class TestAnalyzerIFF(unittest.TestCase):
+
+    def setUp(self):
+        mask = np.ones((30, 40, 6), dtype=bool)
+        mask[5:25, 5:35, :] = False
+        self.an = AnalyzerIFF()
+        self.an._cube = np.ma.masked_array(np.random.rand(30, 40, 6),
+                                           mask=mask)
+
+    def testInteractionMatrix(self):
+        cube = self.an.getCube()
+        mask = self.an.getMasterMask()
+        mask[10, 10] = True
+        self.an.setDetectorMask(mask)
+        int_mat = self.an.getInteractionMatrix()
+        self.assertEqual(int_mat.shape, (20 * 30 - 1, 6))
+        for i in range(6):
+            expected = np.ma.masked_array(cube.data[:, :, i], mask=mask)
+            np.testing.assert_array_equal(int_mat[:, i], expected.compressed())
+
+    def testReconstructorCache(self):
+        master_mask = self.an.getMasterMask()
+        self.an.setDetectorMask(master_mask)
+        rec = self.an.getReconstructor()
+        np.testing.assert_allclose(
+            rec, np.linalg.pinv(self.an.getInteractionMatrix(), rcond=1e-15))
+        mask = master_mask.copy()
+        mask[10, 10] = True
+        self.an.setDetectorMask(mask)
+        rec2 = self.an.getReconstructor()
+        self.assertEqual(rec2.shape[1], rec.shape[1] - 1)
+        self.an.setDetectorMask(master_mask.copy())
+        self.assertIs(self.an.getReconstructor(), rec)
+        self.assertIsNot(self.an.getReconstructor(1e-3), rec)
+
+    def testSvdReconstructor(self):
+        master_mask = self.an.getMasterMask()
+        self.an.setDetectorMask(master_mask)
+        svd = self.an.getSvdReconstructor()
+        mask = master_mask.copy()
+        mask[10, 10:14] = True
+        self.an.setDetectorMask(mask)
+        svd2 = self.an.getSvdReconstructor()
+        self.assertIsNot(svd2, svd)
+        np.testing.assert_allclose(
+            self.an.getReconstructor(),
+            np.linalg.pinv(self.an.getInteractionMatrix()), atol=1e-8)
+        self.an.setDetectorMask(master_mask.copy())
+        self.assertIs(self.an.getSvdReconstructor(), svd)
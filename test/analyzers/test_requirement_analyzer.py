@@ -4,6 +4,8 @@ Authors
 '''
 import unittest
 import os
+import numpy as np
+from skimage.draw import disk
 from m4.analyzers import requirement_analyzer as req_check
 from test.test_helper import testDataRootDir
 from m4.ground import read_data
@@ -30,4 +32,91 @@ class TestRequirementAnalyzer(unittest.TestCase):
         roc = req_check.test283(image, pscale, step)
         rem_31 = req_check.test243(image, 0.015, pscale, step, n_patches)
         rms_500 = req_check.test243(image, 0.1, pscale, step, n_patches)
-        
\ No newline at end of file
+        
+    def testPatchStatistics(self):
+        img = np.random.rand(60, 60)
+        mask = np.ones((60, 60), dtype=bool)
+        rr, cc = disk((30, 30), 22)
+        mask[rr, cc] = 0
+        mask[20:23, 25:40] = 1
+        image = np.ma.masked_array(img, mask=mask)
+        x, y = np.where(image.mask == 0)
+        x, y = x[::37], y[::37]
+        stats = req_check.PatchStatistics(image)
+        rms, valid = stats.planeRms(8, (x, y), 5)
+        alpha, beta, valid2 = stats.curvature(8, (x, y), 100.)
+        for i in range(x.size):
+            ima = req_check._circleImage(image, x[i], y[i], 8)
+            small = req_check._circleImage(image, x[i], y[i], 5)
+            self.assertEqual(valid[i], ima is not None and small is not None)
+            self.assertEqual(valid2[i], ima is not None)
+            if ima is None:
+                continue
+            if small is not None:
+                res = req_check._circleImage(req_check.tiptilt_fit(ima),
+                                             x[i], y[i], 5)
+                self.assertAlmostEqual(rms[i], np.std(res), places=10)
+            a, b = req_check.curv_fit_v2(ima, 100.)
+            self.assertAlmostEqual(alpha[i], a, places=6)
+            self.assertAlmostEqual(beta[i], b, places=6)
+
+    def testPatchesAnalysisMatchesOld(self):
+        yy, xx = np.mgrid[0:100, 0:100]
+        mask = (xx - 50)**2 + (yy - 50)**2 > 40**2
+        mask |= (xx - 50)**2 + (yy - 50)**2 < 8**2
+        mask[30:33, 40:75] = True
+        rng = np.random.default_rng(1)
+        img = 1e-8 * (rng.normal(size=(100, 100)) + 0.05 * xx - 0.03 * yy +
+                      1e-3 * (xx - 50)**2) + 2e-7
+        image = np.ma.masked_array(img, mask=mask)
+        step = 7
+        self.assertNotEqual(image.count() % step, 0)
+        for radius_m in (0.015, 0.25):
+            req, list_ima, result = req_check.patches_analysis(
+                image, radius_m, pixelscale=200., step=step)
+            req_old, list_old, result_old = _oldPatchesAnalysis(
+                image, radius_m, 200., step)
+            np.testing.assert_allclose(result, result_old, rtol=1e-8)
+            self.assertAlmostEqual(req, req_old, delta=1e-8 * req_old)
+            for ima, ima_old in zip(list_ima, list_old):
+                np.testing.assert_array_equal(ima.mask, ima_old.mask)
+
+
+def _oldPatchesAnalysis(image, radius_m, pixelscale, step):
+    ''' patches_analysis before PatchStatistics, for the rms requirements
+    without the n_patches cut '''
+    ps = 1/pixelscale
+    raggio_px = radius_m/ps
+    nn = image.compressed().shape[0]
+    idx = np.where(image.mask == 0)
+    x = idx[0]
+    y = idx[1]
+    n_point = int(nn/step)+1
+    result_list = []
+    list_ima = []
+    for i in range(n_point):
+        p = i + i * (step - 1)
+        if radius_m == 0.015:
+            thresh = 0.95
+            r_px1 = 0.1/2/ps
+            ima = req_check._circleImage(image, x[p], y[p], r_px1)
+            if ima is not None:
+                new_ima = req_check.tiptilt_fit(ima)
+                final_ima = req_check._circleImage(new_ima, x[p], y[p], raggio_px)
+                if final_ima is not None:
+                    if i == 2:
+                        list_ima.append(final_ima)
+                    final_ima = final_ima - np.mean(final_ima)
+                    result_list.append(np.std(final_ima))
+        if radius_m == 0.25:
+            thresh = 0.95
+            r_px1 = 0.1/2/ps
+            ima = req_check._circleImage(image, x[p], y[p], r_px1)
+            if ima is not None:
+                new_ima = req_check.tiptilt_fit(ima)
+                result_list.append(np.std(new_ima))
+    result_vect = np.array(result_list)
+    result_sort = np.copy(result_vect)
+    result_sort.sort()
+    req = result_sort[int(thresh*result_sort.size)]
+    return req, list_ima, result_vect
@@ -302,6 +302,66 @@ class Testi4d(unittest.TestCase):
         wanted_url = self._expected_url_BurstFramesToDisk()
         self.assertEqual(self._calls[-1]['url'], wanted_url)
 
+    def test_keep_alive_and_data_decoding(self):
+        import threading
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+        ports = []
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                ports.append(self.client_address[1])
+                body = b'{"Width": 3, "Height": 2, "PixelSizeInMicrons": 13.2, ' \
+                       b'"Data": [1.5, NaN, -2e-3, 4, 5, 6]}'
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        interf = I4D('127.0.0.1', server.server_address[1], timeout=5)
+        for i in range(3):
+            width, height, pixel_size, data = interf.takeSingleMeasurement()
+        interf.close()
+        server.shutdown()
+        server.server_close()
+        self.assertEqual((width, height), (3, 2))
+        self.assertEqual(data.dtype, np.float32)
+        np.testing.assert_array_equal(data, np.array([1.5, np.nan, -2e-3, 4, 5, 6],
+                                                     dtype=np.float32))
+        self.assertEqual(len(set(ports)), 1)
+        stats = interf.getLatencyStats()
+        self.assertEqual(stats['TakeSingleMeasurement']['ncalls'], 3)
+
+    def test_error_response_records_latency(self):
+        interf = I4D('127.0.0.1', 8011)
+        with mock.patch.object(interf, '_request', return_value=(500, b'<html>error</html>')):
+            with self.assertLogs('I4D', level='ERROR') as logs:
+                self.assertRaises(Exception, interf.takeSingleMeasurement)
+        self.assertIn('<html>error</html>', logs.output[0])
+        self.assertEqual(interf.getLatencyStats()['TakeSingleMeasurement']['ncalls'], 1)
+
+    def test_decode_only_top_level_data(self):
+        from m4.devices.i4d import _decodeJson
+        json_data = _decodeJson(b'{"Info": {"Data": [1, 2]}, "Name": "[Data]", '
+                                b'"Data": [1, 2.5, NaN]}')
+        self.assertEqual(json_data['Info']['Data'], [1, 2])
+        self.assertEqual(json_data['Data'].dtype, np.float32)
+        np.testing.assert_array_equal(json_data['Data'], np.array([1, 2.5, np.nan],
+                                                                  dtype=np.float32))
+        json_data = _decodeJson(b'{"Info": {"Data": [1, 2]}}')
+        self.assertEqual(json_data, {'Info': {'Data': [1, 2]}})
+        json_data = _decodeJson(b'[{"Data": [1, 2]}]')
+        self.assertEqual(json_data, [{'Data': [1, 2]}])
+        json_data = _decodeJson(b'{"Data": ["a", "b"]}')
+        self.assertEqual(json_data, {'Data': ['a', 'b']})
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,41 @@
+'''
+Authors
+  - C. Selmi: written in 2024
+'''
+import unittest
+import numpy as np
+from m4.devices.interferometer import I4d6110
+
+
+class FakeI4D():
+
+    def __init__(self, frames):
+        self._frames = list(frames)
+
+    def takeSingleMeasurement(self):
+        data = self._frames.pop(0)
+        return data.shape[1], data.shape[0], 10., data.flatten()
+
+
+class TestI4d6110(unittest.TestCase):
+
+    def testPipelinedAcquisition(self):
+        frames = [np.random.rand(6, 5).astype(np.float32) for i in range(4)]
+        for i, frame in enumerate(frames):
+            frame[i, :2] = np.nan
+        frames[0][5, 4] = frames[1][5, 4] = frames[2][5, 4] = frames[3][5, 4] = np.nan
+        interf = I4d6110()
+        interf._i4d = FakeI4D(frames)
+        ima, timing = interf.acquire_phasemap(4, timing=True)
+
+        cube = np.ma.dstack([interf._fromDataArrayToMaskedArray(5, 6, f*632.8e-9)
+                             for f in frames])
+        expected = np.ma.mean(cube, 2)
+        np.testing.assert_array_equal(ima.mask, expected.mask)
+        np.testing.assert_allclose(ima.compressed(), expected.compressed(), rtol=1e-6)
+        self.assertEqual(timing['measure'].shape, (4,))
+        self.assertIs(interf.getLastTiming(), timing)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+'''
+Authors
+  - C. Selmi: written in 2024
+'''
+import os
+import time
+import threading
+import shutil
+import tempfile
+import unittest
+import mock
+import numpy as np
+from astropy.io import fits as pyfits
+from m4.ground import read_data
+from m4.ground.acquisition_pipeline import AcquisitionPipeline
+from m4.devices.base_interferometer import BaseInterferometer
+
+_saveMaskedImage = read_data.saveMaskedImage
+
+
+def _slowSave(*args, **kwargs):
+    time.sleep(0.1)
+    return _saveMaskedImage(*args, **kwargs)
+
+
+class SlowInterferometer(BaseInterferometer):
+
+    def __init__(self):
+        self._count = 0
+        self._fullFrameThreads = set()
+
+    def acquire_phasemap(self, nframes=1, delay=0):
+        self._count += 1
+        return np.ma.masked_array(np.full((4, 5), float(self._count)),
+                                  mask=np.zeros((4, 5), dtype=bool))
+
+    def intoFullFrame(self, img):
+        self._fullFrameThreads.add(threading.current_thread())
+        time.sleep(0.02)
+        return img * 2
+
+    def save_phasemap(self, location, file_name, masked_image):
+        return self._writePhasemap(location, file_name, masked_image)
+
+
+class TestAcquisitionPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self._folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._folder)
+
+    @mock.patch('m4.ground.read_data.saveMaskedImage', side_effect=_slowSave)
+    def testOverlappedSave(self, mock_save):
+        interf = SlowInterferometer()
+        t0 = time.time()
+        with AcquisitionPipeline(interf, self._folder, full_frame=True) as pipe:
+            for i in range(3):
+                pipe.move(time.sleep, 0.1)
+                pipe.save('Frame_%04d.fits' % i, pipe.acquire())
+        self.assertLess(time.time() - t0, 0.55)
+        for i in range(3):
+            data = pyfits.getdata(os.path.join(self._folder, 'Frame_%04d.fits' % i))
+            np.testing.assert_array_equal(data, 2. * (i + 1))
+        report = pipe.report()
+        self.assertEqual([report[s]['n'] for s in pipe.STAGES], [3, 3, 3])
+        self.assertEqual(report['writer']['written'], 3)
+        self.assertGreater(report['writer']['transform_time'], 0.05)
+        self.assertLess(report['save']['total'], 0.05)
+        self.assertNotIn(threading.current_thread(), interf._fullFrameThreads)
+        self.assertEqual(mock_save.call_count, 3)
+        self.assertIsNone(interf._frameWriter)
+
+    def testWriteErrorStopsTheRun(self):
+        interf = SlowInterferometer()
+        folder = os.path.join(self._folder, 'missing')
+        with self.assertRaises(OSError):
+            with AcquisitionPipeline(interf, folder) as pipe:
+                for i in range(3):
+                    pipe.save('Frame_%04d.fits' % i, pipe.acquire())
+                    pipe.move(time.sleep, 0.1)
+        self.assertLess(pipe.report()['save']['n'], 3)
+        self.assertIsNone(interf._frameWriter)
+
+    def testDryRun(self):
+        with AcquisitionPipeline(SlowInterferometer(), self._folder, dry_run=True) as pipe:
+            pipe.save('Frame_0000.fits', pipe.acquire())
+        self.assertEqual(os.listdir(self._folder), [])
+        self.assertEqual(pipe.report()['save']['n'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
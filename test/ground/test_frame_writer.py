@@ -0,0 +1,81 @@
+'''
+Authors
+  - C. Selmi: written in 2024
+'''
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from astropy.io import fits as pyfits
+from m4.ground import read_data
+from m4.ground.frame_writer import FrameWriter
+
+
+class TestFrameWriter(unittest.TestCase):
+
+    def setUp(self):
+        self._folder = tempfile.mkdtemp()
+        self._images = [np.ma.masked_array(np.random.rand(30, 37).astype(np.float32),
+                                           mask=np.random.rand(30, 37) > 0.7)
+                        for i in range(6)]
+
+    def tearDown(self):
+        shutil.rmtree(self._folder)
+
+    def _check(self, file_list):
+        for file_name, img in zip(file_list, self._images):
+            ima = read_data.readFits_maskedImage(file_name)
+            np.testing.assert_array_equal(ima.data, img.data)
+            np.testing.assert_array_equal(ima.mask, img.mask)
+
+    def testWriteAndAck(self):
+        file_list = [os.path.join(self._folder, '%d.fits' % i) for i in range(6)]
+        with FrameWriter(max_queue=2) as writer:
+            acks = [writer.write(f, img) for f, img in zip(file_list, self._images)]
+        self.assertEqual([a.result() for a in acks], file_list)
+        self._check(file_list)
+        stats = writer.getStats()
+        self.assertEqual(stats['queued'], 6)
+        self.assertEqual(stats['written'], 6)
+        self.assertEqual(stats['pending'], 0)
+        self.assertLessEqual(stats['max_depth'], 2)
+        self.assertEqual(len(pyfits.open(file_list[0])), 2)
+
+    def testCompressedLayout(self):
+        file_list = [os.path.join(self._folder, '%d.fits' % i) for i in range(6)]
+        writer = FrameWriter(compress=True)
+        for f, img in zip(file_list, self._images):
+            writer.write(f, img)
+        writer.flush()
+        self._check(file_list)
+        cube = read_data.FrameLoader(file_list, nthreads=2).cube()
+        np.testing.assert_array_equal(cube.mask[3], self._images[3].mask)
+        writer.close()
+        self.assertRaises(RuntimeError, writer.write, file_list[0], self._images[0])
+
+    def testErrorOnFlush(self):
+        writer = FrameWriter()
+        ack = writer.write(os.path.join(self._folder, 'no', '0.fits'),
+                           self._images[0])
+        self.assertRaises(OSError, writer.flush)
+        self.assertIsInstance(ack.exception(), OSError)
+        self.assertEqual(writer.getStats()['failed'], 1)
+        writer.close()
+
+    def testCheckErrorsAndMaskDtype(self):
+        writer = FrameWriter()
+        file_name = os.path.join(self._folder, '0.fits')
+        writer.write(file_name, self._images[0], mask_dtype=int).result()
+        writer.checkErrors()
+        self.assertEqual(pyfits.getdata(file_name, 1).dtype.kind, 'i')
+        ack = writer.write(os.path.join(self._folder, 'no', '1.fits'),
+                           self._images[1])
+        self.assertIsInstance(ack.exception(), OSError)
+        self.assertRaises(OSError, writer.checkErrors)
+        writer.checkErrors()
+        writer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,7 +4,11 @@ Authors
 '''
 import unittest
 import os
+import shutil
+import tempfile
+from unittest import mock
 import numpy as np
+from astropy.io import fits as pyfits
 from skimage.draw import disk
 from m4.ground import geo
 from m4.ground import smooth_function
@@ -30,6 +34,24 @@ class Test(unittest.TestCase):
         geo.qpupil(masked_ima)
         geo.rotate(img, 30)
 
+    def testBlockStats(self):
+        img = np.ma.masked_array(np.random.rand(2, 20, 23),
+                                 mask=np.random.rand(2, 20, 23) > 0.7)
+        img.mask[1, 5:10, 5:10] = True
+        count, mean, std = geo.block_stats(img, 5)
+        self.assertEqual(count.shape, (2, 4, 4))
+        for k in range(2):
+            for i in range(4):
+                for j in range(4):
+                    kk = img[k, i*5:i*5+5, j*5:j*5+5]
+                    self.assertEqual(count[k, i, j], kk.count())
+                    if kk.count() == 0:
+                        self.assertTrue(mean.mask[k, i, j])
+                        self.assertTrue(std.mask[k, i, j])
+                    else:
+                        self.assertAlmostEqual(mean[k, i, j], kk.mean())
+                        self.assertAlmostEqual(std[k, i, j], kk.std())
+
     @unittest.skip('Dove mettere il file')
     def testLogger(self):
         import tempfile
@@ -63,3 +85,170 @@ class Test(unittest.TestCase):
 
         coef, mat = zernike.zernikeFit(masked_ima, np.arange(10) + 1)
         zernike.zernikeSurface(masked_ima, coef, mat)
+
+    def testZernikeFitterCache(self):
+        img = np.random.rand(200, 200)
+        mask = np.ones((200, 200), dtype=bool)
+        rr, cc = disk((100, 100), 80)
+        mask[rr, cc] = 0
+        masked_ima = np.ma.masked_array(img, mask=mask)
+        modes = np.arange(10) + 1
+
+        fitter = zernike.ZernikeFitter(maxsize=1)
+        coef, mat = fitter.fit(masked_ima, modes)
+        mm = np.invert(mask)
+        expected = np.linalg.lstsq(mat, img[mm], rcond=-1)[0]
+        np.testing.assert_allclose(coef, expected, atol=1e-10)
+
+        coef2, mat2 = fitter.fit(masked_ima * 2, modes)
+        self.assertIs(mat2, mat)
+        np.testing.assert_allclose(coef2, 2 * coef, atol=1e-10)
+
+        fitter.fit(masked_ima, modes[:3])
+        self.assertEqual(len(fitter._cache), 1)
+        coef3, mat3 = fitter.fit(masked_ima, modes)
+        self.assertIsNot(mat3, mat)
+
+    def testZernikeFitCube(self):
+        img = np.random.rand(4, 100, 100)
+        mask = np.ones((4, 100, 100), dtype=bool)
+        rr, cc = disk((50, 50), 40)
+        mask[:, rr, cc] = 0
+        mask[3, 50:55, 50:55] = 1
+        cube = np.ma.masked_array(img, mask=mask)
+        modes = np.arange(6) + 1
+
+        with mock.patch.object(zernike._fitter, 'basis',
+                               wraps=zernike._fitter.basis) as basis:
+            coeff, res = zernike.zernikeFitCube(cube, modes, residual=True)
+        self.assertEqual(basis.call_count, 2)
+        self.assertEqual(coeff.shape, (4, 6))
+        for i in range(4):
+            cc, mat = zernike.zernikeFit(cube[i], modes)
+            np.testing.assert_allclose(coeff[i], cc, atol=1e-10)
+            surf = zernike.zernikeSurface(cube[i], cc, mat)
+            np.testing.assert_allclose(res[i].compressed(),
+                                       (cube[i] - surf).compressed(), atol=1e-10)
+        np.testing.assert_array_equal(res.mask, mask)
+
+    def testZernikeMatrix(self):
+        xx = np.random.uniform(-0.7, 0.7, 1000)
+        yy = np.random.uniform(-0.7, 0.7, 1000)
+        rho = np.sqrt(xx**2 + yy**2)
+        phi = np.arctan2(yy, xx)
+        mat = zernike._getZernike(xx, yy, np.array([1, 4, 7, 11]))
+        np.testing.assert_allclose(mat[:, 0], 1)
+        np.testing.assert_allclose(mat[:, 1], np.sqrt(3) * (2 * rho**2 - 1))
+        np.testing.assert_allclose(mat[:, 2],
+                                   np.sqrt(8) * (3 * rho**3 - 2 * rho) * np.sin(phi))
+        np.testing.assert_allclose(mat[:, 3],
+                                   np.sqrt(5) * (6 * rho**4 - 6 * rho**2 + 1))
+        mat32 = zernike._getZernike(xx, yy, np.array([1, 4, 7, 11]),
+                                    dtype=np.float32)
+        self.assertEqual(mat32.dtype, np.float32)
+        np.testing.assert_allclose(mat32, mat, atol=1e-5)
+
+
+class TestFrameFiles(unittest.TestCase):
+
+    def setUp(self):
+        self._folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._folder)
+
+    def testFrameLoader(self):
+        file_list = []
+        images = []
+        for i in range(5):
+            img = np.ma.masked_array(np.random.rand(20, 30),
+                                     mask=np.random.rand(20, 30) > 0.8)
+            file_name = os.path.join(self._folder, '%d.fits' % i)
+            pyfits.writeto(file_name, img.data)
+            pyfits.append(file_name, img.mask.astype(np.uint8))
+            file_list.append(file_name)
+            images.append(img)
+
+        loader = read_data.FrameLoader(file_list, nthreads=2)
+        with mock.patch.object(read_data, 'read_phasemap',
+                               wraps=read_data.read_phasemap) as reader:
+            cube = loader.cube()
+        self.assertEqual(reader.call_count, 5)
+        self.assertEqual(cube.shape, (5, 20, 30))
+        for i in range(5):
+            np.testing.assert_array_equal(cube[i].data, images[i].data)
+            np.testing.assert_array_equal(cube[i].mask, images[i].mask)
+        chunks = list(loader.chunks(2))
+        self.assertEqual([len(c) for c in chunks], [2, 2, 1])
+        np.testing.assert_array_equal(chunks[2][0].data, images[4].data)
+
+    def testH5FrameCube(self):
+        file_list = []
+        images = []
+        for i in range(3):
+            img = np.ma.masked_array(np.random.rand(10, 13).astype(np.float32),
+                                     mask=np.random.rand(10, 13) > 0.8)
+            file_name = os.path.join(self._folder, '%d.fits' % i)
+            pyfits.writeto(file_name, img.data)
+            pyfits.append(file_name, img.mask.astype(np.uint8))
+            file_list.append(file_name)
+            images.append(img)
+
+        h5 = read_data.InterferometerConverter.fromFileListToH5Cube(
+            file_list, self._folder, 'frames.h5')
+        with read_data.H5FrameCube(h5) as fc:
+            self.assertEqual(len(fc), 3)
+            np.testing.assert_array_equal(fc.frame(1).data, images[1].data)
+            np.testing.assert_array_equal(fc.frame(1).mask, images[1].mask)
+            cube = fc[1:3]
+            self.assertEqual(cube.shape, (2, 10, 13))
+            np.testing.assert_array_equal(cube.mask[1], images[2].mask)
+            self.assertEqual(fc.fileNames(), ['0.fits', '1.fits', '2.fits'])
+            self.assertEqual(fc.timestamps().shape, (3,))
+
+    def testLazyMaskedCube(self):
+        file_name = os.path.join(self._folder, 'Cube.fits')
+        cube = np.ma.masked_array(np.random.rand(12, 17, 5),
+                                  mask=np.random.rand(12, 17, 5) > 0.7)
+        read_data.saveMaskedCube(file_name, cube)
+        lazy = read_data.readMaskedCube(file_name)
+        self.assertEqual(lazy.shape, cube.shape)
+        for key in [(slice(None), slice(None), 2),
+                    (slice(2, 8), 3, slice(1, 4)),
+                    (4, slice(None), np.array([0, 3])),
+                    (slice(None), slice(None), (np.array([1, 2]),))]:
+            np.testing.assert_array_equal(lazy[key].data, cube[key].data)
+            np.testing.assert_array_equal(lazy[key].mask, cube[key].mask)
+        np.testing.assert_array_equal(lazy.mask, cube.mask)
+        full = lazy.toMaskedArray()
+        np.testing.assert_array_equal(full.data, cube.data)
+        lazy.close()
+
+        read_data.saveMaskedCube(file_name, cube, overwrite=True, packed=False)
+        np.testing.assert_array_equal(pyfits.getdata(file_name), cube.data)
+        with read_data.openMaskedCube(file_name) as old:
+            np.testing.assert_array_equal(old.mask, cube.mask)
+
+    def testCubeBuilder(self):
+        images = [np.ma.masked_array(np.random.rand(8, 9),
+                                     mask=np.random.rand(8, 9) > 0.7)
+                  for i in range(4)]
+        builder = read_data.CubeBuilder(4)
+        for img in images:
+            builder.append(img)
+        self.assertRaises(IndexError, builder.append, images[0])
+        cube = builder.cube()
+        self.assertEqual(cube.shape, (8, 9, 4))
+        expected = np.ma.dstack(images)
+        np.testing.assert_array_equal(cube.data, expected.data)
+        np.testing.assert_array_equal(cube.mask, expected.mask)
+
+        builder = read_data.CubeBuilder(4, memmap_folder=self._folder)
+        cube = builder.map(lambda i: images[i], range(4), nthreads=2)
+        np.testing.assert_array_equal(cube.mask, expected.mask)
+        builder32 = read_data.CubeBuilder(4, memmap_folder=self._folder)
+        cube32 = builder32.map(lambda i: images[i].astype(np.float32), range(4))
+        self.assertEqual(cube32.dtype, np.float32)
+        self.assertEqual(len(os.listdir(self._folder)), 4)
+        np.testing.assert_array_equal(cube.data, expected.data)
+        del builder, cube, builder32, cube32
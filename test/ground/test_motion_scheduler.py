@@ -0,0 +1,63 @@
+'''
+Authors
+  - C. Selmi: written in 2024
+'''
+import time
+import unittest
+from m4.ground.motion_scheduler import MotionScheduler
+
+
+class SlowAxis():
+
+    def __init__(self):
+        self._pos = 0
+
+    def setPosition(self, pos):
+        if pos < 0:
+            raise ValueError('negative position')
+        time.sleep(0.2)
+        self._pos = pos
+        return self._pos
+
+
+class FakeOtt():
+
+    def __init__(self):
+        self.parabolaSlider = SlowAxis()
+        self.referenceMirrorSlider = SlowAxis()
+        self.angleRotator = SlowAxis()
+
+
+class TestMotionScheduler(unittest.TestCase):
+
+    def testConcurrentMoves(self):
+        ott = FakeOtt()
+        ms = MotionScheduler(ott)
+        t0 = time.time()
+        pos = ms.moveTo({'parabolaSlider': 844}, referenceMirrorSlider=844,
+                        angleRotator=30)
+        self.assertLess(time.time() - t0, 0.5)
+        self.assertEqual(pos, {'parabolaSlider': 844,
+                               'referenceMirrorSlider': 844,
+                               'angleRotator': 30})
+        ms.close()
+
+    def testErrors(self):
+        ott = FakeOtt()
+        ms = MotionScheduler(ott)
+        self.assertRaises(ValueError, ms.moveTo, slider=3)
+        self.assertRaises(ValueError, ms.moveTo, parabolaSlider=-1, angleRotator=60)
+        self.assertEqual(ott.angleRotator._pos, 60)
+        ms.close()
+
+    def testClose(self):
+        ott = FakeOtt()
+        with MotionScheduler(ott) as ms:
+            futures = ms.submit(angleRotator=30)
+        self.assertTrue(futures['angleRotator'].done())
+        self.assertEqual(ott.angleRotator._pos, 30)
+        self.assertRaises(RuntimeError, ms.moveTo, angleRotator=60)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,6 +4,12 @@ Authors
 '''
 import unittest
 import mock
+import numpy as np
+from opcua import ua
+
+
+def _dataValues(values):
+    return [ua.DataValue(ua.Variant(value)) for value in values]
 
 
 class TestOpcUaController(unittest.TestCase):
@@ -13,6 +19,8 @@ class TestOpcUaController(unittest.TestCase):
         from m4.devices.opc_ua_controller import OpcUaController
         self.opc = OpcUaController()
         self.client = mock.MagicMock()
+        self.client.uaclient.get_attributes.side_effect = \
+            lambda nodeids, attr: _dataValues([0.] * len(nodeids))
         self.opc._client = self.client
 
     def tearDown(self):
@@ -34,18 +42,164 @@ class TestOpcUaController(unittest.TestCase):
         self.opc.stop()
         self.client.connect.assert_called_with()
         self.client.get_node.assert_called_with(self.opc.STOP_NODE)
-        self.client.disconnect.assert_called_with()
+        self.client.disconnect.assert_not_called()
 
     def testGetTemperatureVector(self):
         self.opc.get_temperature_vector()
         self.client.connect.assert_called_with()
         self.client.get_node.assert_called_with(self.opc.TEMPERATURE_NODE)
-        self.client.disconnect.assert_called_with()
+        self.client.disconnect.assert_not_called()
 
     def testGetPosition(self):
         self.opc.get_position(42)
         self.client.connect.assert_called_with()
         self.client.get_node.assert_called_with(
             "ns=7;s=MAIN.Drivers_input.f_PosAct[42]")
-        self.client.disconnect.assert_called_with()
+        self.client.disconnect.assert_not_called()
+
+
+    def testSessionIsKeptOpen(self):
+        self.client.uaclient.get_attributes.side_effect = \
+            lambda nodeids, attr: _dataValues([False] * len(nodeids))
+        self.opc.get_position(3)
+        self.opc.get_position(4)
+        self.opc.wait_for_stop(4)
+        self.client.connect.assert_called_once_with()
+        self.opc.disconnect()
+        self.client.disconnect.assert_called_once_with()
+
+    def testVariablesPositionsInOneRead(self):
+        from m4.configuration.ott_parameters import OpcUaParameters
+        nvar = len(OpcUaParameters.zabbix_variables_name)
+        self.client.uaclient.get_attributes.side_effect = \
+            lambda nodeids, attr: _dataValues(range(len(nodeids)))
+        pos = self.opc.get_variables_positions()
+        self.assertEqual(self.client.uaclient.get_attributes.call_count, 1)
+        np.testing.assert_array_equal(pos, np.arange(nvar))
+
+    def testReconnectOnFailure(self):
+        self.client.uaclient.get_attributes.side_effect = [
+            _dataValues([1.]), ConnectionResetError(), _dataValues([2.5]),
+            ua.UaStatusCodeError(ua.StatusCodes.BadSessionIdInvalid),
+            _dataValues([3.5])]
+        self.opc.get_position(1)
+        self.assertEqual(self.opc.get_position(1), 2.5)
+        self.assertEqual(self.opc.get_position(1), 3.5)
+        self.assertEqual(self.client.connect.call_count, 3)
+        self.assertEqual(self.client.disconnect.call_count, 2)
+
+    def testBadStatusIsRaisedWithoutReconnecting(self):
+        results = _dataValues([1., 2.])
+        results[1].StatusCode = ua.StatusCode(ua.StatusCodes.BadNodeIdUnknown)
+        self.client.uaclient.get_attributes.side_effect = None
+        self.client.uaclient.get_attributes.return_value = results
+        self.assertRaises(ua.UaStatusCodeError, self.opc.get_positions, [1, 2])
+        self.client.uaclient.get_attributes.side_effect = \
+            ua.UaStatusCodeError(ua.StatusCodes.BadTypeMismatch)
+        self.assertRaises(ua.UaStatusCodeError, self.opc.get_position, 1)
+        self.client.connect.assert_called_once_with()
+        self.client.disconnect.assert_not_called()
+
+    def testWriteUsesCachedType(self):
+        self.client.uaclient.set_attributes.return_value = []
+        self.opc.move_object(2)
+        self.opc.move_object(2)
+        node = self.client.get_node.return_value
+        self.assertEqual(node.get_data_type_as_variant_type.call_count, 1)
+        self.assertEqual(self.client.uaclient.set_attributes.call_count, 2)
+
+    def _setUpSubscription(self):
+        values = {}
+        self.client.get_node.side_effect = lambda node_id: mock.MagicMock(nodeid=node_id)
+        self.client.uaclient.get_attributes.side_effect = \
+            lambda nodeids, attr: _dataValues([values[n] for n in nodeids])
+        self.client.uaclient.set_attributes.return_value = []
+        return values
+
+    def _notify(self, node_id, value):
+        handler = self.client.create_subscription.call_args[0][1]
+        handler.datachange_notification(mock.MagicMock(nodeid=node_id), value, None)
+
+    def testWaitForStopAsync(self):
+        values = self._setUpSubscription()
+        node_id = self.opc.MOVE_NODE % 2
+        values[node_id] = True
+        future = self.opc.wait_for_stop_async(2)
+        self.assertFalse(future.done())
+        self._notify(node_id, True)
+        self.assertFalse(future.done())
+        self._notify(node_id, False)
+        self.assertFalse(future.result(timeout=1))
+        values[node_id] = False
+        self.opc.wait_for_stop(2, timeout=1)
+        self.assertEqual(self.client.create_subscription.call_count, 1)
+
+    def testWaitForPositionTimeout(self):
+        import concurrent.futures
+        values = self._setUpSubscription()
+        node_id = self.opc.POSITION_NODE % 4
+        values[node_id] = 0.
+        future = self.opc.wait_for_position_async(4, 10., 0.1, timeout=0.05)
+        self.assertRaises(concurrent.futures.TimeoutError, future.result, 1)
+        future = self.opc.wait_for_position_async(4, 10., 0.1)
+        self._notify(node_id, 9.95)
+        self.assertEqual(future.result(timeout=1), 9.95)
+
+    def testWaitForStopDefaultTimeout(self):
+        import concurrent.futures
+        values = self._setUpSubscription()
+        values[self.opc.MOVE_NODE % 2] = True
+        self.opc.STOP_TIMEOUT = 0.05
+        self.assertRaises(concurrent.futures.TimeoutError, self.opc.wait_for_stop, 2)
+
+    def testResubscribeOnReconnect(self):
+        values = self._setUpSubscription()
+        node_id = self.opc.MOVE_NODE % 2
+        values[node_id] = True
+        future = self.opc.wait_for_stop_async(2)
+        subscription = self.client.create_subscription.return_value
+        self.assertEqual(subscription.subscribe_data_change.call_count, 1)
+        read = self.client.uaclient.get_attributes.side_effect
+        errors = [ConnectionResetError()]
+
+        def failOnce(nodeids, attr):
+            if errors:
+                raise errors.pop()
+            return read(nodeids, attr)
+        self.client.uaclient.get_attributes.side_effect = failOnce
+        values[self.opc.POSITION_NODE % 1] = 1.
+        self.assertEqual(self.opc.get_position(1), 1.)
+        self.assertEqual(self.client.connect.call_count, 2)
+        self.assertEqual(self.client.create_subscription.call_count, 2)
+        self.assertEqual(subscription.subscribe_data_change.call_count, 2)
+        self.assertFalse(future.done())
+        self._notify(node_id, False)
+        self.assertFalse(future.result(timeout=1))
+
+    def testPollingWithoutNotifications(self):
+        values = self._setUpSubscription()
+        node_id = self.opc.MOVE_NODE % 3
+        values[node_id] = True
+        self.opc.WATCH_POLL_PERIOD = 0.02
+        future = self.opc.wait_for_stop_async(3)
+        self.assertFalse(future.done())
+        values[node_id] = False
+        self.assertFalse(future.result(timeout=1))
+
+    def testPositionMustSettle(self):
+        import time
+        values = self._setUpSubscription()
+        node_id = self.opc.POSITION_NODE % 4
+        values[node_id] = 0.
+        future = self.opc.wait_for_position_async(4, 10., 0.1, dwell=0.2)
+        self._notify(node_id, 9.95)
+        time.sleep(0.1)
+        self._notify(node_id, 9.98)
+        time.sleep(0.15)
+        self.assertFalse(future.done())
+        self._notify(node_id, 10.5)
+        time.sleep(0.25)
+        self.assertFalse(future.done())
+        self._notify(node_id, 10.02)
+        self.assertEqual(future.result(timeout=1), 10.02)
 
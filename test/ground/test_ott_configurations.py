@@ -46,3 +46,4 @@ class TestCalc(unittest.TestCase):
         oc.move_to_central_view(False)
         segment_view, rm_in = oc.get_configuration()
         self.assertEqual(rm_in, False)
+        oc.close()
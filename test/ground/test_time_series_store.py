@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from astropy.io import fits as pyfits
+from m4.ground import time_series_store
+from m4.ground.time_series_store import TimeSeriesStore, readTimeSeries
+
+
+class TestTimeSeriesStore(unittest.TestCase):
+
+    def setUp(self):
+        self._folder = tempfile.mkdtemp()
+        self._fileName = os.path.join(self._folder, time_series_store.FILE_NAME)
+
+    def tearDown(self):
+        shutil.rmtree(self._folder)
+
+    def testIncrementalRead(self):
+        zern = np.random.rand(5, 11)
+        temp = np.random.rand(5, 3)
+        with TimeSeriesStore(self._fileName) as store:
+            for i in range(3):
+                store.append(zernike=zern[i], temperature=list(temp[i]))
+            np.testing.assert_array_equal(readTimeSeries(self._fileName, 'zernike'),
+                                          zern[:3])
+            for i in range(3, 5):
+                store.append(zernike=zern[i], temperature=temp[i])
+            new = readTimeSeries(self._fileName, 'temperature', start=3)
+            np.testing.assert_array_equal(new, temp[3:])
+            self.assertEqual(len(store), 5)
+            self.assertRaises(KeyError, store.append, zernike=zern[0])
+            store.toFits(self._folder)
+        np.testing.assert_array_equal(
+            time_series_store.readSeriesOrFits(self._folder, 'zernike', 1), zern[1:])
+        os.remove(self._fileName)
+        np.testing.assert_array_equal(
+            time_series_store.readSeriesOrFits(self._folder, 'temperature'), temp)
+        np.testing.assert_array_equal(
+            pyfits.getdata(os.path.join(self._folder, 'zernike.fits')), zern)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+from m4.ground.tracking_number_catalog import TrackingNumberCatalog
+
+
+class TestTrackingNumberCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        for folder, tn in [('OPDImages', '20240101_100000'),
+                           ('OPDImages', '20240101_110000'),
+                           ('OPDImages', '20240101_120000'),
+                           ('Noise', '20240102_100000_noise')]:
+            path = os.path.join(self._root, folder, tn)
+            os.makedirs(path)
+            for i in range(3):
+                open(os.path.join(path, '%d.4D' % i), 'w').close()
+        self._cat = TrackingNumberCatalog(self._root)
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+    def testRebuildAndLookup(self):
+        self.assertEqual(self._cat.rebuild(), 4)
+        rows = self._cat.lookup('20240101_110000')
+        self.assertEqual(len(rows), 1)
+        tn, folder, path, nfiles, first, last = rows[0]
+        self.assertEqual(folder, 'OPDImages')
+        self.assertEqual(path, os.path.join(self._root, 'OPDImages', tn))
+        self.assertEqual(nfiles, 3)
+        self.assertLessEqual(first, last)
+        self.assertEqual(self._cat.findFolder('20240102_100000_noise'), 'Noise')
+        self.assertIsNone(self._cat.findPath('20991231_000000'))
+
+    def testNewFoldersAreFound(self):
+        self._cat.rebuild()
+        path = os.path.join(self._root, 'Noise', '20240103_100000')
+        os.makedirs(path)
+        self.assertEqual(self._cat.findPath('20240103_100000'), path)
+        shutil.rmtree(path)
+        self.assertIsNone(self._cat.findPath('20240103_100000'))
+
+    def testStatsAreRefreshed(self):
+        path = os.path.join(self._root, 'Noise', '20240104_100000')
+        os.makedirs(path)
+        self._cat.add(path)
+        self.assertEqual(self._cat.lookup('20240104_100000')[0][3], 0)
+        open(os.path.join(path, '0.fits'), 'w').close()
+        os.utime(path, (1e9, 1e9))
+        tn, folder, path, nfiles, first, last = self._cat.lookup('20240104_100000')[0]
+        self.assertEqual(nfiles, 1)
+        self.assertIsNotNone(first)
+
+    def testScan(self):
+        self._cat.add(os.path.join(self._root, 'OPDImages', '20240101_100000'))
+        tnlist = self._cat.scan('20240101_100000', '20240101_120000')
+        self.assertEqual(tnlist, ['20240101_100000', '20240101_110000',
+                                  '20240101_120000'])
+        tnlist = self._cat.scan('20240101_110000', '20240101_120000')
+        self.assertEqual(tnlist, ['20240101_110000', '20240101_120000'])
+
+    def testScanListsTheFolderOnlyWhenChanged(self):
+        folder = 'OPDImages'
+        self._cat.rebuild()
+        with mock.patch.object(self._cat, 'sync', wraps=self._cat.sync) as sync:
+            for i in range(3):
+                tnlist = self._cat.scan('20240101', '20240101_2', folder)
+            self.assertEqual(len(tnlist), 3)
+            sync.assert_not_called()
+            os.makedirs(os.path.join(self._root, folder, '20240101_130000'))
+            os.utime(os.path.join(self._root, folder), (1e9, 1e9))
+            tnlist = self._cat.scan('20240101', '20240101_2', folder)
+            self.assertEqual(tnlist[-1], '20240101_130000')
+            tnlist = self._cat.scan('20240101', '20240101_2', folder)
+            self.assertEqual(sync.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,217 @@
+'''
+Tests of timehistory: the spectral functions are compared with the
+implementations they replaced
+'''
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import mock
+import numpy as np
+import scipy.fft
+import scipy.ndimage
+import scipy.stats as stats
+from test import test_helper
+os.environ.setdefault('PYOTTCONF', os.path.join(
+    test_helper.testDataRootDir(), 'base', 'Configurations', 'testConf.yaml'))
+from m4.ground import geo
+from m4.ground import read_data
+from m4.mini_OTT import timehistory as th
+
+
+def _oldCompPsd(imgin, nbins=None, norm='backward', d=1, sigma=None,
+                crop=True):
+    ''' comp_psd before PsdEngine, without prints and plots '''
+    if crop:
+        cir = geo.qpupil(-1*imgin.mask+1)
+        cir = np.array(cir[0:3]).astype(int)
+        img = imgin.data[cir[0]-cir[2]:cir[0]+cir[2], cir[1]-cir[2]:cir[1]+cir[2]]
+        m = imgin.mask[cir[0]-cir[2]:cir[0]+cir[2], cir[1]-cir[2]:cir[1]+cir[2]]
+        img = np.ma.masked_array(img, m)
+    else:
+        img = imgin.copy()
+    sx = (np.shape(img))[0]
+    if nbins is None:
+        nbins = sx//2
+    img = img-np.mean(img)
+    mask = np.invert(img.mask)
+    img[mask == 0] = 0
+    if sigma is not None:
+        img = scipy.ndimage.fourier_gaussian(img, sigma=sigma)
+    tf2d = scipy.fft.fft2(img, norm=norm)
+    tf2d[0, 0] = 0
+    tf2d_power_spectrum = np.abs(tf2d)**2
+    kfreq = np.fft.fftfreq(sx, d=d)
+    kfreq2D = np.meshgrid(kfreq, kfreq)
+    knrm = np.sqrt(kfreq2D[0]**2 + kfreq2D[1]**2)
+    fmask = knrm < np.max(kfreq)
+    knrm = knrm[fmask].flatten()
+    fourier_amplitudes = tf2d_power_spectrum[fmask].flatten()
+    Abins, x_edges, y_edges = stats.binned_statistic(knrm, fourier_amplitudes,
+                                                     statistic="sum",
+                                                     bins=nbins)
+    fout = kfreq[0:sx//2]
+    Aout = Abins/np.sum(mask)
+    return fout, Aout
+
+
+def _oldCompFilteredImage(imgin, d=1, freq2filter=None):
+    ''' comp_filtered_image before BandPassFilter, without prints and
+    plots '''
+    img = imgin.copy()
+    sx = (np.shape(img))[0]
+    mask = np.invert(img.mask)
+    img[mask == 0] = 0
+    norm = 'ortho'
+    tf2d = scipy.fft.fft2(img.data, norm=norm)
+    kfreq = np.fft.fftfreq(sx, d=d)
+    kfreq2D = np.meshgrid(kfreq, kfreq)
+    knrm = np.sqrt(kfreq2D[0]**2 + kfreq2D[1]**2)
+    fmask1 = 1.0 * (knrm > np.max(kfreq))
+    if freq2filter is None:
+        fmin = -1
+        fmax = np.max(kfreq)
+    else:
+        fmin, fmax = freq2filter
+    fmask2 = 1.0*(knrm > fmax)
+    fmask3 = 1.0*(knrm < fmin)
+    fmask = (fmask1+fmask2+fmask3) > 0
+    tf2d_filtered = tf2d.copy()
+    tf2d_filtered[fmask] = 0
+    imgf = scipy.fft.ifft2(tf2d_filtered, norm=norm)
+    return np.ma.masked_array(np.real(imgf), mask=imgin.mask)
+
+
+def _pupilImage(size):
+    rng = np.random.default_rng(size)
+    yy, xx = np.mgrid[0:size, 0:size]
+    c = (size - 1) / 2.
+    mask = (xx - c)**2 + (yy - c)**2 > (0.4 * size)**2
+    return np.ma.masked_array(rng.normal(size=(size, size)), mask)
+
+
+class TestPsdEngine(unittest.TestCase):
+
+    def testCompPsdMatchesOld(self):
+        for size in (100, 101):
+            img = _pupilImage(size)
+            for crop in (True, False):
+                for sigma in (None, 2.):
+                    fout, aout = th.comp_psd(img, d=0.5, sigma=sigma,
+                                             crop=crop, verbose=True)
+                    fold, aold = _oldCompPsd(img, d=0.5, sigma=sigma,
+                                             crop=crop)
+                    np.testing.assert_allclose(fout, fold)
+                    np.testing.assert_allclose(aout, aold, rtol=1e-10,
+                                               atol=1e-12 * aold.max())
+
+    def testPsdMatchesOld(self):
+        for size in (100, 101):
+            img = _pupilImage(size)
+            for crop in (True, False):
+                pe = th.PsdEngine(d=0.5, crop=crop)
+                fout, aout = pe.psd(img)
+                fold, aold = _oldCompPsd(img, d=0.5, crop=crop)
+                np.testing.assert_allclose(fout, fold)
+                np.testing.assert_allclose(aout, aold, rtol=1e-10,
+                                           atol=1e-12 * aold.max())
+
+    def testBinnedSpectrumIsNotNormalized(self):
+        img = _pupilImage(64)
+        pe = th.PsdEngine(crop=False)
+        fout, abins, data = pe.binnedSpectrum(img)
+        nvalid = np.sum(np.invert(img.mask))
+        np.testing.assert_allclose(abins / nvalid, pe.psd(img)[1])
+        self.assertTrue(np.all(data[img.mask] == 0))
+
+
+class TestBandPassFilter(unittest.TestCase):
+
+    def testCompFilteredImageMatchesOld(self):
+        for size in (100, 101):
+            img = _pupilImage(size)
+            for freq2filter in (None, (0.05, 0.4), (0.1, 2.)):
+                imgout = th.comp_filtered_image(img, d=0.5,
+                                                freq2filter=freq2filter)
+                imgold = _oldCompFilteredImage(img, d=0.5,
+                                               freq2filter=freq2filter)
+                np.testing.assert_array_equal(imgout.mask, imgold.mask)
+                np.testing.assert_allclose(imgout.data, imgold.data,
+                                           rtol=0, atol=1e-14)
+
+    def testFilterCubeMatchesOld(self):
+        for size in (100, 101):
+            cube = np.ma.masked_array([_pupilImage(size + i)[:size, :size]
+                                       for i in range(3)])
+            bp = th.BandPassFilter((size, size), d=0.5,
+                                   freq2filter=(0.05, 0.4), dtype=float)
+            cubeout = bp.filterCube(cube, chunk_size=2)
+            for i in range(3):
+                imgold = _oldCompFilteredImage(cube[i], d=0.5,
+                                               freq2filter=(0.05, 0.4))
+                np.testing.assert_array_equal(cubeout[i].mask, imgold.mask)
+                np.testing.assert_allclose(cubeout[i].data, imgold.data,
+                                           rtol=0, atol=1e-14)
+
+    def testWrongShapeRaises(self):
+        bp = th.BandPassFilter((10, 10))
+        self.assertRaises(ValueError, bp.filter,
+                          np.ma.masked_array(np.zeros((12, 12))))
+
+
+class TestTrackingNumbers(unittest.TestCase):
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        for tn in ('20240101_100000', '20240101_110000', '20240102_100000'):
+            os.makedirs(os.path.join(self._root, 'OPDImages', tn))
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+    def testFallbackWithoutCatalog(self):
+        error = sqlite3.OperationalError('unable to open database file')
+        with mock.patch.object(th, 'a', self._root + '/'), \
+                mock.patch.object(th.foldname, 'OPT_DATA_FOLDER', self._root), \
+                mock.patch.object(th.tnc, 'catalog', side_effect=error):
+            self.assertEqual(th.findTracknum('20240101_110000'), 'OPDImages')
+            self.assertIsNone(th.findTracknum('20991231_000000'))
+            self.assertEqual(th.tnscan('20240101_100000', '20240101_2'),
+                             ['20240101_100000', '20240101_110000'])
+
+
+class TestAverageFrames(unittest.TestCase):
+
+    def setUp(self):
+        self._folder = tempfile.mkdtemp()
+        self._fileList = []
+        for i in range(4):
+            img = _pupilImage(32)
+            file_name = os.path.join(self._folder, '%d.fits' % i)
+            read_data.saveMaskedImage(file_name, img)
+            self._fileList.append(file_name)
+
+    def tearDown(self):
+        shutil.rmtree(self._folder)
+
+    def testAllFramesRejected(self):
+        self.assertRaisesRegex(ValueError, 'no frame accepted',
+                               th.averageFrames, 0, 3, self._fileList,
+                               thresh=32 * 32 + 1)
+        self.assertRaises(ValueError, th.RunningAverage().std)
+        aveimg = th.averageFrames(0, 3, self._fileList, thresh=100)
+        self.assertEqual(aveimg.shape, (32, 32))
+
+    def testReadPhasemapBothLayouts(self):
+        img = _pupilImage(32)
+        for compress in (False, True):
+            file_name = os.path.join(self._folder, 'c%d.fits' % compress)
+            read_data.saveMaskedImage(file_name, img, compress)
+            imgout = th.read_phasemap(file_name)
+            np.testing.assert_array_equal(imgout.mask, img.mask)
+            np.testing.assert_array_equal(imgout.data, img.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+'''
+Authors
+  - C. Selmi:  written in 2023
+'''
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from m4.utils.svd_reconstructor import SvdReconstructor
+
+
+class TestSvdReconstructor(unittest.TestCase):
+
+    def setUp(self):
+        self.int_mat = np.random.rand(300, 20)
+        self.svd = SvdReconstructor(self.int_mat)
+
+    def testReconstructor(self):
+        np.testing.assert_allclose(self.svd.reconstructor(),
+                                   np.linalg.pinv(self.int_mat), atol=1e-10)
+        wf = np.random.rand(300, 3)
+        np.testing.assert_allclose(self.svd.solve(wf, n_modes=10),
+                                   np.dot(self.svd.reconstructor(n_modes=10), wf),
+                                   atol=1e-10)
+        alpha = 0.5
+        a = self.int_mat
+        expected = np.linalg.solve(np.dot(a.T, a) + alpha**2 * np.eye(20),
+                                   np.dot(a.T, wf[:, 0]))
+        np.testing.assert_allclose(self.svd.solve(wf[:, 0], tikhonov=alpha),
+                                   expected, atol=1e-10)
+
+    def testUpdate(self):
+        keep = np.ones(300, dtype=bool)
+        keep[[3, 50, 51]] = False
+        new_mat = np.vstack((self.int_mat[keep][:100], np.random.rand(1, 20),
+                             self.int_mat[keep][100:], np.random.rand(1, 20)))
+        added = np.zeros(new_mat.shape[0], dtype=bool)
+        added[[100, -1]] = True
+        svd = self.svd.update(new_mat, keep, added)
+        np.testing.assert_allclose(svd.singularValues,
+                                   np.linalg.svd(new_mat, compute_uv=False))
+        wf = np.random.rand(new_mat.shape[0])
+        np.testing.assert_allclose(svd.solve(wf),
+                                   np.dot(np.linalg.pinv(new_mat), wf),
+                                   atol=1e-8)
+        np.testing.assert_allclose(svd.reconstructor(),
+                                   np.linalg.pinv(new_mat), atol=1e-8)
+
+    def testUpdateIllConditioned(self):
+        u, r = np.linalg.qr(np.random.randn(300, 20))
+        v, r = np.linalg.qr(np.random.randn(20, 20))
+        int_mat = np.dot(u * np.logspace(0, -10, 20), v.T)
+        keep = np.ones(300, dtype=bool)
+        keep[[7, 8, 120]] = False
+        svd = SvdReconstructor(int_mat)
+        for i in range(3):
+            new_mat = int_mat[keep]
+            svd = svd.update(new_mat, keep)
+            int_mat = new_mat
+            keep = np.ones(new_mat.shape[0], dtype=bool)
+            keep[[10 + i, 200 + i]] = False
+        wf = np.dot(int_mat, np.random.rand(20))
+        expected = np.dot(np.linalg.pinv(int_mat, rcond=1e-15), wf)
+        err = np.linalg.norm(svd.solve(wf) - expected) / np.linalg.norm(expected)
+        self.assertLess(err, 1e-5)
+
+    def testSaveAndLoad(self):
+        folder = tempfile.mkdtemp()
+        file_name = os.path.join(folder, 'svd.fits')
+        self.svd.save(file_name)
+        svd = SvdReconstructor.load(file_name, self.int_mat)
+        np.testing.assert_allclose(svd.reconstructor(),
+                                   self.svd.reconstructor(), atol=1e-10)
+        shutil.rmtree(folder)